@@ -0,0 +1,78 @@
+import abc
+from typing import Iterable
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from domain import model
+from adapters import orm
+from adapters import repository
+
+
+class AbstractAsyncRepository(abc.ABC):
+    def __init__(self):
+        self.seen: set[model.Product] = set()
+
+    def add(self, product: model.Product):
+        self._add(product)
+        self.seen.add(product)
+
+    async def get(self, sku: str) -> Optional[model.Product]:
+        product = await self._get(sku)
+        if product is not None:
+            self.seen.add(product)
+        return product
+
+    async def get_many(self, skus: Iterable[str]) -> list[model.Product]:
+        products = await self._get_many(skus)
+        self.seen.update(products)
+        return products
+
+    @abc.abstractmethod
+    async def availability(self, sku: str) -> tuple[model.BatchAvailability, ...]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _add(self, product: model.Product):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def _get(self, sku: str) -> Optional[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def _get_many(self, skus: Iterable[str]) -> list[model.Product]:
+        raise NotImplementedError
+
+
+class AsyncSqlAlchemyRepository(AbstractAsyncRepository):
+    def __init__(self, session: AsyncSession):
+        super().__init__()
+        self.session = session
+
+    def _select(self):
+        return select(model.Product).options(
+            selectinload(model.Product.batches).selectinload(model.Batch._allocations)
+        )
+
+    def _add(self, product: model.Product):
+        self.session.add(product)
+
+    async def _get(self, sku: str) -> Optional[model.Product]:
+        result = await self.session.execute(
+            self._select().where(orm.products.c.sku == sku)
+        )
+        return result.scalars().one_or_none()
+
+    async def _get_many(self, skus: Iterable[str]) -> list[model.Product]:
+        result = await self.session.execute(
+            self._select().where(orm.products.c.sku.in_(set(skus)))
+        )
+        return list(result.scalars())
+
+    async def availability(self, sku: str) -> tuple[model.BatchAvailability, ...]:
+        return await self.session.run_sync(
+            lambda session: repository.SqlAlchemyRepository(session).availability(sku)
+        )
@@ -0,0 +1,47 @@
+"""Streaming readers for purchase-order files of new batches.
+
+Both readers yield ``(line_number, row)`` pairs one at a time, where a row is a
+dict with ``reference``, ``sku``, ``quantity`` and ``eta`` entries as found in
+the file, or None for a JSON line that is not an object. Validating rows is up
+to the caller.
+"""
+
+import csv
+import json
+from typing import IO
+from typing import Iterator
+from typing import Optional
+
+FORMATS = ("csv", "jsonl")
+
+Row = tuple[int, Optional[dict]]
+
+
+def read_csv(f: IO[str]) -> Iterator[Row]:
+    reader = csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(f: IO[str]) -> Iterator[Row]:
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def format_for(path: str) -> str:
+    suffix = path.rsplit(".", 1)[-1].lower()
+    if suffix in ("jsonl", "ndjson"):
+        return "jsonl"
+    return "csv"
+
+
+def read_batches(f: IO[str], format: str) -> Iterator[Row]:
+    if format not in FORMATS:
+        raise ValueError(f"Unknown batch file format {format}")
+    return read_csv(f) if format == "csv" else read_jsonl(f)
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+from typing import Generic
+from typing import Hashable
+from typing import Iterable
+from typing import Optional
+from typing import TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        # bumped by invalidate(), only for keys with a load in flight
+        self._generations: dict[K, int] = {}
+        self._loading: dict[K, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, key: K) -> tuple[bool, V]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._entries[key]
+        self.misses += 1
+        return False, None  # type: ignore
+
+    def _store(self, key: K, value: V) -> None:
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            found, value = self._lookup(key)
+        return value if found else None
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def put_if_absent(self, key: K, value: V) -> Optional[V]:
+        """Stores the value unless the key holds one already, which it returns."""
+        with self._lock:
+            found, current = self._lookup(key)
+            if found:
+                return current
+            self._store(key, value)
+        return None
+
+    def _start_loading(self, key: K) -> int:
+        self._loading[key] = self._loading.get(key, 0) + 1
+        return self._generations.get(key, 0)
+
+    def _stop_loading(self, key: K) -> None:
+        self._loading[key] -= 1
+        if not self._loading[key]:
+            del self._loading[key]
+            self._generations.pop(key, None)
+
+    def get_or_load(self, key: K, loader: Callable[[], V]) -> V:
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            generation = self._start_loading(key)
+        try:
+            value = loader()
+            with self._lock:
+                # an invalidation while we were loading means the value may be stale
+                if self._generations.get(key, 0) == generation:
+                    self._store(key, value)
+        finally:
+            with self._lock:
+                self._stop_loading(key)
+        return value
+
+    def get_many_or_load(
+        self,
+        keys: Iterable[K],
+        loader: Callable[[list[K]], dict[K, V]],
+    ) -> dict[K, V]:
+        found: dict[K, V] = {}
+        generations: dict[K, int] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                hit, value = self._lookup(key)
+                if hit:
+                    found[key] = value
+                else:
+                    generations[key] = self._start_loading(key)
+        if not generations:
+            return found
+        try:
+            loaded = loader(list(generations))
+            with self._lock:
+                for key, value in loaded.items():
+                    if self._generations.get(key, 0) == generations.get(key):
+                        self._store(key, value)
+        finally:
+            with self._lock:
+                for key in generations:
+                    self._stop_loading(key)
+        found.update(loaded)
+        return found
+
+    def invalidate(self, key: K) -> None:
+        with self._lock:
+            if key in self._loading:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
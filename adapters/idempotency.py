@@ -0,0 +1,213 @@
+"""Outcomes of requests sent with an idempotency key, so that a client retrying
+a request gets the original response back instead of running it again.
+
+The key is reserved before the request runs, so that of two attempts in flight
+at the same time only the first runs; the other is told it is in progress, and
+can retry once the first has stored its outcome. Allocating the same line twice
+would otherwise allocate it twice.
+"""
+
+import abc
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timedelta
+from typing import Callable
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from adapters import orm
+from adapters.cache import LRUCache
+
+# a concurrent update is worth retrying, so its outcome is not kept
+RETRYABLE_STATUSES = {409}
+# the status of a reservation, held while the request runs
+PENDING = 102
+
+
+class KeyReused(Exception):
+    pass
+
+
+class RequestInProgress(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Outcome:
+    fingerprint: str
+    body: dict
+    status: int
+
+    @property
+    def pending(self) -> bool:
+        return self.status == PENDING
+
+
+def fingerprint(request: object) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class AbstractIdempotencyStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Outcome]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reserve(self, key: str, request_fingerprint: str) -> Optional[Outcome]:
+        """Stores a pending outcome for the key and returns None, or returns
+        the outcome, pending or not, that the key already has."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put(self, key: str, outcome: Outcome) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def release(self, key: str) -> None:
+        """Drops a pending outcome, so that the request can be sent again."""
+        raise NotImplementedError
+
+
+class InMemoryIdempotencyStore(AbstractIdempotencyStore):
+    def __init__(self, maxsize: int = 10_000, ttl: float = 86_400, **kwargs):
+        self._outcomes: LRUCache[str, Outcome] = LRUCache(
+            maxsize=maxsize, ttl=ttl, **kwargs
+        )
+
+    def get(self, key: str) -> Optional[Outcome]:
+        return self._outcomes.get(key)
+
+    def reserve(self, key: str, request_fingerprint: str) -> Optional[Outcome]:
+        return self._outcomes.put_if_absent(
+            key, Outcome(request_fingerprint, {}, PENDING)
+        )
+
+    def put(self, key: str, outcome: Outcome) -> None:
+        self._outcomes.put(key, outcome)
+
+    def release(self, key: str) -> None:
+        self._outcomes.invalidate(key)
+
+
+class SqlAlchemyIdempotencyStore(AbstractIdempotencyStore):
+    """Shares outcomes between processes. Expired rows are deleted as new ones
+    are stored, which keeps the table to about one ``ttl`` worth of requests.
+    A reservation expires after ``pending_ttl``, in case its process died."""
+
+    def __init__(
+        self,
+        session_factory,
+        ttl: float = 86_400,
+        clock: Callable[[], datetime] = datetime.utcnow,
+        pending_ttl: float = 60,
+    ):
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl)
+        self.pending_ttl = timedelta(seconds=pending_ttl)
+        self._clock = clock
+
+    def get(self, key: str) -> Optional[Outcome]:
+        keys = orm.idempotency_keys.c
+        with self.session_factory() as session:
+            row = session.execute(
+                select(keys.fingerprint, keys.body, keys.status).where(
+                    keys.key == key, keys.expires_at > self._clock()
+                )
+            ).first()
+        if row is None:
+            return None
+        return Outcome(row.fingerprint, json.loads(row.body), row.status)
+
+    def reserve(self, key: str, request_fingerprint: str) -> Optional[Outcome]:
+        while True:
+            if self._insert(key, Outcome(request_fingerprint, {}, PENDING)):
+                return None
+            stored = self.get(key)
+            # None when the row expired between the insert and the lookup
+            if stored is not None:
+                return stored
+
+    def put(self, key: str, outcome: Outcome) -> None:
+        keys = orm.idempotency_keys.c
+        with self.session_factory() as session:
+            completed = session.execute(
+                orm.idempotency_keys.update()
+                .where(keys.key == key, keys.status == PENDING)
+                .values(
+                    fingerprint=outcome.fingerprint,
+                    status=outcome.status,
+                    body=json.dumps(outcome.body),
+                    expires_at=self._clock() + self.ttl,
+                )
+            ).rowcount
+            session.commit()
+        if not completed:
+            # the reservation expired; the first outcome stored wins
+            self._insert(key, outcome)
+
+    def release(self, key: str) -> None:
+        keys = orm.idempotency_keys.c
+        with self.session_factory() as session:
+            session.execute(
+                orm.idempotency_keys.delete().where(
+                    keys.key == key, keys.status == PENDING
+                )
+            )
+            session.commit()
+
+    def _insert(self, key: str, outcome: Outcome) -> bool:
+        keys = orm.idempotency_keys.c
+        now = self._clock()
+        with self.session_factory() as session:
+            session.execute(
+                orm.idempotency_keys.delete().where(keys.expires_at <= now)
+            )
+            try:
+                session.execute(
+                    orm.idempotency_keys.insert().values(
+                        key=key,
+                        fingerprint=outcome.fingerprint,
+                        status=outcome.status,
+                        body=json.dumps(outcome.body),
+                        expires_at=now
+                        + (self.pending_ttl if outcome.pending else self.ttl),
+                    )
+                )
+                session.commit()
+            except IntegrityError:
+                # another attempt with this key got there first
+                session.rollback()
+                return False
+        return True
+
+
+def outcome_for(
+    store: AbstractIdempotencyStore,
+    key: str,
+    request_fingerprint: str,
+    run: Callable[[], tuple[dict, int]],
+) -> tuple[Outcome, bool]:
+    """Returns the stored outcome for ``key`` and True, or runs the request and
+    returns its outcome and False. Raises RequestInProgress while another
+    attempt with the same key runs."""
+    stored = store.reserve(key, request_fingerprint)
+    if stored is not None:
+        if stored.fingerprint != request_fingerprint:
+            raise KeyReused("Idempotency key already used for a different request")
+        if stored.pending:
+            raise RequestInProgress("A request with this idempotency key is running")
+        return stored, True
+    try:
+        outcome = Outcome(request_fingerprint, *run())
+    except BaseException:
+        store.release(key)
+        raise
+    if outcome.status in RETRYABLE_STATUSES:
+        store.release(key)
+    else:
+        store.put(key, outcome)
+    return outcome, False
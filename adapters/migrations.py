@@ -0,0 +1,234 @@
+"""Versioned schema migrations.
+
+``metadata.create_all`` creates missing tables but never changes existing ones,
+so changes such as new indexes are made by migrations. Each runs once, in
+version order, and is recorded in the schema_migrations table. Migrations
+that are not transactional build their indexes online: on PostgreSQL with
+CREATE INDEX CONCURRENTLY, which does not block writes to the table while it
+runs. Every statement can be run again, so an interrupted migration can simply
+be retried.
+"""
+
+from dataclasses import dataclass
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine import Engine
+
+from adapters import orm
+from adapters import read_model
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+    # False to run outside a transaction, as concurrent index builds must
+    transactional: bool = True
+
+
+def _online(connection: Connection) -> bool:
+    return (
+        connection.dialect.name == "postgresql"
+        and connection.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+    )
+
+
+def _drop_invalid_index(connection: Connection, name: str) -> None:
+    # an interrupted concurrent build leaves an invalid index behind, which
+    # IF NOT EXISTS would otherwise keep
+    invalid = connection.execute(
+        text(
+            "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid"
+            " WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+        ),
+        dict(name=name),
+    ).first()
+    if invalid:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def create_index(
+    connection: Connection,
+    name: str,
+    table: str,
+    columns: Iterable[str],
+    unique: bool = False,
+    where: Optional[str] = None,
+) -> None:
+    concurrently = _online(connection)
+    if concurrently:
+        _drop_invalid_index(connection, name)
+    connection.execute(
+        text(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX"
+            f"{' CONCURRENTLY' if concurrently else ''} IF NOT EXISTS {name}"
+            f" ON {table} ({', '.join(columns)})"
+            + (f" WHERE {where}" if where else "")
+        )
+    )
+
+
+def drop_index(connection: Connection, name: str) -> None:
+    concurrently = " CONCURRENTLY" if _online(connection) else ""
+    connection.execute(text(f"DROP INDEX{concurrently} IF EXISTS {name}"))
+
+
+def add_column(connection: Connection, table: str, column: str, type_: str) -> None:
+    if column not in {c["name"] for c in inspect(connection).get_columns(table)}:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {type_}"))
+
+
+def _create_tables(connection: Connection) -> None:
+    orm.metadata.create_all(connection)
+
+
+def _index_allocation_lookups(connection: Connection) -> None:
+    create_index(connection, "ix_batches_reference", "batches", ["reference"], True)
+    create_index(
+        connection,
+        "ix_order_lines_order_reference_sku",
+        "order_lines",
+        ["order_reference", "sku"],
+    )
+    create_index(
+        connection,
+        "ix_allocations_orderline_id",
+        "allocations",
+        ["orderline_id"],
+        unique=True,
+    )
+    create_index(connection, "ix_allocations_batch_id", "allocations", ["batch_id"])
+
+
+def _index_unpublished_outbox_rows(connection: Connection) -> None:
+    create_index(
+        connection,
+        "ix_outbox_unpublished",
+        "outbox",
+        ["id"],
+        where="published_at IS NULL",
+    )
+    drop_index(connection, "ix_outbox_published_at")
+
+
+def _add_outbox_transaction_ids(connection: Connection) -> None:
+    add_column(connection, "outbox", "transaction_id", "BIGINT")
+
+
+def _index_outbox_transaction_ids(connection: Connection) -> None:
+    create_index(connection, "ix_outbox_transaction_id", "outbox", ["transaction_id"])
+
+
+def _track_allocated_quantities(connection: Connection) -> None:
+    # existing lines are counted once; later allocations keep the count current
+    add_column(
+        connection, "batches", "_allocated_quantity", "INTEGER NOT NULL DEFAULT 0"
+    )
+    connection.execute(
+        text(
+            "UPDATE batches SET _allocated_quantity = ("
+            "SELECT COALESCE(SUM(order_lines.quantity), 0) FROM allocations"
+            " JOIN order_lines ON order_lines.id = allocations.orderline_id"
+            " WHERE allocations.batch_id = batches.id)"
+        )
+    )
+
+
+def _add_products_for_batches(connection: Connection) -> None:
+    connection.execute(
+        text(
+            "INSERT INTO products (sku, version_number)"
+            " SELECT DISTINCT sku, 0 FROM batches"
+            " WHERE sku IS NOT NULL AND sku NOT IN (SELECT sku FROM products)"
+        )
+    )
+
+
+def _index_batch_skus(connection: Connection) -> None:
+    create_index(connection, "ix_batches_sku", "batches", ["sku"])
+
+
+def _rebuild_availability(connection: Connection) -> None:
+    read_model.rebuild(connection)
+
+
+MIGRATIONS = (
+    Migration(1, "create missing tables", _create_tables),
+    Migration(
+        2,
+        "index batch references, order lines and allocations",
+        _index_allocation_lookups,
+        transactional=False,
+    ),
+    Migration(
+        3,
+        "index the outbox rows still to publish",
+        _index_unpublished_outbox_rows,
+        transactional=False,
+    ),
+    Migration(
+        4, "record the transaction of outbox rows", _add_outbox_transaction_ids
+    ),
+    Migration(
+        5,
+        "index outbox rows by transaction",
+        _index_outbox_transaction_ids,
+        transactional=False,
+    ),
+    Migration(
+        6, "count the quantity allocated from each batch", _track_allocated_quantities
+    ),
+    Migration(7, "add a product for each batch sku", _add_products_for_batches),
+    Migration(8, "index batches by sku", _index_batch_skus, transactional=False),
+    Migration(9, "rebuild the availability read model", _rebuild_availability),
+)
+
+
+def applied_versions(engine: Engine) -> set[int]:
+    orm.schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        return set(
+            connection.execute(select(orm.schema_migrations.c.version)).scalars()
+        )
+
+
+def pending(engine: Engine, migrations=MIGRATIONS) -> list[Migration]:
+    applied = applied_versions(engine)
+    return sorted(
+        (m for m in migrations if m.version not in applied), key=lambda m: m.version
+    )
+
+
+def migrate(engine: Engine, migrations=MIGRATIONS) -> list[Migration]:
+    """Applies the pending migrations and returns them. Run it from one process
+    at a time: it takes no lock against concurrent runs."""
+    applied = []
+    for migration in pending(engine, migrations):
+        if migration.transactional:
+            with engine.begin() as connection:
+                migration.upgrade(connection)
+                _record(connection, migration)
+        else:
+            with engine.connect() as connection:
+                migration.upgrade(
+                    connection.execution_options(isolation_level="AUTOCOMMIT")
+                )
+            with engine.begin() as connection:
+                _record(connection, migration)
+        applied.append(migration)
+    return applied
+
+
+def _record(connection: Connection, migration: Migration) -> None:
+    connection.execute(
+        orm.schema_migrations.insert().values(
+            version=migration.version, description=migration.description
+        )
+    )
@@ -1,24 +1,68 @@
+import sys
+from itertools import chain
+from typing import Iterable
+
+from sqlalchemy import BigInteger
 from sqlalchemy import Column
 from sqlalchemy import Date
+from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import MetaData
 from sqlalchemy import String
 from sqlalchemy import Table
+from sqlalchemy import Text
+from sqlalchemy import TypeDecorator
+from sqlalchemy import bindparam
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import nullsfirst
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import mapper
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import flag_dirty
+from sqlalchemy.orm.attributes import instance_state
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.collections import mapped_collection
 
 from domain import model
 
 metadata = MetaData()
 
+# rows per multi-row INSERT: keeps SQLite well under its limit on bound parameters
+INSERT_CHUNK_SIZE = 250
+
+
+class InternedString(TypeDecorator):
+    """A string column whose values repeat across many rows, such as the sku of
+    every line allocated to a batch: loaded rows share one string object."""
+
+    impl = String
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else sys.intern(value)
+
+
 order_lines = Table(
     "order_lines",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("order_reference", String(255)),
-    Column("sku", String(255)),
+    Column("sku", InternedString(255)),
     Column("quantity", Integer, nullable=False),
+    # the lookup behind every deallocation
+    Index("ix_order_lines_order_reference_sku", "order_reference", "sku"),
+)
+
+products = Table(
+    "products",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("version_number", Integer, nullable=False, server_default="0"),
 )
 
 batches = Table(
@@ -26,9 +70,11 @@ batches = Table(
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("reference", String(255)),
-    Column("sku", String(255)),
+    Column("sku", ForeignKey("products.sku"), index=True),
     Column("eta", Date, nullable=True),
     Column("_purchased_quantity", Integer, nullable=False),
+    Column("_allocated_quantity", Integer, nullable=False, server_default="0"),
+    Index("ix_batches_reference", "reference", unique=True),
 )
 
 
@@ -38,19 +84,224 @@ allocations = Table(
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("orderline_id", ForeignKey("order_lines.id")),
     Column("batch_id", ForeignKey("batches.id")),
+    # each allocation writes an order line row of its own
+    Index("ix_allocations_orderline_id", "orderline_id", unique=True),
+    Index("ix_allocations_batch_id", "batch_id"),
+)
+
+availability = Table(
+    "availability",
+    metadata,
+    Column("batchref", String(255), primary_key=True),
+    Column("sku", String(255), nullable=False, index=True),
+    Column("eta", Date, nullable=True),
+    Column("available_quantity", Integer, nullable=False),
+)
+
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
+    Column("published_at", DateTime, nullable=True),
+    # the writing transaction on PostgreSQL, for change streams to find rows
+    # that commit after a snapshot despite a lower id
+    Column("transaction_id", BigInteger, nullable=True),
+)
+
+# only the rows still to relay, which stay few however long the outbox grows
+Index(
+    "ix_outbox_unpublished",
+    outbox.c.id,
+    postgresql_where=outbox.c.published_at.is_(None),
+    sqlite_where=outbox.c.published_at.is_(None),
+)
+Index("ix_outbox_transaction_id", outbox.c.transaction_id)
+
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+idempotency_keys = Table(
+    "idempotency_keys",
+    metadata,
+    Column("key", String(255), primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+    Column("status", Integer, nullable=False),
+    Column("body", Text, nullable=False),
+    Column("expires_at", DateTime, nullable=False, index=True),
 )
 
 
 def start_mappers():
     lines_mapper = mapper(model.OrderLine, order_lines)
-    mapper(
+    batches_mapper = mapper(
         model.Batch,
         batches,
         properties={
+            # read through the ORM, written in bulk by write_allocation_changes
+            # in allocation order, which Batch.change_purchased_quantity relies on
             "_allocations": relationship(
                 lines_mapper,
                 secondary=allocations,
-                collection_class=set,
+                viewonly=True,
+                order_by=allocations.c.id,
+                collection_class=mapped_collection(_line_key),
+            )
+        },
+    )
+    event.listen(model.Batch._allocations, "append", receive_append, raw=True)
+    event.listen(model.Batch._allocations, "remove", receive_remove, raw=True)
+    mapper(
+        model.Product,
+        products,
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
+        properties={
+            "batches": relationship(
+                batches_mapper,
+                order_by=[nullsfirst(batches.c.eta), batches.c.id],
             )
         },
     )
+
+
+@event.listens_for(model.Product, "load")
+def receive_product_load(product, *_):
+    product.events = []
+
+
+def _line_key(line: model.OrderLine) -> tuple[str, str]:
+    return (line.order_reference, line.sku)
+
+
+def _allocation_changes(state) -> tuple[dict, set]:
+    # lines allocated to the batch, and (order_reference, sku) keys of lines
+    # removed from it, since the batch was last flushed
+    return state.info.setdefault("allocation_changes", ({}, set()))
+
+
+@event.listens_for(model.Batch, "expire", raw=True)
+def receive_expire(state, attrs):
+    # the lines are reloaded from the database, along with any changes to them
+    if attrs is None or "_allocations" in attrs:
+        state.info.pop("allocation_changes", None)
+
+
+def receive_append(state, line, initiator):
+    added, _ = _allocation_changes(state)
+    added[_line_key(line)] = line
+    flag_dirty(state.obj())
+
+
+def receive_remove(state, line, initiator):
+    added, removed = _allocation_changes(state)
+    if added.pop(_line_key(line), None) is None:
+        removed.add(_line_key(line))
+    flag_dirty(state.obj())
+
+
+def _line_row(line: model.OrderLine) -> dict:
+    return dict(
+        order_reference=line.order_reference, sku=line.sku, quantity=line.quantity
+    )
+
+
+def _insert_order_lines(connection: Connection, lines: list[model.OrderLine]):
+    statement = order_lines.insert().values([_line_row(line) for line in lines])
+    if connection.dialect.full_returning:  # type: ignore[attr-defined]
+        # ids are drawn from the sequence in row order
+        return sorted(
+            connection.execute(statement.returning(order_lines.c.id)).scalars()
+        )
+    if connection.dialect.name == "sqlite":
+        # SQLite numbers the rows of a single INSERT consecutively
+        last = connection.execute(statement).lastrowid
+        return list(range(last - len(lines) + 1, last + 1))
+    return [
+        connection.execute(
+            order_lines.insert().values(_line_row(line))
+        ).inserted_primary_key[0]
+        for line in lines
+    ]
+
+
+def insert_allocations(
+    connection: Connection, allocated: list[tuple[int, model.OrderLine]]
+) -> None:
+    """Inserts (batch id, line) pairs with one multi-row INSERT of order lines per
+    INSERT_CHUNK_SIZE lines, and one executemany of allocation rows."""
+    rows = []
+    for start in range(0, len(allocated), INSERT_CHUNK_SIZE):
+        chunk = allocated[start : start + INSERT_CHUNK_SIZE]
+        ids = _insert_order_lines(connection, [line for _, line in chunk])
+        for orderline_id, (batch_id, line) in zip(ids, chunk):
+            set_committed_value(line, "id", orderline_id)
+            rows.append(dict(orderline_id=orderline_id, batch_id=batch_id))
+    if rows:
+        connection.execute(allocations.insert(), rows)
+
+
+def _delete_allocations(connection: Connection, removed: list[dict]) -> None:
+    lines = order_lines.c
+    connection.execute(
+        allocations.delete().where(
+            allocations.c.batch_id == bindparam("batch"),
+            allocations.c.orderline_id.in_(
+                select(lines.id).where(
+                    lines.order_reference == bindparam("reference"),
+                    lines.sku == bindparam("line_sku"),
+                )
+            ),
+        ),
+        removed,
+    )
+
+
+def write_allocation_changes(
+    connection: Connection, batches: Iterable[model.Batch]
+) -> None:
+    added: list[tuple[int, model.OrderLine]] = []
+    removed: list[dict] = []
+    for batch in batches:
+        batch_added, batch_removed = instance_state(batch).info.pop(
+            "allocation_changes", ({}, ())
+        )
+        batch_id = batch.id  # type: ignore[attr-defined]
+        added.extend((batch_id, line) for line in batch_added.values())
+        removed.extend(
+            dict(batch=batch_id, reference=reference, line_sku=sku)
+            for reference, sku in batch_removed
+        )
+    # removals first: a line can be removed and allocated again before a flush
+    if removed:
+        _delete_allocations(connection, removed)
+    insert_allocations(connection, added)
+
+
+@event.listens_for(Session, "after_flush")
+def receive_after_flush(session, flush_context):
+    # only batches flagged as changed are looked at, not every one in the session
+    batches = [
+        o for o in chain(session.new, session.dirty) if isinstance(o, model.Batch)
+    ]
+    if batches:
+        write_allocation_changes(session.connection(), batches)
+        session.info.setdefault("changed_batches", set()).update(batches)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def receive_end_of_transaction(session):
+    session.info.pop("changed_batches", None)
+
+
+def pop_changed_batches(session: Session) -> set[model.Batch]:
+    """The batches flushed since the transaction began, or since the last call."""
+    return session.info.pop("changed_batches", set())
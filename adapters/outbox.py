@@ -0,0 +1,65 @@
+"""The outbox: domain events stored in the same transaction as the change
+that raised them, until a relay hands them on to other systems."""
+
+import json
+from dataclasses import asdict
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from domain import events
+from adapters import orm
+
+
+@dataclass(frozen=True)
+class Message:
+    id: int
+    type: str
+    payload: dict
+
+    def to_json(self) -> str:
+        return json.dumps({"id": self.id, "type": self.type, "payload": self.payload})
+
+
+def _encode(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {value!r}")
+
+
+def add(session, new_events: Iterable[events.Event]) -> None:
+    rows = [
+        dict(
+            event_type=type(e).__name__,
+            payload=json.dumps(asdict(e), default=_encode),
+        )
+        for e in new_events
+    ]
+    if rows:
+        insert = orm.outbox.insert()
+        if session.get_bind().dialect.name == "postgresql":
+            insert = insert.values(transaction_id=func.txid_current())
+        session.execute(insert, rows)
+
+
+def fetch_unpublished(session, limit: int) -> list[Message]:
+    # several relays can share the outbox: each locks its own batch of rows
+    rows = session.execute(
+        select(orm.outbox.c.id, orm.outbox.c.event_type, orm.outbox.c.payload)
+        .where(orm.outbox.c.published_at.is_(None))
+        .order_by(orm.outbox.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return [Message(row.id, row.event_type, json.loads(row.payload)) for row in rows]
+
+
+def mark_published(session, ids: list[int]) -> None:
+    session.execute(
+        orm.outbox.update()
+        .where(orm.outbox.c.id.in_(ids))
+        .values(published_at=func.now())
+    )
@@ -0,0 +1,46 @@
+import abc
+import threading
+from typing import Callable
+
+from adapters.outbox import Message
+
+
+class AbstractPublisher(abc.ABC):
+    @abc.abstractmethod
+    def publish(self, messages: list[Message]) -> None:
+        raise NotImplementedError
+
+
+class InMemoryPublisher(AbstractPublisher):
+    """In-process stand-in for a broker: keeps every message and hands it to
+    the subscribed handlers."""
+
+    def __init__(self):
+        self.messages: list[Message] = []
+        self._handlers: list[Callable[[Message], None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, handler: Callable[[Message], None]) -> None:
+        self._handlers.append(handler)
+
+    def publish(self, messages: list[Message]) -> None:
+        with self._lock:
+            self.messages.extend(messages)
+        for message in messages:
+            for handler in self._handlers:
+                handler(message)
+
+
+class RedisPublisher(AbstractPublisher):
+    """Publishes each message on a channel named after its event type, with any
+    client offering redis-py's ``pipeline()`` and ``publish()``."""
+
+    def __init__(self, client, prefix: str = "allocation"):
+        self.client = client
+        self.prefix = prefix
+
+    def publish(self, messages: list[Message]) -> None:
+        pipe = self.client.pipeline()
+        for message in messages:
+            pipe.publish(f"{self.prefix}:{message.type}", message.to_json())
+        pipe.execute()
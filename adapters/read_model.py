@@ -0,0 +1,45 @@
+from typing import Iterable
+
+from sqlalchemy import select
+
+from domain import model
+from adapters import orm
+
+
+def refresh(session, batches: Iterable[model.Batch]) -> None:
+    batches = list(batches)
+    if not batches:
+        return
+    session.execute(
+        orm.availability.delete().where(
+            orm.availability.c.batchref.in_([b.reference for b in batches])
+        )
+    )
+    session.execute(
+        orm.availability.insert(),
+        [
+            dict(
+                batchref=b.reference,
+                sku=b.sku,
+                eta=b.eta,
+                available_quantity=b.available_quantity,
+            )
+            for b in batches
+        ],
+    )
+
+
+def rebuild(session) -> None:
+    batches = orm.batches.c
+    session.execute(orm.availability.delete())
+    session.execute(
+        orm.availability.insert().from_select(
+            ["batchref", "sku", "eta", "available_quantity"],
+            select(
+                batches.reference,
+                batches.sku,
+                batches.eta,
+                batches._purchased_quantity - batches._allocated_quantity,
+            ),
+        )
+    )
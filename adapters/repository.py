@@ -1,33 +1,386 @@
 import abc
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
 
+from sqlalchemy import nullsfirst
+from sqlalchemy import exists
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.session import Session
 
+from domain import events
 from domain import model
+from adapters import metrics
+from adapters import orm
+from adapters import outbox
+from adapters.cache import LRUCache
+
+
+def _chunks(values: Iterable[str]) -> Iterator[list[str]]:
+    # keeps each IN (...) under SQLite's limit of 999 bound parameters
+    ordered = sorted(values)
+    for start in range(0, len(ordered), orm.INSERT_CHUNK_SIZE):
+        yield ordered[start : start + orm.INSERT_CHUNK_SIZE]
 
 
 class AbstractRepository(abc.ABC):
+    def __init__(self):
+        self.seen: set[model.Product] = set()
+        # SKUs changed by statements that bypass the session
+        self.written: set[str] = set()
+
+    def add(self, product: model.Product):
+        self._add(product)
+        self.seen.add(product)
+
+    def get(self, sku: str) -> Optional[model.Product]:
+        product = self._get(sku)
+        if product is not None:
+            self.seen.add(product)
+        return product
+
+    def get_many(self, skus: Iterable[str]) -> list[model.Product]:
+        products = self._get_many(skus)
+        self.seen.update(products)
+        return products
+
+    def get_by_batchref(self, reference: str) -> Optional[model.Product]:
+        product = self._get_by_batchref(reference)
+        if product is not None:
+            self.seen.add(product)
+        return product
+
+    def add_batches(self, batches: list[model.Batch]) -> int:
+        """Adds the batches whose reference is not stored yet, creating products
+        as needed, and returns how many were added."""
+        products = {p.sku: p for p in self.get_many({b.sku for b in batches})}
+        existing = {b.reference for p in products.values() for b in p.batches}
+        added = 0
+        for batch in batches:
+            if batch.reference in existing:
+                continue
+            product = products.get(batch.sku)
+            if product is None:
+                product = products[batch.sku] = model.Product(batch.sku, batches=[])
+                self.add(product)
+            product.add_batch(batch)
+            existing.add(batch.reference)
+            added += 1
+        return added
+
+    def allocate_set_based(self, line: model.OrderLine) -> Optional[str]:
+        """Allocates the line without handing the product to the caller, which
+        lets SQL repositories do it in the database. Returns None for an
+        unknown sku."""
+        product = self.get(line.sku)
+        if product is None:
+            return None
+        return product.allocate(line)
+
     @abc.abstractmethod
-    def add(self, batch: model.Batch):
+    def version_numbers(self, skus: Iterable[str]) -> dict[str, int]:
+        """The stored version of each product, for holders of a product to
+        tell whether another writer changed it."""
         raise NotImplementedError
 
     @abc.abstractmethod
-    def get(self, reference) -> model.Batch:
+    def availability(self, sku: str) -> tuple[model.BatchAvailability, ...]:
         raise NotImplementedError
 
+    def availability_many(
+        self, skus: Iterable[str]
+    ) -> dict[str, tuple[model.BatchAvailability, ...]]:
+        return {sku: self.availability(sku) for sku in skus}
+
     @abc.abstractmethod
-    def list(self) -> list[model.Batch]:
+    def _add(self, product: model.Product):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _get(self, sku: str) -> Optional[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _get_many(self, skus: Iterable[str]) -> list[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _get_by_batchref(self, reference: str) -> Optional[model.Product]:
         raise NotImplementedError
 
 
 class SqlAlchemyRepository(AbstractRepository):
     def __init__(self, session: Session):
+        super().__init__()
         self.session = session
 
-    def add(self, batch: model.Batch):
-        self.session.add(batch)
+    def _query(self):
+        return self.session.query(model.Product).options(
+            selectinload(model.Product.batches).selectinload(model.Batch._allocations)
+        )
+
+    def _add(self, product: model.Product):
+        self.session.add(product)
+
+    def _get(self, sku: str) -> Optional[model.Product]:
+        with metrics.span("repository.get"):
+            return self._query().filter_by(sku=sku).one_or_none()
+
+    def _get_many(self, skus: Iterable[str]) -> list[model.Product]:
+        with metrics.span("repository.get_many"):
+            return self._query().filter(orm.products.c.sku.in_(set(skus))).all()
+
+    def _get_by_batchref(self, reference: str) -> Optional[model.Product]:
+        with metrics.span("repository.get_by_batchref"):
+            return (
+                self._query()
+                .join(orm.batches)
+                .filter(orm.batches.c.reference == reference)
+                .one_or_none()
+            )
+
+    def add_batches(self, batches: list[model.Batch]) -> int:
+        # bulk Core inserts: nothing is loaded into, or tracked by, the session
+        with metrics.span("repository.add_batches"):
+            existing = self._stored(
+                orm.batches.c.reference, {b.reference for b in batches}
+            )
+            new = [b for b in batches if b.reference not in existing]
+            if not new:
+                return 0
+            skus = {b.sku for b in new}
+            self.written.update(skus)
+            known = self._stored(orm.products.c.sku, skus)
+            if skus - known:
+                self.session.execute(
+                    orm.products.insert(),
+                    [dict(sku=sku, version_number=0) for sku in sorted(skus - known)],
+                )
+            # concurrent writers holding one of these products must reload it
+            for chunk in _chunks(skus):
+                self.session.execute(
+                    orm.products.update()
+                    .where(orm.products.c.sku.in_(chunk))
+                    .values(version_number=orm.products.c.version_number + 1)
+                )
+            self.session.execute(
+                orm.batches.insert(),
+                [
+                    dict(
+                        reference=b.reference,
+                        sku=b.sku,
+                        eta=b.eta,
+                        _purchased_quantity=b._purchased_quantity,
+                        _allocated_quantity=0,
+                    )
+                    for b in new
+                ],
+            )
+            self.session.execute(
+                orm.availability.insert(),
+                [
+                    dict(
+                        batchref=b.reference,
+                        sku=b.sku,
+                        eta=b.eta,
+                        available_quantity=b._purchased_quantity,
+                    )
+                    for b in new
+                ],
+            )
+            outbox.add(
+                self.session,
+                (
+                    events.BatchCreated(
+                        b.reference, b.sku, b._purchased_quantity, b.eta
+                    )
+                    for b in new
+                ),
+            )
+            return len(new)
+
+    def version_numbers(self, skus: Iterable[str]) -> dict[str, int]:
+        products = orm.products.c
+        # the products held in memory may have changes of their own to flush
+        with self.session.no_autoflush:
+            rows = self.session.execute(
+                select(products.sku, products.version_number).where(
+                    products.sku.in_(set(skus))
+                )
+            )
+            return {row.sku: row.version_number for row in rows}
+
+    def _stored(self, column, values: set[str]) -> set[str]:
+        # the values already in the column, looked up a chunk at a time
+        stored: set[str] = set()
+        for chunk in _chunks(values):
+            stored.update(
+                self.session.execute(
+                    select(column).where(column.in_(chunk))
+                ).scalars()
+            )
+        return stored
+
+    def _first_with_room(self, line: model.OrderLine, skip_locked: bool):
+        batches = orm.batches.c
+        available = batches._purchased_quantity - batches._allocated_quantity
+        return self.session.execute(
+            select(batches.id, batches.reference)
+            .where(batches.sku == line.sku, available >= line.quantity)
+            .order_by(nullsfirst(batches.eta), batches.id)
+            .limit(1)
+            .with_for_update(skip_locked=skip_locked)
+        ).first()
+
+    def allocate_set_based(self, line: model.OrderLine) -> Optional[str]:
+        # the rules of model.allocate, applied to rows: the first batch in ETA
+        # order (warehouse stock first) with enough stock, nothing hydrated
+        batches = orm.batches.c
+        available = batches._purchased_quantity - batches._allocated_quantity
+        with metrics.span("repository.allocate_set_based"):
+            while True:
+                # batches locked by other allocations are skipped, but a batch
+                # that only they can still serve is waited for
+                batch = self._first_with_room(line, skip_locked=True)
+                if batch is None:
+                    batch = self._first_with_room(line, skip_locked=False)
+                if batch is None:
+                    if not self._has_product(line.sku):
+                        return None
+                    outbox.add(
+                        self.session,
+                        [
+                            events.OutOfStock(
+                                line.order_reference, line.sku, line.quantity
+                            )
+                        ],
+                    )
+                    raise model.OutOfStock(f"Out of stock for sku {line.sku}")
+                if self._holds(batch.id, line):
+                    break
+                # guards against a concurrent allocation where rows cannot be locked
+                updated = self.session.execute(
+                    orm.batches.update()
+                    .where(batches.id == batch.id, available >= line.quantity)
+                    .values(
+                        _allocated_quantity=batches._allocated_quantity
+                        + line.quantity
+                    )
+                ).rowcount  # type: ignore[attr-defined]
+                if updated:
+                    orm.insert_allocations(
+                        self.session.connection(), [(batch.id, line)]
+                    )
+                    break
+            self.session.execute(
+                orm.products.update()
+                .where(orm.products.c.sku == line.sku)
+                .values(version_number=orm.products.c.version_number + 1)
+            )
+            self.session.execute(
+                orm.availability.update()
+                .where(orm.availability.c.batchref == batch.reference)
+                .values(
+                    available_quantity=select(available)
+                    .where(batches.id == batch.id)
+                    .scalar_subquery()
+                )
+            )
+            outbox.add(
+                self.session,
+                [
+                    events.Allocated(
+                        line.order_reference, line.sku, line.quantity, batch.reference
+                    )
+                ],
+            )
+            self.written.add(line.sku)
+            return batch.reference
+
+    def _has_product(self, sku: str) -> bool:
+        return bool(
+            self.session.execute(
+                select(exists().where(orm.products.c.sku == sku))
+            ).scalar()
+        )
+
+    def _holds(self, batch_id: int, line: model.OrderLine) -> bool:
+        lines = orm.order_lines.c
+        return bool(
+            self.session.execute(
+                select(
+                    exists()
+                    .where(orm.allocations.c.batch_id == batch_id)
+                    .where(orm.allocations.c.orderline_id == lines.id)
+                    .where(lines.order_reference == line.order_reference)
+                    .where(lines.sku == line.sku)
+                    .where(lines.quantity == line.quantity)
+                )
+            ).scalar()
+        )
+
+    def availability(self, sku: str) -> tuple[model.BatchAvailability, ...]:
+        return self.availability_many([sku])[sku]
+
+    def availability_many(
+        self, skus: Iterable[str]
+    ) -> dict[str, tuple[model.BatchAvailability, ...]]:
+        skus = set(skus)
+        view = orm.availability.c
+        found: dict[str, list[model.BatchAvailability]] = {sku: [] for sku in skus}
+        with metrics.span("repository.availability"):
+            rows = self.session.execute(
+                select(view.batchref, view.sku, view.eta, view.available_quantity)
+                .where(view.sku.in_(skus))
+                .order_by(view.sku, nullsfirst(view.eta), view.batchref)
+            )
+            for row in rows:
+                found[row.sku].append(model.BatchAvailability(*row))
+        return {sku: tuple(batches) for sku, batches in found.items()}
+
+
+class CachingRepository(AbstractRepository):
+    """Serves availability snapshots from a shared cache, and everything else
+    from the wrapped repository."""
+
+    def __init__(
+        self,
+        repo: AbstractRepository,
+        cache: LRUCache[str, tuple[model.BatchAvailability, ...]],
+    ):
+        super().__init__()
+        self._repo = repo
+        self._cache = cache
+        # one record of what the unit of work touched, whichever repository did
+        self.seen = repo.seen
+        self.written = repo.written
+
+    def _add(self, product: model.Product):
+        self._repo.add(product)
+
+    def _get(self, sku: str) -> Optional[model.Product]:
+        return self._repo.get(sku)
+
+    def _get_many(self, skus: Iterable[str]) -> list[model.Product]:
+        return self._repo.get_many(skus)
+
+    def _get_by_batchref(self, reference: str) -> Optional[model.Product]:
+        return self._repo.get_by_batchref(reference)
+
+    def add_batches(self, batches: list[model.Batch]) -> int:
+        return self._repo.add_batches(batches)
+
+    def allocate_set_based(self, line: model.OrderLine) -> Optional[str]:
+        return self._repo.allocate_set_based(line)
+
+    def version_numbers(self, skus: Iterable[str]) -> dict[str, int]:
+        return self._repo.version_numbers(skus)
 
-    def get(self, reference: str) -> model.Batch:
-        return self.session.query(model.Batch).filter_by(reference=reference).one()
+    def availability(self, sku: str) -> tuple[model.BatchAvailability, ...]:
+        return self._cache.get_or_load(sku, lambda: self._repo.availability(sku))
 
-    def list(self) -> list[model.Batch]:
-        return self.session.query(model.Batch).all()
+    def availability_many(
+        self, skus: Iterable[str]
+    ) -> dict[str, tuple[model.BatchAvailability, ...]]:
+        return self._cache.get_many_or_load(skus, self._repo.availability_many)
@@ -0,0 +1,131 @@
+"""Queries behind the allocation export: every batch with the lines allocated
+to it, and the outbox records of changes committed since."""
+
+import json
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+from sqlalchemy import Text
+from sqlalchemy import cast
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.types import UserDefinedType
+
+from adapters import orm
+
+CHANGE_TYPES = ("BatchCreated", "BatchQuantityChanged", "Allocated", "Deallocated")
+
+
+class TxidSnapshot(UserDefinedType):
+    cache_ok = True
+
+    def get_col_spec(self, **kw) -> str:
+        return "txid_snapshot"
+
+
+def position(session) -> int:
+    """The id of the last outbox row visible to the session's transaction."""
+    return session.execute(
+        select(func.coalesce(func.max(orm.outbox.c.id), 0))
+    ).scalar()
+
+
+def transaction_snapshot(session) -> Optional[str]:
+    """The PostgreSQL snapshot of the session's transaction, such as
+    ``100:104:101,103``: transactions below 100 had ended, and 101 and 103 were
+    still running. None on databases that commit one writer at a time."""
+    if session.get_bind().dialect.name != "postgresql":
+        return None
+    return session.execute(select(cast(func.txid_current_snapshot(), Text))).scalar()
+
+
+def batch_records(session, chunk_size: int) -> Iterator[dict]:
+    """One record per batch, fetched ``chunk_size`` rows at a time through a
+    server-side cursor: memory is bounded by the chunk, not by the tables."""
+    batches, lines = orm.batches.c, orm.order_lines.c
+    rows = session.execute(
+        select(
+            batches.id,
+            batches.reference,
+            batches.sku,
+            batches.eta,
+            batches._purchased_quantity,
+            batches._allocated_quantity,
+            lines.order_reference,
+            lines.quantity,
+        )
+        .select_from(
+            orm.batches.outerjoin(orm.allocations).outerjoin(orm.order_lines)
+        )
+        .order_by(batches.id, orm.allocations.c.id),
+        execution_options=dict(stream_results=True, max_row_buffer=chunk_size),
+    )
+    return _group_by_batch(
+        row for chunk in rows.partitions(chunk_size) for row in chunk
+    )
+
+
+def _group_by_batch(rows: Iterable) -> Iterator[dict]:
+    record, batch_id = None, None
+    allocations: list[dict] = []
+    for row in rows:
+        if row.id != batch_id:
+            if record is not None:
+                yield record
+            batch_id = row.id
+            allocations = []
+            record = dict(
+                type="batch",
+                reference=row.reference,
+                sku=row.sku,
+                eta=row.eta.isoformat() if row.eta else None,
+                purchased_quantity=row._purchased_quantity,
+                allocated_quantity=row._allocated_quantity,
+                allocations=allocations,
+            )
+        if row.order_reference is not None:
+            allocations.append(
+                dict(order_reference=row.order_reference, quantity=row.quantity)
+            )
+    if record is not None:
+        yield record
+
+
+def changes_after(session, after: int, limit: int) -> list[tuple[int, str, dict]]:
+    """(id, event type, payload) of up to ``limit`` outbox rows above ``after``,
+    including rows of other event types, so that callers can spot gaps."""
+    outbox = orm.outbox.c
+    rows = session.execute(
+        select(outbox.id, outbox.event_type, outbox.payload)
+        .where(outbox.id > after)
+        .order_by(outbox.id)
+        .limit(limit)
+    )
+    return [(row.id, row.event_type, json.loads(row.payload)) for row in rows]
+
+
+def late_changes(
+    session, position: int, snapshot: str
+) -> tuple[bool, list[tuple[int, str, dict]]]:
+    """Outbox rows at or below ``position`` written by transactions that were
+    running at ``snapshot``, and committed since. The first value is True once
+    all of those transactions have ended, after which there can be no more."""
+    taken = cast(snapshot, TxidSnapshot())  # type: ignore[type-var]
+    ended = session.execute(
+        select(
+            func.txid_snapshot_xmin(func.txid_current_snapshot())
+            >= func.txid_snapshot_xmax(taken)
+        )
+    ).scalar()
+    outbox = orm.outbox.c
+    rows = session.execute(
+        select(outbox.id, outbox.event_type, outbox.payload)
+        .where(
+            outbox.id <= position,
+            outbox.transaction_id >= func.txid_snapshot_xmin(taken),
+            ~func.txid_visible_in_snapshot(outbox.transaction_id, taken),
+        )
+        .order_by(outbox.id)
+    )
+    return ended, [(row.id, row.event_type, json.loads(row.payload)) for row in rows]
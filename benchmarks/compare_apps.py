@@ -0,0 +1,63 @@
+"""Compare allocation throughput of the Flask app and the ASGI app.
+
+Both apps must be running against the same database (``make up``). Stock is
+added through the Flask app's /add_batch endpoint, then each app receives the
+same number of /allocate requests with the same number in flight.
+
+    python -m benchmarks.compare_apps --requests 2000 --concurrency 50
+"""
+
+import argparse
+import uuid
+
+import requests
+
+import config
+from benchmarks import harness
+
+
+def add_stock(api_url: str, skus: list[str], quantity: int) -> None:
+    for sku in skus:
+        r = requests.post(
+            f"{api_url}/add_batch",
+            json={
+                "reference": f"bench-{sku}",
+                "sku": sku,
+                "quantity": quantity,
+                "eta": None,
+            },
+        )
+        r.raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--skus", type=int, default=10)
+    parser.add_argument("--output", help="write the JSON report here, not stdout")
+    args = parser.parse_args()
+
+    results = {}
+    for name, url in (
+        ("flask", config.get_api_url()),
+        ("asgi", config.get_async_api_url()),
+    ):
+        skus = [f"bench-{uuid.uuid4().hex[:8]}" for _ in range(args.skus)]
+        add_stock(config.get_api_url(), skus, quantity=args.requests)
+        payloads = [
+            {
+                "order_reference": f"bench-{i}",
+                "sku": skus[i % len(skus)],
+                "quantity": 1,
+            }
+            for i in range(args.requests)
+        ]
+        results[name] = harness.http_load(
+            "POST", f"{url}/allocate", payloads, args.concurrency
+        )
+    harness.write_report("compare_apps", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Seeded synthetic warehouse data for benchmarks.
+
+The same spec and seed always produce the same products, batches and order
+lines, so runs on different commits measure the same workload.
+"""
+
+import random
+from dataclasses import asdict
+from dataclasses import dataclass
+from datetime import date
+from datetime import timedelta
+from typing import Iterator
+
+from sqlalchemy.engine import Engine
+
+from domain import model
+from adapters import orm
+from adapters import read_model
+
+
+@dataclass(frozen=True)
+class WarehouseSpec:
+    skus: int = 1000
+    batches_per_sku: int = 10
+    # share of batches already in the warehouse; the rest are shipments
+    in_stock_ratio: float = 0.3
+    # shipments arrive uniformly within this many days of ``start``
+    eta_days: int = 90
+    min_batch_quantity: int = 100
+    max_batch_quantity: int = 1000
+    # share of each batch's purchased quantity that is already allocated
+    allocation_density: float = 0.5
+    min_line_quantity: int = 1
+    max_line_quantity: int = 10
+    start: date = date(2021, 1, 1)
+    seed: int = 42
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "start": self.start.isoformat()}
+
+
+def sku_name(i: int) -> str:
+    return f"SKU-{i:06d}"
+
+
+def generate(spec: WarehouseSpec) -> Iterator[model.Product]:
+    rng = random.Random(spec.seed)
+    for i in range(spec.skus):
+        sku = sku_name(i)
+        batches = []
+        for j in range(spec.batches_per_sku):
+            eta = None
+            if rng.random() >= spec.in_stock_ratio:
+                eta = spec.start + timedelta(days=rng.randint(1, spec.eta_days))
+            quantity = rng.randint(spec.min_batch_quantity, spec.max_batch_quantity)
+            batch = model.Batch(f"{sku}-B{j:03d}", sku, quantity, eta)
+            target = int(quantity * spec.allocation_density)
+            k = 0
+            while quantity - batch.available_quantity < target:
+                line = model.OrderLine(
+                    f"{batch.reference}-O{k:05d}",
+                    sku,
+                    rng.randint(spec.min_line_quantity, spec.max_line_quantity),
+                )
+                if not batch.can_allocate(line):
+                    break
+                batch.allocate(line)
+                k += 1
+            batches.append(batch)
+        yield model.Product(sku, batches)
+
+
+def order_lines(
+    spec: WarehouseSpec, count: int, seed: int = 0
+) -> list[model.OrderLine]:
+    """New orders spread uniformly over the spec's SKUs."""
+    rng = random.Random(f"{spec.seed}-{seed}")
+    return [
+        model.OrderLine(
+            f"ORDER-{seed}-{i:07d}",
+            sku_name(rng.randrange(spec.skus)),
+            rng.randint(spec.min_line_quantity, spec.max_line_quantity),
+        )
+        for i in range(count)
+    ]
+
+
+def seed_database(
+    engine: Engine, spec: WarehouseSpec, chunk_size: int = 10_000
+) -> None:
+    """Bulk-insert the generated warehouse with Core, bypassing the ORM."""
+    tables = [orm.products, orm.batches, orm.order_lines, orm.allocations]
+    rows: dict = {table: [] for table in tables}
+    batch_id = line_id = 0
+
+    def flush(conn):
+        # parents first, so foreign keys hold after every flush
+        for table in tables:
+            if rows[table]:
+                conn.execute(table.insert(), rows[table])
+                rows[table] = []
+
+    with engine.begin() as conn:
+        for table in reversed(orm.metadata.sorted_tables):
+            conn.execute(table.delete())
+        for product in generate(spec):
+            rows[orm.products].append(dict(sku=product.sku, version_number=0))
+            for batch in product.batches:
+                batch_id += 1
+                rows[orm.batches].append(
+                    dict(
+                        id=batch_id,
+                        reference=batch.reference,
+                        sku=batch.sku,
+                        eta=batch.eta,
+                        _purchased_quantity=batch._purchased_quantity,
+                        _allocated_quantity=batch._allocated_quantity,
+                    )
+                )
+                for line in batch._allocations.values():
+                    line_id += 1
+                    rows[orm.order_lines].append(
+                        dict(
+                            id=line_id,
+                            order_reference=line.order_reference,
+                            sku=line.sku,
+                            quantity=line.quantity,
+                        )
+                    )
+                    rows[orm.allocations].append(
+                        dict(orderline_id=line_id, batch_id=batch_id)
+                    )
+            if len(rows[orm.order_lines]) >= chunk_size:
+                flush(conn)
+        flush(conn)
+        read_model.rebuild(conn)
@@ -0,0 +1,85 @@
+"""Microbenchmarks for the domain model on a generated warehouse.
+
+    python -m benchmarks.domain_bench --skus 10000 --batches-per-sku 10 \\
+        --lines 100000 --output domain.json
+"""
+
+import argparse
+
+from domain import model
+from benchmarks import datagen
+from benchmarks import harness
+
+
+def spec_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--skus", type=int, default=1000)
+    parser.add_argument("--batches-per-sku", type=int, default=10)
+    parser.add_argument("--in-stock-ratio", type=float, default=0.3)
+    parser.add_argument("--eta-days", type=int, default=90)
+    parser.add_argument("--allocation-density", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here, not stdout")
+
+
+def spec_from(args: argparse.Namespace) -> datagen.WarehouseSpec:
+    return datagen.WarehouseSpec(
+        skus=args.skus,
+        batches_per_sku=args.batches_per_sku,
+        in_stock_ratio=args.in_stock_ratio,
+        eta_days=args.eta_days,
+        allocation_density=args.allocation_density,
+        seed=args.seed,
+    )
+
+
+def run(spec: datagen.WarehouseSpec, lines: int) -> dict:
+    results = {}
+    products: dict[str, model.Product] = {}
+    results["generate"] = harness.time_once(
+        lambda: products.update((p.sku, p) for p in datagen.generate(spec))
+    )
+    batches = [b for p in products.values() for b in p.batches]
+    workload = datagen.order_lines(spec, lines)
+
+    results["BatchIndex.__init__"] = harness.time_once(
+        lambda: model.BatchIndex(batches)
+    )
+    results["Product.__init__"] = harness.time_each(
+        lambda p: model.Product(p.sku, p.batches), list(products.values())
+    )
+    # the module-level function, handed the product's batches as a plain list
+    results["model.allocate"] = harness.time_each(
+        lambda line: model.allocate(line, products[line.sku].batches),
+        workload[: len(workload) // 2],
+        expected=model.OutOfStock,
+    )
+    results["Product.allocate"] = harness.time_each(
+        lambda line: products[line.sku].allocate(line),
+        workload[len(workload) // 2 :],
+        expected=model.OutOfStock,
+    )
+    results["Product.deallocate"] = harness.time_each(
+        lambda line: products[line.sku].deallocate(line.order_reference),
+        workload,
+        expected=model.ReferenceAndSkuNotFound,
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    spec_arguments(parser)
+    parser.add_argument("--lines", type=int, default=100_000)
+    args = parser.parse_args()
+
+    spec = spec_from(args)
+    harness.write_report(
+        "domain",
+        {"spec": spec.as_dict(), "lines": args.lines},
+        run(spec, args.lines),
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
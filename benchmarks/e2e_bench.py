@@ -0,0 +1,96 @@
+"""End-to-end throughput and latency of the Flask app on a generated warehouse.
+
+The app runs in-process on an ephemeral port against either a scratch SQLite
+file or the local Postgres from docker-compose (which is wiped and reseeded).
+
+    python -m benchmarks.e2e_bench --db sqlite --skus 1000 --requests 2000
+    python -m benchmarks.e2e_bench --db postgres --skus 10000 --concurrency 32
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+from dataclasses import asdict
+
+import config
+from benchmarks import datagen
+from benchmarks import harness
+from benchmarks.domain_bench import spec_arguments
+from benchmarks.domain_bench import spec_from
+
+
+def database_uri(db: str, workdir: str) -> str:
+    if db == "sqlite":
+        return f"sqlite:///{os.path.join(workdir, 'allocation.db')}"
+    return config.get_postgres_uri()
+
+
+def run(
+    uri: str, spec: datagen.WarehouseSpec, requests: int, concurrency: int
+) -> dict:
+    # the app builds its engine at import time, from the environment
+    os.environ["DB_URI"] = uri
+    from sqlalchemy import create_engine
+    from werkzeug.serving import make_server
+
+    from adapters import orm
+    from entrypoints import flask_app
+
+    engine = create_engine(uri)
+    orm.metadata.create_all(engine)
+    results = {"seed": harness.time_once(lambda: datagen.seed_database(engine, spec))}
+
+    server = make_server("127.0.0.1", 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        lines = datagen.order_lines(spec, requests)
+        results["allocate"] = harness.http_load(
+            "POST",
+            f"{url}/allocate",
+            [asdict(line) for line in lines],
+            concurrency,
+            ok=(201, 400),
+        )
+        results["availability"] = harness.http_load(
+            "GET",
+            f"{url}/availability",
+            [{"sku": [line.sku]} for line in lines],
+            concurrency,
+        )
+        results["deallocate"] = harness.http_load(
+            "POST",
+            f"{url}/deallocate",
+            [{"order_reference": l.order_reference, "sku": l.sku} for l in lines],
+            concurrency,
+        )
+    finally:
+        server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    spec_arguments(parser)
+    parser.add_argument("--db", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    spec = spec_from(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(
+            database_uri(args.db, workdir), spec, args.requests, args.concurrency
+        )
+    params = {
+        "spec": spec.as_dict(),
+        "db": args.db,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+    }
+    harness.write_report("e2e", params, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
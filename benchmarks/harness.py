@@ -0,0 +1,121 @@
+"""Timing and reporting helpers shared by the benchmark scripts.
+
+Reports are JSON documents carrying the commit, interpreter and workload spec
+next to the numbers, so two reports can be diffed across commits.
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timezone
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+import requests
+import sqlalchemy
+
+
+def latency_stats(seconds: list[float]) -> dict:
+    ordered = sorted(seconds)
+    centiles = (
+        statistics.quantiles(ordered, n=100) if len(ordered) > 1 else ordered * 99
+    )
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 4),
+        "p50_ms": round(centiles[49] * 1000, 4),
+        "p95_ms": round(centiles[94] * 1000, 4),
+        "p99_ms": round(centiles[98] * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+def time_each(operation: Callable, inputs: Iterable, expected=()) -> dict:
+    """Time ``operation(x)`` for every input; ``expected`` exceptions still count."""
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for x in inputs:
+        t0 = time.perf_counter()
+        try:
+            operation(x)
+        except expected:
+            errors += 1
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return {
+        **latency_stats(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "ops_per_second": round(len(latencies) / elapsed, 1),
+    }
+
+
+def http_load(
+    method: str, url: str, payloads: list, concurrency: int, ok=(200, 201)
+) -> dict:
+    """Send one request per payload (JSON body, or query params for GET) with
+    ``concurrency`` requests in flight."""
+    http = requests.Session()
+    http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    key = "params" if method == "GET" else "json"
+
+    def send(payload) -> tuple[float, int]:
+        t0 = time.perf_counter()
+        r = http.request(method, url, **{key: payload})
+        return time.perf_counter() - t0, r.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, payloads))
+    elapsed = time.perf_counter() - start
+    statuses = Counter(status for _, status in results)
+    return {
+        **latency_stats([latency for latency, _ in results]),
+        "concurrency": concurrency,
+        "errors": sum(n for status, n in statuses.items() if status not in ok),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(len(results) / elapsed, 1),
+    }
+
+
+def time_once(operation: Callable[[], object]) -> dict:
+    start = time.perf_counter()
+    operation()
+    return {"seconds": round(time.perf_counter() - start, 4)}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def write_report(
+    suite: str, params: dict, results: dict, output: Optional[str] = None
+) -> None:
+    report = {"suite": suite, **environment(), "params": params, "results": results}
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
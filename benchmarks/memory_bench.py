@@ -0,0 +1,94 @@
+"""Memory and load time of a product with a large ``_allocations`` collection.
+
+Seeds one SKU into a scratch SQLite file, then loads it through the
+repository in a fresh session and reports the bytes retained per allocated
+order line (measured with tracemalloc) and the load time.
+
+    python -m benchmarks.memory_bench --allocations 100000 --output memory.json
+"""
+
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers
+from sqlalchemy.orm import sessionmaker
+
+from adapters import orm
+from adapters import repository
+from benchmarks import datagen
+from benchmarks import harness
+
+
+def spec_for(allocations: int, batches: int) -> datagen.WarehouseSpec:
+    # lines are one unit each, so every batch holds exactly its share
+    quantity = allocations // batches
+    return datagen.WarehouseSpec(
+        skus=1,
+        batches_per_sku=batches,
+        min_batch_quantity=quantity,
+        max_batch_quantity=quantity,
+        allocation_density=1.0,
+        min_line_quantity=1,
+        max_line_quantity=1,
+    )
+
+
+def measure(load) -> dict:
+    # timed and traced separately: tracemalloc slows allocation-heavy code down
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    product = load()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    lines = sum(len(b._allocations) for b in product.batches)
+    return {
+        "allocations": lines,
+        "seconds": round(elapsed, 4),
+        "retained_bytes": retained,
+        "peak_bytes": peak,
+        "bytes_per_allocation": round(retained / lines, 1),
+    }
+
+
+def run(spec: datagen.WarehouseSpec, workdir: str) -> dict:
+    results = {"domain": measure(lambda: next(datagen.generate(spec)))}
+
+    orm.start_mappers()
+    try:
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, 'memory.db')}")
+        orm.metadata.create_all(engine)
+        datagen.seed_database(engine, spec)
+        session_factory = sessionmaker(bind=engine)
+        sku = datagen.sku_name(0)
+        results["repository"] = measure(
+            lambda: repository.SqlAlchemyRepository(session_factory()).get(sku)
+        )
+    finally:
+        clear_mappers()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--allocations", type=int, default=100_000)
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--output", help="write the JSON report here, not stdout")
+    args = parser.parse_args()
+
+    spec = spec_for(args.allocations, args.batches)
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(spec, workdir)
+    harness.write_report("memory", {"spec": spec.as_dict()}, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
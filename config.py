@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 def get_postgres_uri():
@@ -9,7 +10,92 @@ def get_postgres_uri():
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_database_uri():
+    return os.environ.get("DB_URI") or get_postgres_uri()
+
+
+def get_async_postgres_uri():
+    return get_postgres_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+def get_pool_options():
+    if get_database_uri().startswith("sqlite"):
+        return {}
+    return dict(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "true").lower()
+        in ("1", "true", "yes"),
+    )
+
+
+def get_availability_cache_options():
+    return dict(
+        maxsize=int(os.environ.get("AVAILABILITY_CACHE_SIZE", 1024)),
+        ttl=float(os.environ.get("AVAILABILITY_CACHE_TTL", 5)),
+    )
+
+
+def get_idempotency_options():
+    # "memory" keeps outcomes per process; "table" shares them between processes
+    return dict(
+        store=os.environ.get("IDEMPOTENCY_STORE", "memory"),
+        maxsize=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 10_000)),
+        ttl=float(os.environ.get("IDEMPOTENCY_KEY_TTL", 86_400)),
+    )
+
+
+def get_allocation_strategy():
+    # "domain" loads the product and allocates in Python; "sql" allocates with
+    # set-based statements, without hydrating batches or order lines
+    return os.environ.get("ALLOCATION_STRATEGY", "domain")
+
+
+def get_planner_options():
+    # objective: "earliest_ship_date" or "fewest_batches"; budget in seconds
+    return dict(
+        objective=os.environ.get("PLANNER_OBJECTIVE", "earliest_ship_date"),
+        budget=float(os.environ.get("PLANNER_BUDGET", 0.05)),
+    )
+
+
+def get_dispatcher_options():
+    return dict(
+        workers=int(os.environ.get("ALLOCATION_WORKERS", 0)),
+        max_batch=int(os.environ.get("ALLOCATION_MAX_BATCH", 100)),
+        max_products=int(os.environ.get("ALLOCATION_MAX_PRODUCTS", 1000)),
+    )
+
+
+def get_profiling_options():
+    return dict(
+        enabled=os.environ.get("PROFILE_REQUESTS", "false").lower()
+        in ("1", "true", "yes"),
+        directory=os.environ.get("PROFILE_DIR", tempfile.gettempdir()),
+    )
+
+
+def get_redis_host_and_port():
+    host = os.environ.get("REDIS_HOST", "localhost")
+    port = 63791 if host == "localhost" else 6379
+    return dict(host=host, port=port)
+
+
+def get_outbox_relay_options():
+    return dict(
+        batch_size=int(os.environ.get("OUTBOX_BATCH_SIZE", 100)),
+        interval=float(os.environ.get("OUTBOX_POLL_INTERVAL", 0.5)),
+    )
+
+
 def get_api_url():
     host = os.environ.get("API_HOST", "localhost")
     port = 5005 if host == "localhost" else 80
     return f"http://{host}:{port}"
+
+
+def get_async_api_url():
+    host = os.environ.get("ASYNC_API_HOST", "localhost")
+    port = 5006 if host == "localhost" else 80
+    return f"http://{host}:{port}"
@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+
+@dataclass
+class Event:
+    pass
+
+
+@dataclass
+class BatchCreated(Event):
+    reference: str
+    sku: str
+    quantity: int
+    eta: Optional[date]
+
+
+@dataclass
+class BatchQuantityChanged(Event):
+    reference: str
+    sku: str
+    quantity: int
+
+
+@dataclass
+class Allocated(Event):
+    order_reference: str
+    sku: str
+    quantity: int
+    batchref: str
+
+
+@dataclass
+class Deallocated(Event):
+    order_reference: str
+    sku: str
+    batchref: str
+
+
+@dataclass
+class OutOfStock(Event):
+    order_reference: str
+    sku: str
+    quantity: int
@@ -1,5 +1,10 @@
 from datetime import date
 from dataclasses import dataclass
+from typing import Iterable
+from typing import Optional
+from typing import Union
+
+from domain import events
 
 
 class OutOfStock(Exception):
@@ -17,13 +22,23 @@ class OrderLine:
     quantity: int
 
 
+@dataclass(frozen=True)
+class BatchAvailability:
+    reference: str
+    sku: str
+    eta: Optional[date]
+    available_quantity: int
+
+
 class Batch:
-    def __init__(self, reference: str, sku: str, quantity: int, eta: date):
+    def __init__(self, reference: str, sku: str, quantity: int, eta: Optional[date]):
         self.reference = reference
         self.sku = sku
         self.eta = eta
         self._purchased_quantity = quantity
-        self._allocations: set[OrderLine] = set()
+        self._allocated_quantity = 0
+        # keyed by (order_reference, sku), in allocation order
+        self._allocations: dict[tuple[str, str], OrderLine] = {}
 
     def __gt__(self, other):
         if self.eta is None:
@@ -42,19 +57,54 @@ class Batch:
 
     @property
     def allocated_quantity(self) -> int:
-        return sum(allocation.quantity for allocation in self._allocations)
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
         return self._purchased_quantity - self.allocated_quantity
 
     def allocate(self, order_line: OrderLine) -> None:
+        key = (order_line.order_reference, order_line.sku)
+        held = self._allocations.get(key)
+        if held == order_line:
+            return
         if self.can_allocate(order_line):
-            self._allocations.add(order_line)
+            # a line of the same order and sku with another quantity is replaced
+            if held is not None:
+                self._allocated_quantity -= held.quantity
+            self._allocations[key] = order_line
+            self._allocated_quantity += order_line.quantity
 
     def deallocate(self, order_line: OrderLine) -> None:
-        if order_line in self._allocations:
-            self._allocations.remove(order_line)
+        key = (order_line.order_reference, order_line.sku)
+        if self._allocations.get(key) == order_line:
+            del self._allocations[key]
+            self._allocated_quantity -= order_line.quantity
+
+    def change_purchased_quantity(self, quantity: int) -> list[OrderLine]:
+        """Sets the purchased quantity and deallocates the lines the batch can no
+        longer hold, newest first, as they have waited least for it. Of the
+        newest lines that must make room, older ones small enough to fit in
+        what is left stay. Returns the lines deallocated, newest first."""
+        self._purchased_quantity = quantity
+        excess = -self.available_quantity
+        candidates = []
+        for line in reversed(self._allocations.values()):
+            if excess <= 0:
+                break
+            candidates.append(line)
+            excess -= line.quantity
+        # the room left once every candidate is out
+        room = -excess
+        leaving = []
+        for line in reversed(candidates):
+            if line.quantity <= room:
+                room -= line.quantity
+            else:
+                leaving.append(line)
+        for line in leaving:
+            self.deallocate(line)
+        return leaving[::-1]
 
     def can_allocate(self, order_line: OrderLine) -> bool:
         return (
@@ -63,33 +113,176 @@ class Batch:
         )
 
     def can_deallocate(self, order_reference: str, sku: str) -> bool:
-        return (order_reference, sku) in (
-            (o.order_reference, o.sku) for o in self._allocations
-        )
+        return (order_reference, sku) in self._allocations
 
+    def allocation_for(self, order_reference: str, sku: str) -> Optional[OrderLine]:
+        return self._allocations.get((order_reference, sku))
 
-def allocate(line: OrderLine, batches: list[Batch]) -> str:
-    try:
-        batch = next(b for b in sorted(batches) if b.can_allocate(line))
-        batch.allocate(line)
-        return batch.reference
-    except StopIteration:
+
+def eta_order(batch: Batch) -> tuple[bool, date]:
+    return (batch.eta is not None, batch.eta or date.min)
+
+
+def insert_in_eta_order(batches: list[Batch], batch: Batch) -> None:
+    key = eta_order(batch)
+    lo, hi = 0, len(batches)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key < eta_order(batches[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    batches.insert(lo, batch)
+
+
+class BatchIndex:
+    """Batches grouped by SKU, each group kept in ETA order (warehouse stock first)."""
+
+    def __init__(self, batches: Iterable[Batch] = ()):
+        self._by_sku: dict[str, list[Batch]] = {}
+        for batch in batches:
+            self._by_sku.setdefault(batch.sku, []).append(batch)
+        for sku_batches in self._by_sku.values():
+            sku_batches.sort(key=eta_order)
+
+    @classmethod
+    def of_sorted(cls, sku: str, batches: list[Batch]) -> "BatchIndex":
+        """An index over one SKU's batches, already in ETA order, that shares the
+        list instead of copying and sorting it."""
+        index = cls()
+        index._by_sku[sku] = batches
+        return index
+
+    def add(self, batch: Batch) -> None:
+        insert_in_eta_order(self._by_sku.setdefault(batch.sku, []), batch)
+
+    def for_sku(self, sku: str) -> list[Batch]:
+        return self._by_sku.get(sku, [])
+
+    def first_allocatable(self, line: OrderLine) -> Optional[Batch]:
+        return next((b for b in self.for_sku(line.sku) if b.can_allocate(line)), None)
+
+
+def _index(sku: str, batches: Union[BatchIndex, Iterable[Batch]]) -> BatchIndex:
+    if isinstance(batches, BatchIndex):
+        return batches
+    return BatchIndex(b for b in batches if b.sku == sku)
+
+
+def allocate(line: OrderLine, batches: Union[BatchIndex, Iterable[Batch]]) -> str:
+    batch = _index(line.sku, batches).first_allocatable(line)
+    if batch is None:
         raise OutOfStock(f"Out of stock for sku {line.sku}")
+    batch.allocate(line)
+    return batch.reference
+
+
+def deallocate(
+    order_reference: str, sku: str, batches: Union[BatchIndex, Iterable[Batch]]
+) -> str:
+    for batch in _index(sku, batches).for_sku(sku):
+        order_line = batch.allocation_for(order_reference, sku)
+        if order_line is not None:
+            batch.deallocate(order_line)
+            return batch.reference
+    raise ReferenceAndSkuNotFound(
+        f"Order line not found for such reference {order_reference} and sku {sku}"
+    )
+
+
+class Product:
+    def __init__(self, sku: str, batches: list[Batch], version_number: int = 0):
+        self.sku = sku
+        self.batches = sorted(batches, key=eta_order)
+        self.version_number = version_number
+        self.events: list[events.Event] = []
 
+    @property
+    def index(self) -> BatchIndex:
+        # batches are kept in ETA order, so the index costs nothing to build
+        return BatchIndex.of_sorted(self.sku, self.batches)
 
-def deallocate(order_reference: str, sku: str, batches: list[Batch]) -> str:
-    try:
-        batch = next(
-            b for b in sorted(batches) if b.can_deallocate(order_reference, sku)
+    def add_batch(self, batch: Batch) -> None:
+        insert_in_eta_order(self.batches, batch)
+        self.version_number += 1
+        self.events.append(
+            events.BatchCreated(
+                batch.reference, batch.sku, batch._purchased_quantity, batch.eta
+            )
         )
-        order_line = next(
-            line
-            for line in batch._allocations
-            if (order_reference, sku) == (line.order_reference, line.sku)
+
+    def allocate(self, line: OrderLine) -> str:
+        try:
+            batchref = allocate(line, self.index)
+        except OutOfStock:
+            self.events.append(
+                events.OutOfStock(line.order_reference, line.sku, line.quantity)
+            )
+            raise
+        self.version_number += 1
+        self.events.append(
+            events.Allocated(line.order_reference, line.sku, line.quantity, batchref)
         )
-        batch.deallocate(order_line)
-        return batch.reference
-    except StopIteration:
-        raise ReferenceAndSkuNotFound(
-            f"Order line not found for such reference {order_reference} and sku {sku}"
+        return batchref
+
+    def allocate_to(self, line: OrderLine, batch: Optional[Batch]) -> str:
+        """Allocates the line to a batch picked by a planner, where None means
+        that no batch can take it."""
+        held = (
+            batch is not None
+            and batch.allocation_for(line.order_reference, line.sku) == line
         )
+        if batch is None or not (held or batch.can_allocate(line)):
+            self.events.append(
+                events.OutOfStock(line.order_reference, line.sku, line.quantity)
+            )
+            raise OutOfStock(f"Out of stock for sku {line.sku}")
+        batch.allocate(line)
+        self.version_number += 1
+        self.events.append(
+            events.Allocated(
+                line.order_reference, line.sku, line.quantity, batch.reference
+            )
+        )
+        return batch.reference
+
+    def change_batch_quantity(
+        self, reference: str, quantity: int
+    ) -> list[tuple[OrderLine, Union[str, OutOfStock]]]:
+        """Changes the purchased quantity of a batch. The lines the batch can no
+        longer hold, as chosen by Batch.change_purchased_quantity, are allocated
+        to the product's other batches. Returns each line moved with its new
+        batch reference, or the OutOfStock error of a line left out."""
+        batch = next(b for b in self.batches if b.reference == reference)
+        self.version_number += 1
+        self.events.append(events.BatchQuantityChanged(reference, self.sku, quantity))
+        moved = batch.change_purchased_quantity(quantity)
+        for line in moved:
+            self.events.append(
+                events.Deallocated(line.order_reference, self.sku, reference)
+            )
+        others = BatchIndex(b for b in self.batches if b is not batch)
+        results: list[tuple[OrderLine, Union[str, OutOfStock]]] = []
+        # lines that waited longest for the batch get first pick of the others
+        for line in reversed(moved):
+            try:
+                batchref = allocate(line, others)
+            except OutOfStock as e:
+                self.events.append(
+                    events.OutOfStock(line.order_reference, line.sku, line.quantity)
+                )
+                results.append((line, e))
+                continue
+            self.events.append(
+                events.Allocated(
+                    line.order_reference, line.sku, line.quantity, batchref
+                )
+            )
+            results.append((line, batchref))
+        return results
+
+    def deallocate(self, order_reference: str) -> str:
+        batchref = deallocate(order_reference, self.sku, self.index)
+        self.version_number += 1
+        self.events.append(events.Deallocated(order_reference, self.sku, batchref))
+        return batchref
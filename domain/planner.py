@@ -0,0 +1,221 @@
+"""Plans the allocation of a whole order at once.
+
+``model.allocate`` takes one line at a time and gives it the first batch that
+can hold it, so the lines of one order may end up spread over many batches and
+ETAs. The planner searches the assignments of every line of an order to the
+batches of its SKU for the best plan under an objective, within a time budget,
+and falls back to the greedy plan when the budget runs out.
+"""
+
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+
+from domain.model import Batch
+from domain.model import BatchIndex
+from domain.model import OrderLine
+from domain.model import eta_order
+
+EARLIEST_SHIP_DATE = "earliest_ship_date"
+FEWEST_BATCHES = "fewest_batches"
+OBJECTIVES = (EARLIEST_SHIP_DATE, FEWEST_BATCHES)
+
+# the eta_order key of warehouse stock, which ships before any batch with an ETA
+IN_STOCK = (False, date.min)
+
+
+@dataclass
+class Plan:
+    # a batch, or None for a line no batch can take, for each line in order
+    allocations: list[tuple[OrderLine, Optional[Batch]]]
+    objective: str
+    # False when the budget ran out and the plan is the greedy one
+    optimal: bool
+
+    @property
+    def batches(self) -> set[Batch]:
+        return {batch for _, batch in self.allocations if batch is not None}
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+@dataclass
+class _Step:
+    # the line at ``depth`` in the search order, the batches it can still try,
+    # and the batch it holds while the lines after it are searched
+    depth: int
+    choices: Iterator[Optional[Batch]]
+    taken: bool = False
+    batch: Optional[Batch] = None
+
+
+class _Search:
+    def __init__(
+        self,
+        lines: list[OrderLine],
+        index: BatchIndex,
+        objective: str,
+        deadline: float,
+        clock: Callable[[], float],
+    ):
+        self.lines = lines
+        self.objective = objective
+        self.deadline = deadline
+        self.clock = clock
+        self.remaining = {
+            b: b.available_quantity for line in lines for b in index.for_sku(line.sku)
+        }
+        self.held = {line: _holder(line, index) for line in lines}
+        self.options: dict[OrderLine, list[Batch]] = {}
+        for line in lines:
+            held = self.held[line]
+            self.options[line] = [held] if held else index.for_sku(line.sku)
+        # the earliest batch each line could get with no other line competing,
+        # or None when no batch can take it at all
+        self.floor: dict[OrderLine, Optional[tuple]] = {
+            line: min(
+                (eta_order(b) for b in self.options[line] if self.fits(line, b)),
+                default=None,
+            )
+            for line in lines
+        }
+        self.touched: Counter = Counter()
+        self.etas: list[tuple] = []
+        self.unallocated = 0
+
+    def bound(self, rest: list[OrderLine]) -> tuple:
+        """The least any plan completing the current one with ``rest`` costs:
+        lines unallocated, then the objective, then the other measure."""
+        possible = [line for line in rest if self.floor[line] is not None]
+        floors = [floor for floor in map(self.floor.get, rest) if floor is not None]
+        unallocated = self.unallocated + len(rest) - len(possible)
+        latest = max([*self.etas, *floors], default=IN_STOCK)
+        untouched_skus = {line.sku for line in possible} - {
+            b.sku for b in self.touched
+        }
+        touched = len(self.touched) + len(untouched_skus)
+        if self.objective == FEWEST_BATCHES:
+            return (unallocated, touched, latest)
+        return (unallocated, latest, touched)
+
+    def take(self, line: OrderLine, batch: Optional[Batch]) -> None:
+        if batch is None:
+            self.unallocated += 1
+            return
+        if not self.held[line]:
+            self.remaining[batch] -= line.quantity
+        self.touched[batch] += 1
+        self.etas.append(eta_order(batch))
+
+    def release(self, line: OrderLine, batch: Optional[Batch]) -> None:
+        if batch is None:
+            self.unallocated -= 1
+            return
+        if not self.held[line]:
+            self.remaining[batch] += line.quantity
+        self.touched[batch] -= 1
+        if not self.touched[batch]:
+            del self.touched[batch]
+        self.etas.pop()
+
+    def fits(self, line: OrderLine, batch: Batch) -> bool:
+        return self.held[line] is batch or self.remaining[batch] >= line.quantity
+
+    def greedy(self) -> list[Optional[Batch]]:
+        chosen = []
+        for line in self.lines:
+            batch = next((b for b in self.options[line] if self.fits(line, b)), None)
+            self.take(line, batch)
+            chosen.append(batch)
+        return chosen
+
+    def search(
+        self, greedy: list[Optional[Batch]], greedy_cost: tuple
+    ) -> list[Optional[Batch]]:
+        best_cost, best_plan = greedy_cost, greedy
+        # lines with the fewest batches to choose from first
+        order = sorted(
+            range(len(self.lines)), key=lambda i: len(self.options[self.lines[i]])
+        )
+        chosen: list[Optional[Batch]] = [None] * len(self.lines)
+
+        def visit(depth: int) -> Optional[Iterator[Optional[Batch]]]:
+            nonlocal best_cost, best_plan
+            # the choices for the line at this depth, or None for a finished or
+            # hopeless partial plan
+            if self.clock() > self.deadline:
+                raise _OutOfTime
+            # a partial plan that cannot beat the best one found is not pursued
+            if self.bound([self.lines[i] for i in order[depth:]]) >= best_cost:
+                return None
+            if depth == len(order):
+                best_cost, best_plan = self.bound([]), list(chosen)
+                return None
+            line = self.lines[order[depth]]
+            return iter([*self.options[line], None])
+
+        # depth-first, with a stack of steps rather than recursion, which orders
+        # of a thousand lines would run out of
+        root = visit(0)
+        stack: list[_Step] = [] if root is None else [_Step(0, root)]
+        while stack:
+            step = stack[-1]
+            line = self.lines[order[step.depth]]
+            if step.taken:
+                self.release(line, step.batch)
+                step.taken = False
+            for batch in step.choices:
+                if batch is None or self.fits(line, batch):
+                    break
+            else:
+                stack.pop()
+                continue
+            chosen[order[step.depth]] = batch
+            self.take(line, batch)
+            step.taken, step.batch = True, batch
+            following = visit(step.depth + 1)
+            if following is not None:
+                stack.append(_Step(step.depth + 1, following))
+        return best_plan
+
+
+def _holder(line: OrderLine, index: BatchIndex) -> Optional[Batch]:
+    # a line already allocated stays where it is, as with Batch.allocate
+    return next(
+        (
+            b
+            for b in index.for_sku(line.sku)
+            if b.allocation_for(line.order_reference, line.sku) == line
+        ),
+        None,
+    )
+
+
+def plan(
+    lines: list[OrderLine],
+    index: BatchIndex,
+    objective: str = EARLIEST_SHIP_DATE,
+    budget: float = 0.05,
+    clock: Callable[[], float] = time.perf_counter,
+) -> Plan:
+    """Plans the lines of one order without allocating them. Lines no batch can
+    take are planned as None, and the best plan leaves as few of those as it
+    can before it looks at the objective."""
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective}")
+    search = _Search(lines, index, objective, clock() + budget, clock)
+    greedy = search.greedy()
+    greedy_cost = search.bound([])
+    for line, batch in reversed(list(zip(lines, greedy))):
+        search.release(line, batch)
+    try:
+        chosen, optimal = search.search(greedy, greedy_cost), True
+    except _OutOfTime:
+        chosen, optimal = greedy, False
+    return Plan(list(zip(lines, chosen)), objective, optimal)
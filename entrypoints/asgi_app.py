@@ -0,0 +1,52 @@
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from domain import model
+from service_layer import async_services
+from service_layer import services
+from service_layer.async_unit_of_work import AsyncSqlAlchemyUnitOfWork
+from adapters import orm
+
+orm.start_mappers()
+
+
+async def allocate_endpoint(request: Request):
+    body = await request.json()
+    line = model.OrderLine(
+        order_reference=body["order_reference"],
+        sku=body["sku"],
+        quantity=body["quantity"],
+    )
+
+    try:
+        batchref = await async_services.allocate(line, AsyncSqlAlchemyUnitOfWork())
+    except (model.OutOfStock, services.InvalidSku) as e:
+        return JSONResponse({"message": str(e)}, 400)
+    except services.ConcurrentUpdate as e:
+        return JSONResponse({"message": str(e)}, 409)
+
+    return JSONResponse({"batchref": batchref}, 201)
+
+
+async def deallocate_endpoint(request: Request):
+    body = await request.json()
+    try:
+        batchref = await async_services.deallocate(
+            body["order_reference"], body["sku"], AsyncSqlAlchemyUnitOfWork()
+        )
+    except (model.ReferenceAndSkuNotFound, services.InvalidSku) as e:
+        return JSONResponse({"message": str(e)}, 400)
+    except services.ConcurrentUpdate as e:
+        return JSONResponse({"message": str(e)}, 409)
+
+    return JSONResponse({"batchref": batchref}, 201)
+
+
+app = Starlette(
+    routes=[
+        Route("/allocate", allocate_endpoint, methods=["POST"]),
+        Route("/deallocate", deallocate_endpoint, methods=["POST"]),
+    ]
+)
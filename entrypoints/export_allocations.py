@@ -0,0 +1,65 @@
+"""Export the allocation state, then the changes made to it.
+
+    python -m entrypoints.export_allocations snapshot allocations.jsonl.gz
+    python -m entrypoints.export_allocations changes --since 1234 --follow
+
+A snapshot starts with a header record holding its position and, on
+PostgreSQL, its transaction snapshot; pass them to ``changes --since`` and
+``--snapshot`` to stream every later change, one JSON line each, to standard
+output. Files ending in .gz are compressed.
+"""
+
+import argparse
+import gzip
+import json
+import sys
+from dataclasses import asdict
+
+from adapters import orm
+from service_layer import exports
+
+
+def open_output(path):
+    if path == "-":
+        return sys.stdout
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt")
+    return open(path, "w")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    snapshot = commands.add_parser("snapshot")
+    snapshot.add_argument("path")
+    snapshot.add_argument("--chunk-size", type=int, default=1000)
+    changes = commands.add_parser("changes")
+    changes.add_argument("--since", type=int, required=True)
+    changes.add_argument("--snapshot", help="the snapshot header's snapshot")
+    changes.add_argument("--batch-size", type=int, default=1000)
+    changes.add_argument("--follow", action="store_true")
+    changes.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    orm.start_mappers()
+    if args.command == "snapshot":
+        with open_output(args.path) as out:
+            report = exports.export_snapshot(out, chunk_size=args.chunk_size)
+        print(json.dumps(asdict(report), indent=2), file=sys.stderr)
+        return 0
+
+    stream = exports.ChangeStream(
+        args.since, batch_size=args.batch_size, snapshot=args.snapshot
+    )
+    records = stream.follow(args.interval) if args.follow else stream.poll()
+    try:
+        for record in records:
+            print(json.dumps(record), flush=args.follow)
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps({"position": stream.position}), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
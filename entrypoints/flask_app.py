@@ -1,24 +1,149 @@
+import cProfile
+import functools
+import os
+import time
+import uuid
+from datetime import datetime
+
 from flask import Flask
+from flask import g
 from flask import request
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 import config
 from domain import model
+from domain import planner
 from service_layer import services
+from service_layer import unit_of_work
+from service_layer.dispatcher import AllocationDispatcher
+from service_layer.dispatcher import WORKER_SESSION_FACTORY
+from adapters import idempotency
+from adapters import metrics
 from adapters import orm
-from adapters import repository
-
+from adapters.cache import LRUCache
 
 orm.start_mappers()
-get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
+availability_cache: LRUCache = LRUCache(**config.get_availability_cache_options())
+profiling = config.get_profiling_options()
 app = Flask(__name__)
+metrics.instrument_engine(unit_of_work.DEFAULT_ENGINE)
+
+
+def new_uow():
+    return unit_of_work.SqlAlchemyUnitOfWork(cache=availability_cache)
+
+
+def new_worker_uow():
+    return unit_of_work.SqlAlchemyUnitOfWork(
+        WORKER_SESSION_FACTORY, availability_cache
+    )
+
+
+allocate = (
+    services.allocate_set_based
+    if config.get_allocation_strategy() == "sql"
+    else services.allocate
+)
+planner_options = config.get_planner_options()
+idempotency_options = config.get_idempotency_options()
+idempotency_store: idempotency.AbstractIdempotencyStore = (
+    idempotency.SqlAlchemyIdempotencyStore(
+        unit_of_work.DEFAULT_SESSION_FACTORY, ttl=idempotency_options["ttl"]
+    )
+    if idempotency_options["store"] == "table"
+    else idempotency.InMemoryIdempotencyStore(
+        idempotency_options["maxsize"], idempotency_options["ttl"]
+    )
+)
+dispatcher_options = config.get_dispatcher_options()
+dispatcher = (
+    AllocationDispatcher(new_worker_uow, **dispatcher_options).start()
+    if dispatcher_options["workers"]
+    else None
+)
+
+
+@app.before_request
+def start_instrumentation():
+    g.started_at = time.perf_counter()
+    metrics.start_request()
+    if profiling["enabled"] and request.headers.get("X-Profile"):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def finish_instrumentation(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        path = os.path.join(
+            profiling["directory"], f"request-{uuid.uuid4().hex}.prof"
+        )
+        profiler.dump_stats(path)
+        response.headers["X-Profile-File"] = path
+    stats = metrics.end_request()
+    if stats is not None:
+        metrics.REQUEST_SQL_STATEMENTS.observe(stats.statements, endpoint=endpoint)
+    metrics.REQUEST_SECONDS.observe(
+        time.perf_counter() - g.started_at,
+        endpoint=endpoint,
+        status=response.status_code,
+    )
+    return response
+
+
+def idempotent(endpoint):
+    """Replays the stored response to a request repeated with the same
+    Idempotency-Key header, without running it again."""
+
+    @functools.wraps(endpoint)
+    def wrapper():
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return endpoint()
+        try:
+            outcome, replayed = idempotency.outcome_for(
+                idempotency_store,
+                f"{request.path}:{key}",
+                idempotency.fingerprint(request.json),
+                endpoint,
+            )
+        except idempotency.KeyReused as e:
+            return {"message": str(e)}, 422
+        except idempotency.RequestInProgress as e:
+            return {"message": str(e)}, 409
+        headers = {"Idempotent-Replayed": "true"} if replayed else {}
+        return outcome.body, outcome.status, headers
+
+    return wrapper
+
+
+@app.route("/add_batch", methods=["POST"])
+def add_batch_endpoint():
+    eta = request.json["eta"]
+    if eta is not None:
+        eta = datetime.fromisoformat(eta).date()
+    args = (
+        request.json["reference"],
+        request.json["sku"],
+        request.json["quantity"],
+        eta,
+    )
+    try:
+        if dispatcher is not None:
+            services.check_new_batch_reference(args[0], new_uow())
+            dispatcher.add_batch(*args).result()
+        else:
+            services.add_batch(*args, new_uow())
+    except services.DuplicateBatchReference as e:
+        return {"message": str(e)}, 400
+    return "OK", 201
 
 
 @app.route("/allocate", methods=["POST"])
+@idempotent
 def allocate_endpoint():
-    session = get_session()
-    repo = repository.SqlAlchemyRepository(session)
     line = model.OrderLine(
         order_reference=request.json["order_reference"],
         sku=request.json["sku"],
@@ -26,22 +151,190 @@ def allocate_endpoint():
     )
 
     try:
-        batchref = services.allocate(line, repo, session)
+        if dispatcher is not None:
+            batchref = dispatcher.allocate(line).result()
+        else:
+            batchref = allocate(line, new_uow())
     except (model.OutOfStock, services.InvalidSku) as e:
         return {"message": str(e)}, 400
+    except services.ConcurrentUpdate as e:
+        return {"message": str(e)}, 409
 
     return {"batchref": batchref}, 201
 
 
+@app.route("/allocate/bulk", methods=["POST"])
+def allocate_bulk_endpoint():
+    lines = [
+        model.OrderLine(
+            order_reference=line["order_reference"],
+            sku=line["sku"],
+            quantity=line["quantity"],
+        )
+        for line in request.json["lines"]
+    ]
+
+    try:
+        if dispatcher is not None:
+            results = dispatcher.allocate_many(lines).result()
+        else:
+            results = services.allocate_many(lines, new_uow())
+    except services.ConcurrentUpdate as e:
+        return {"message": str(e)}, 409
+
+    return {
+        "results": [
+            {"message": str(r)} if isinstance(r, Exception) else {"batchref": r}
+            for r in results
+        ]
+    }, 201
+
+
+@app.route("/allocate/order", methods=["POST"])
+def allocate_order_endpoint():
+    lines = [
+        model.OrderLine(
+            order_reference=line["order_reference"],
+            sku=line["sku"],
+            quantity=line["quantity"],
+        )
+        for line in request.json["lines"]
+    ]
+    objective = request.json.get("objective", planner_options["objective"])
+    if objective not in planner.OBJECTIVES:
+        return {"message": f"Unknown objective {objective}"}, 400
+
+    try:
+        if dispatcher is not None:
+            results = dispatcher.allocate_order(
+                lines, objective, planner_options["budget"]
+            ).result()
+        else:
+            results = services.allocate_order(
+                lines, new_uow(), objective, planner_options["budget"]
+            )
+    except services.ConcurrentUpdate as e:
+        return {"message": str(e)}, 409
+
+    return {
+        "results": [
+            {"message": str(r)} if isinstance(r, Exception) else {"batchref": r}
+            for r in results
+        ]
+    }, 201
+
+
+@app.route("/change_batch_quantity", methods=["POST"])
+def change_batch_quantity_endpoint():
+    reference = request.json["reference"]
+    quantity = request.json["quantity"]
+    if not isinstance(quantity, int) or quantity < 0:
+        return {"message": f"Invalid quantity {quantity}"}, 400
+
+    try:
+        if dispatcher is not None:
+            sku = services.batch_sku(reference, new_uow())
+            moved = dispatcher.change_batch_quantity(
+                reference, sku, quantity
+            ).result()
+        else:
+            moved = services.change_batch_quantity(reference, quantity, new_uow())
+    except services.InvalidBatchReference as e:
+        return {"message": str(e)}, 400
+    except services.ConcurrentUpdate as e:
+        return {"message": str(e)}, 409
+
+    return {
+        "reallocated": [
+            dict(
+                order_reference=line.order_reference,
+                sku=line.sku,
+                quantity=line.quantity,
+                **(
+                    {"message": str(r)}
+                    if isinstance(r, Exception)
+                    else {"batchref": r}
+                ),
+            )
+            for line, r in moved
+        ]
+    }, 200
+
+
 @app.route("/deallocate", methods=["POST"])
+@idempotent
 def deallocate_endpoint():
-    session = get_session()
-    repo = repository.SqlAlchemyRepository(session)
     order_reference = request.json["order_reference"]
     sku = request.json["sku"]
     try:
-        batchref = services.deallocate(order_reference, sku, repo, session)
-    except (model.OutOfStock, services.InvalidSku) as e:
+        if dispatcher is not None:
+            batchref = dispatcher.deallocate(order_reference, sku).result()
+        else:
+            batchref = services.deallocate(order_reference, sku, new_uow())
+    except (model.ReferenceAndSkuNotFound, services.InvalidSku) as e:
         return {"message": str(e)}, 400
+    except services.ConcurrentUpdate as e:
+        return {"message": str(e)}, 409
 
     return {"batchref": batchref}, 201
+
+
+def availability_json(sku, batches):
+    return {
+        "sku": sku,
+        "available_quantity": sum(b.available_quantity for b in batches),
+        "batches": [
+            {
+                "batchref": b.reference,
+                "eta": b.eta.isoformat() if b.eta else None,
+                "available_quantity": b.available_quantity,
+            }
+            for b in batches
+        ],
+    }
+
+
+@app.route("/availability/<sku>", methods=["GET"])
+def availability_endpoint(sku):
+    batches = services.availability(sku, new_uow())
+    if not batches:
+        return {"message": f"Invalid sku {sku}"}, 404
+
+    return availability_json(sku, batches), 200
+
+
+@app.route("/availability", methods=["GET"])
+def availability_many_endpoint():
+    skus = request.args.getlist("sku")
+    found = services.availability_many(skus, new_uow())
+    return {"results": [availability_json(sku, found[sku]) for sku in skus]}, 200
+
+
+@app.route("/cache-stats", methods=["GET"])
+def cache_stats_endpoint():
+    return availability_cache.stats(), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return (
+        metrics.REGISTRY.render(),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4"},
+    )
+
+
+@app.route("/pool-stats", methods=["GET"])
+def pool_stats_endpoint():
+    pool = unit_of_work.DEFAULT_ENGINE.pool
+    stats = {"status": pool.status()}
+    # counters only pools that keep connections have, which NullPool does not
+    for name, method in [
+        ("size", "size"),
+        ("checked_in", "checkedin"),
+        ("checked_out", "checkedout"),
+        ("overflow", "overflow"),
+    ]:
+        if hasattr(pool, method):
+            stats[name] = getattr(pool, method)()
+    return stats, 200
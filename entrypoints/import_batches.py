@@ -0,0 +1,47 @@
+"""Import new batches from a CSV or JSONL purchase-order file.
+
+    python -m entrypoints.import_batches purchase-order.csv --chunk-size 5000
+
+CSV files need a header row naming the reference, sku, quantity and eta
+columns; JSONL files hold one object with those keys per line. Each chunk is
+committed on its own, and references already stored are skipped, so an
+interrupted import can be rerun on the same file.
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import asdict
+
+from adapters import batch_files
+from adapters import orm
+from service_layer import batch_import
+from service_layer import unit_of_work
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=batch_files.FORMATS)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    orm.start_mappers()
+    format = args.format or batch_files.format_for(args.path)
+    with open(args.path, newline="") as f:
+        report = batch_import.import_batches(
+            batch_files.read_batches(f, format),
+            unit_of_work.SqlAlchemyUnitOfWork(),
+            args.chunk_size,
+        )
+    print(
+        json.dumps(
+            {**asdict(report), "rows_per_second": round(report.rows_per_second, 1)},
+            indent=2,
+        )
+    )
+    return 1 if report.invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""Bring the database schema up to date.
+
+    python -m entrypoints.migrate
+    python -m entrypoints.migrate --list
+
+Applies the migrations the database has not had yet, building new indexes
+without blocking allocations, and prints each one as it completes.
+"""
+
+import argparse
+import sys
+
+from adapters import migrations
+from service_layer import unit_of_work
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--list", action="store_true", help="print pending migrations only"
+    )
+    args = parser.parse_args(argv)
+
+    engine = unit_of_work.DEFAULT_ENGINE
+    if args.list:
+        for migration in migrations.pending(engine):
+            print(f"{migration.version}: {migration.description}")
+        return 0
+    for migration in migrations.migrate(engine):
+        print(f"applied {migration.version}: {migration.description}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Relay allocation events from the outbox to Redis (or, for local runs, to
+an in-process publisher that logs them).
+
+    python -m entrypoints.outbox_relay --publisher redis
+"""
+
+import argparse
+import logging
+import time
+
+import config
+from adapters import publishers
+from service_layer.outbox_relay import OutboxRelay
+
+logger = logging.getLogger(__name__)
+
+
+def make_publisher(kind: str) -> publishers.AbstractPublisher:
+    if kind == "redis":
+        import redis
+
+        return publishers.RedisPublisher(
+            redis.Redis(**config.get_redis_host_and_port())
+        )
+    publisher = publishers.InMemoryPublisher()
+    publisher.subscribe(lambda m: logger.info("%s %s", m.type, m.payload))
+    return publisher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--publisher", choices=["memory", "redis"], default="memory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    relay = OutboxRelay(
+        make_publisher(args.publisher), **config.get_outbox_relay_options()
+    )
+    relay.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        relay.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from typing import Awaitable
+from typing import Callable
+from typing import TypeVar
+
+from domain import model
+from domain.model import OrderLine
+from service_layer.async_unit_of_work import AbstractAsyncUnitOfWork
+from service_layer.services import ConcurrentUpdate
+from service_layer.services import InvalidSku
+from service_layer.services import MAX_ATTEMPTS
+from service_layer.unit_of_work import VersionConflict
+
+T = TypeVar("T")
+
+
+async def _commit_with_retries(
+    uow: AbstractAsyncUnitOfWork, operation: Callable[[], Awaitable[T]]
+) -> T:
+    for _ in range(MAX_ATTEMPTS):
+        async with uow:
+            try:
+                result = await operation()
+            except model.OutOfStock:
+                await uow.commit()
+                raise
+            try:
+                await uow.commit()
+            except VersionConflict:
+                continue
+            return result
+    raise ConcurrentUpdate(f"Gave up after {MAX_ATTEMPTS} conflicting attempts")
+
+
+async def allocate(line: OrderLine, uow: AbstractAsyncUnitOfWork) -> str:
+    async def _allocate():
+        product = await uow.products.get(sku=line.sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {line.sku}")
+        return product.allocate(line)
+
+    return await _commit_with_retries(uow, _allocate)
+
+
+async def deallocate(
+    order_reference: str, sku: str, uow: AbstractAsyncUnitOfWork
+) -> str:
+    async def _deallocate():
+        product = await uow.products.get(sku=sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {sku}")
+        return product.deallocate(order_reference)
+
+    return await _commit_with_retries(uow, _deallocate)
+
+
+async def availability(
+    sku: str, uow: AbstractAsyncUnitOfWork
+) -> tuple[model.BatchAvailability, ...]:
+    async with uow:
+        return await uow.products.availability(sku)
@@ -0,0 +1,72 @@
+import abc
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+
+import config
+from adapters import async_repository
+from adapters import orm
+from adapters import outbox
+from adapters import read_model
+from service_layer.unit_of_work import VersionConflict
+
+
+class AbstractAsyncUnitOfWork(abc.ABC):
+    products: async_repository.AbstractAsyncRepository
+
+    async def __aenter__(self) -> "AbstractAsyncUnitOfWork":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.rollback()
+
+    @abc.abstractmethod
+    async def commit(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def rollback(self):
+        raise NotImplementedError
+
+
+DEFAULT_ASYNC_ENGINE = create_async_engine(
+    config.get_async_postgres_uri(), **config.get_pool_options()
+)
+DEFAULT_ASYNC_SESSION_FACTORY = sessionmaker(  # type: ignore[type-var]
+    bind=DEFAULT_ASYNC_ENGINE, class_=AsyncSession, expire_on_commit=False
+)
+
+
+class AsyncSqlAlchemyUnitOfWork(AbstractAsyncUnitOfWork):
+    def __init__(self, session_factory=DEFAULT_ASYNC_SESSION_FACTORY):
+        self.session_factory = session_factory
+
+    async def __aenter__(self):
+        self.session = self.session_factory()
+        self.products = async_repository.AsyncSqlAlchemyRepository(self.session)
+        return await super().__aenter__()
+
+    async def __aexit__(self, *args):
+        await super().__aexit__(*args)
+        await self.session.close()
+
+    async def commit(self):
+        new_events = []
+        for product in self.products.seen:
+            new_events.extend(product.events)
+            product.events.clear()
+        await self.session.run_sync(outbox.add, new_events)
+        try:
+            await self.session.flush()
+            changed = orm.pop_changed_batches(self.session.sync_session)
+            await self.session.run_sync(read_model.refresh, changed)
+            await self.session.commit()
+        except StaleDataError as e:
+            raise VersionConflict(str(e)) from e
+
+    async def rollback(self):
+        await self.session.rollback()
+        for product in self.products.seen:
+            product.events.clear()
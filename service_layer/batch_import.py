@@ -0,0 +1,101 @@
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import date
+from typing import Iterable
+from typing import Optional
+
+from domain import model
+from service_layer import unit_of_work
+from service_layer.services import commit_with_retries
+
+MAX_REPORTED_ERRORS = 100
+
+
+class InvalidBatchRow(Exception):
+    pass
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    already_present: int = 0
+    invalid: int = 0
+    # (line number, message) for the first MAX_REPORTED_ERRORS invalid rows
+    errors: list[tuple[int, str]] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def parse_batch_row(row: Optional[dict]) -> model.Batch:
+    if not isinstance(row, dict):
+        raise InvalidBatchRow("expected a JSON object")
+    reference = str(row.get("reference") or "").strip()
+    sku = str(row.get("sku") or "").strip()
+    if not reference:
+        raise InvalidBatchRow("missing reference")
+    if not sku:
+        raise InvalidBatchRow("missing sku")
+    raw_quantity = row.get("quantity")
+    if raw_quantity is None:
+        raise InvalidBatchRow("missing quantity")
+    try:
+        quantity = int(raw_quantity)
+    except (TypeError, ValueError):
+        raise InvalidBatchRow(f"invalid quantity {raw_quantity!r}") from None
+    if quantity <= 0:
+        raise InvalidBatchRow(f"invalid quantity {quantity}")
+    eta = row.get("eta") or None
+    if eta is not None:
+        try:
+            eta = date.fromisoformat(str(eta).strip())
+        except ValueError:
+            raise InvalidBatchRow(f"invalid eta {eta!r}") from None
+    return model.Batch(reference, sku, quantity, eta)
+
+
+def import_batches(
+    rows: Iterable[tuple[int, Optional[dict]]],
+    uow: unit_of_work.AbstractUnitOfWork,
+    chunk_size: int = 1000,
+) -> ImportReport:
+    """Imports ``(line number, row)`` pairs, committing every ``chunk_size``
+    valid batches. References already stored are skipped, so a failed import
+    can simply be run again; a reference repeated in a later chunk is counted
+    as already present rather than as a duplicate."""
+    report = ImportReport()
+    # keyed by reference, so repeats are only tracked within the current chunk
+    chunk: dict[str, model.Batch] = {}
+    start = time.perf_counter()
+
+    def write():
+        batches = list(chunk.values())
+        added = commit_with_retries(uow, lambda: uow.products.add_batches(batches))
+        report.imported += added
+        report.already_present += len(chunk) - added
+        chunk.clear()
+
+    for line_number, row in rows:
+        report.rows += 1
+        try:
+            batch = parse_batch_row(row)
+        except InvalidBatchRow as e:
+            report.invalid += 1
+            if len(report.errors) < MAX_REPORTED_ERRORS:
+                report.errors.append((line_number, str(e)))
+            continue
+        if batch.reference in chunk:
+            report.duplicates += 1
+            continue
+        chunk[batch.reference] = batch
+        if len(chunk) >= chunk_size:
+            write()
+    if chunk:
+        write()
+    report.seconds = time.perf_counter() - start
+    return report
@@ -0,0 +1,327 @@
+"""Serializes writes per SKU by routing them to a fixed worker thread.
+
+Every command for a SKU goes to the same worker, which keeps the products it
+owns in memory, up to ``max_products`` of the most recently used ones, applies
+commands in arrival order and commits whatever it has queued up in one unit of
+work. Commands spanning several SKUs are split into one command per SKU. All
+writes for a dispatched SKU should go through the dispatcher: a writer that
+bypasses it is caught by the product version check the next time the worker
+commits a change to that product. Before it reports a line out of stock or not
+found, the worker also checks that nobody changed the product since it loaded
+it, and starts over from the stored product if somebody did.
+"""
+
+import functools
+import queue
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import date
+from typing import Callable
+from typing import Optional
+from typing import Union
+
+from sqlalchemy.orm import sessionmaker
+
+from domain import model
+from domain import planner
+from service_layer import unit_of_work
+from service_layer.services import MAX_ATTEMPTS
+from service_layer.services import ConcurrentUpdate
+from service_layer.services import DuplicateBatchReference
+from service_layer.services import InvalidBatchReference
+from service_layer.services import InvalidSku
+from service_layer.services import allocate_as_planned
+from service_layer.services import allocate_lines
+from service_layer.services import moved_lines
+
+EXPECTED_ERRORS = (
+    InvalidSku,
+    InvalidBatchReference,
+    DuplicateBatchReference,
+    model.OutOfStock,
+    model.ReferenceAndSkuNotFound,
+)
+
+# workers own their products between commits, so there is nothing to expire
+WORKER_SESSION_FACTORY = sessionmaker(
+    bind=unit_of_work.DEFAULT_ENGINE, expire_on_commit=False
+)
+
+
+def default_uow() -> unit_of_work.AbstractUnitOfWork:
+    return unit_of_work.SqlAlchemyUnitOfWork(WORKER_SESSION_FACTORY)
+
+
+@dataclass
+class _Command:
+    sku: str
+    handle: Callable[[Optional[model.Product]], object]
+    create: bool = False
+    future: Future = field(default_factory=Future)
+
+
+_STOP = object()
+
+# the result of a command, or the error it failed with
+_Outcome = tuple[object, Optional[BaseException]]
+
+
+class _Worker(threading.Thread):
+    def __init__(
+        self, uow: unit_of_work.AbstractUnitOfWork, max_batch: int, max_products: int
+    ):
+        super().__init__(daemon=True)
+        self.uow = uow
+        self.max_batch = max_batch
+        self.max_products = max_products
+        self.queue: queue.Queue = queue.Queue()
+        # least recently used first
+        self.products: OrderedDict[str, model.Product] = OrderedDict()
+        # the version of each product as last loaded or committed
+        self.versions: dict[str, int] = {}
+
+    def run(self):
+        with self.uow:
+            while True:
+                commands = self._next_commands()
+                if not commands:
+                    return
+                self._process(commands)
+
+    def _next_commands(self) -> list[_Command]:
+        command = self.queue.get()
+        commands = []
+        while command is not _STOP:
+            commands.append(command)
+            if len(commands) == self.max_batch:
+                break
+            try:
+                command = self.queue.get_nowait()
+            except queue.Empty:
+                break
+        else:
+            if commands:
+                self.queue.put(_STOP)
+        return commands
+
+    def _process(self, commands: list[_Command]):
+        for _ in range(MAX_ATTEMPTS):
+            try:
+                self._load({c.sku for c in commands})
+                outcomes = [self._apply(c) for c in commands]
+                failed = {c.sku for c, o in zip(commands, outcomes) if _failed(o)}
+                if self._changed_elsewhere(failed):
+                    raise unit_of_work.VersionConflict("product changed elsewhere")
+                self.uow.commit()
+                self._committed({c.sku for c in commands})
+            except unit_of_work.VersionConflict:
+                self._reset()
+                continue
+            except Exception as e:
+                self._reset()
+                for command in commands:
+                    command.future.set_exception(e)
+                return
+            for command, (result, error) in zip(commands, outcomes):
+                if error is None:
+                    command.future.set_result(result)
+                else:
+                    command.future.set_exception(error)
+            return
+        self._reset()
+        for command in commands:
+            command.future.set_exception(
+                ConcurrentUpdate(f"Gave up after {MAX_ATTEMPTS} conflicting attempts")
+            )
+
+    def _load(self, skus: set[str]):
+        for sku in skus & self.products.keys():
+            self.products.move_to_end(sku)
+        missing = skus - self.products.keys()
+        if missing:
+            for product in self.uow.products.get_many(missing):
+                self.products[product.sku] = product
+                self.versions[product.sku] = product.version_number
+
+    def _changed_elsewhere(self, skus: set[str]) -> bool:
+        # a failure may come from stock added by a writer bypassing the worker
+        held = skus & self.versions.keys()
+        if not held:
+            return False
+        stored = self.uow.products.version_numbers(held)
+        return any(stored.get(sku) != self.versions[sku] for sku in held)
+
+    def _committed(self, skus: set[str]):
+        for sku in skus & self.products.keys():
+            self.versions[sku] = self.products[sku].version_number
+        # only once committed, as the events of seen products are written then
+        while len(self.products) > self.max_products:
+            sku, product = self.products.popitem(last=False)
+            del self.versions[sku]
+            self.uow.products.seen.discard(product)
+
+    def _apply(self, command: _Command) -> _Outcome:
+        product = self.products.get(command.sku)
+        if product is None and command.create:
+            product = model.Product(command.sku, batches=[])
+            self.uow.products.add(product)
+            self.products[command.sku] = product
+        try:
+            return command.handle(product), None
+        except EXPECTED_ERRORS as e:
+            return None, e
+
+    def _reset(self):
+        # a rollback discards our in-memory state too; reload on the next attempt
+        self.uow.rollback()
+        self.products.clear()
+        self.versions.clear()
+
+
+def _failed(outcome: _Outcome) -> bool:
+    # an error, or a result holding one, as bulk allocations return
+    result, error = outcome
+    return error is not None or _holds_error(result)
+
+
+def _holds_error(result: object) -> bool:
+    if isinstance(result, (list, tuple)):
+        return any(_holds_error(r) for r in result)
+    return isinstance(result, Exception)
+
+
+class AllocationDispatcher:
+    def __init__(
+        self,
+        uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork] = default_uow,
+        workers: int = 4,
+        max_batch: int = 100,
+        max_products: int = 1000,
+    ):
+        self._workers = [
+            _Worker(uow_factory(), max_batch, max_products) for _ in range(workers)
+        ]
+
+    def start(self) -> "AllocationDispatcher":
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def stop(self):
+        for worker in self._workers:
+            worker.queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self) -> "AllocationDispatcher":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def shard(self, sku: str) -> int:
+        # crc32 rather than hash() so the mapping is the same in every process
+        return zlib.crc32(sku.encode()) % len(self._workers)
+
+    def _submit(self, command: _Command) -> Future:
+        self._workers[self.shard(command.sku)].queue.put(command)
+        return command.future
+
+    def add_batch(
+        self, reference: str, sku: str, quantity: int, eta: Optional[date]
+    ) -> Future:
+        def handle(product):
+            # the endpoint checks the stored batches, this catches racing requests
+            if any(b.reference == reference for b in product.batches):
+                raise DuplicateBatchReference(
+                    f"Duplicate batch reference {reference}"
+                )
+            product.add_batch(model.Batch(reference, sku, quantity, eta))
+
+        return self._submit(_Command(sku, handle, create=True))
+
+    def allocate(self, line: model.OrderLine) -> Future:
+        def handle(product):
+            if product is None:
+                raise InvalidSku(f"Invalid sku {line.sku}")
+            return product.allocate(line)
+
+        return self._submit(_Command(line.sku, handle))
+
+    def deallocate(self, order_reference: str, sku: str) -> Future:
+        def handle(product):
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+            return product.deallocate(order_reference)
+
+        return self._submit(_Command(sku, handle))
+
+    def change_batch_quantity(
+        self, reference: str, sku: str, quantity: int
+    ) -> Future:
+        def handle(product):
+            if product is None or reference not in (
+                b.reference for b in product.batches
+            ):
+                raise InvalidBatchReference(f"Invalid batch reference {reference}")
+            return moved_lines(product.change_batch_quantity(reference, quantity))
+
+        return self._submit(_Command(sku, handle))
+
+    def allocate_many(self, lines: list[model.OrderLine]) -> Future:
+        def allocate(lines, product):
+            return allocate_lines(lines, {product.sku: product} if product else {})
+
+        return self._submit_per_sku(lines, allocate)
+
+    def allocate_order(
+        self,
+        lines: list[model.OrderLine],
+        objective: str = planner.EARLIEST_SHIP_DATE,
+        budget: float = 0.05,
+    ) -> Future:
+        """Plans the lines of each SKU on their own, as each SKU has its own
+        worker; the objective is met SKU by SKU."""
+
+        def allocate(lines, product):
+            products = {product.sku: product} if product else {}
+            return allocate_as_planned(lines, products, objective, budget)
+
+        return self._submit_per_sku(lines, allocate)
+
+    def _submit_per_sku(
+        self,
+        lines: list[model.OrderLine],
+        allocate: Callable[[list, Optional[model.Product]], list],
+    ) -> Future:
+        # one command per SKU; the future holds a result for each line, in order
+        groups: dict[str, list[int]] = {}
+        for i, line in enumerate(lines):
+            groups.setdefault(line.sku, []).append(i)
+        combined: Future = Future()
+        results: list[Union[str, Exception]] = [""] * len(lines)
+        remaining = [len(groups)]
+        lock = threading.Lock()
+
+        def done(indices: list[int], future: Future):
+            error = future.exception()
+            values = [error] * len(indices) if error else future.result()
+            for i, value in zip(indices, values):
+                results[i] = value
+            with lock:
+                remaining[0] -= 1
+                finished = not remaining[0]
+            if finished:
+                combined.set_result(results)
+
+        if not groups:
+            combined.set_result(results)
+        for sku, indices in groups.items():
+            handle = functools.partial(allocate, [lines[i] for i in indices])
+            future = self._submit(_Command(sku, handle))
+            future.add_done_callback(functools.partial(done, indices))
+        return combined
@@ -0,0 +1,162 @@
+"""Exports the allocation state for reporting and reconciliation jobs.
+
+A snapshot holds every batch with its allocations, read in one transaction,
+and the outbox position it was taken at. A change stream started from that
+position then yields the batches created or resized, and the lines allocated and
+deallocated, by every later commit. On PostgreSQL the snapshot also records the
+transactions still running when it was taken, whose outbox rows can have ids
+below its position.
+"""
+
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+from typing import TextIO
+
+from adapters import snapshots
+from service_layer import unit_of_work
+
+# a consistent view that neither blocks nor is aborted by live allocations
+SNAPSHOT_OPTIONS = dict(
+    isolation_level="SERIALIZABLE",
+    postgresql_readonly=True,
+    postgresql_deferrable=True,
+)
+
+
+@dataclass
+class SnapshotReport:
+    position: int
+    snapshot: Optional[str] = None
+    batches: int = 0
+    allocations: int = 0
+    seconds: float = 0.0
+
+
+def export_snapshot(
+    out: TextIO,
+    session_factory=unit_of_work.DEFAULT_SESSION_FACTORY,
+    chunk_size: int = 1000,
+) -> SnapshotReport:
+    """Writes a header record with the snapshot position, and on PostgreSQL the
+    transaction snapshot, then one JSON line per batch."""
+    start = time.perf_counter()
+    with session_factory() as session:
+        session.connection(execution_options=SNAPSHOT_OPTIONS)
+        report = SnapshotReport(
+            snapshots.position(session), snapshots.transaction_snapshot(session)
+        )
+        header = dict(
+            type="snapshot",
+            position=report.position,
+            snapshot=report.snapshot,
+            taken_at=datetime.utcnow().isoformat(),
+        )
+        out.write(json.dumps(header) + "\n")
+        for record in snapshots.batch_records(session, chunk_size):
+            out.write(json.dumps(record) + "\n")
+            report.batches += 1
+            report.allocations += len(record["allocations"])
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+class ChangeStream:
+    """Change records in outbox order, from a snapshot position onwards.
+
+    Outbox ids come from a sequence, so a transaction can commit a lower id
+    after a higher one has been read. The position does not move past a missing
+    id until that id shows up, or until ``gap_timeout`` seconds have passed, as
+    a rolled back transaction leaves a gap for good. Records above a gap are
+    passed on as they arrive, and only once.
+
+    Given the ``snapshot`` of an export, the stream also passes on rows at or
+    below the position that the export could not see, as the transactions that
+    were running when it was taken commit them.
+    """
+
+    def __init__(
+        self,
+        position: int,
+        session_factory=unit_of_work.DEFAULT_SESSION_FACTORY,
+        batch_size: int = 1000,
+        gap_timeout: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+        snapshot: Optional[str] = None,
+    ):
+        self.position = position
+        self.snapshot = snapshot
+        self._snapshot_position = position
+        self._late: set[int] = set()
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self._clock = clock
+        self._delivered: set[int] = set()
+        self._gaps: dict[int, float] = {}
+
+    def poll(self) -> list[dict]:
+        with self.session_factory() as session:
+            records = self._late_records(session)
+            rows = snapshots.changes_after(session, self.position, self.batch_size)
+        now = self._clock()
+        expected = self.position + 1
+        for id, event_type, payload in rows:
+            for missing in range(expected, id):
+                self._gaps.setdefault(missing, now)
+            expected = id + 1
+            self._gaps.pop(id, None)
+            if id in self._delivered:
+                continue
+            self._delivered.add(id)
+            if event_type in snapshots.CHANGE_TYPES:
+                records.append(_record(id, event_type, payload))
+        self._advance(now)
+        return records
+
+    def _late_records(self, session) -> list[dict]:
+        if self.snapshot is None:
+            return []
+        ended, rows = snapshots.late_changes(
+            session, self._snapshot_position, self.snapshot
+        )
+        records = [
+            _record(id, event_type, payload)
+            for id, event_type, payload in rows
+            if id not in self._late and event_type in snapshots.CHANGE_TYPES
+        ]
+        self._late.update(id for id, _, _ in rows)
+        if ended:
+            # every transaction the export could not see has committed or not
+            self.snapshot = None
+            self._late.clear()
+        return records
+
+    def _advance(self, now: float) -> None:
+        while True:
+            following = self.position + 1
+            if following in self._delivered:
+                self._delivered.remove(following)
+            elif (
+                following in self._gaps
+                and now - self._gaps[following] >= self.gap_timeout
+            ):
+                del self._gaps[following]
+            else:
+                return
+            self.position = following
+
+    def follow(self, interval: float = 1.0) -> Iterator[dict]:
+        while True:
+            records = self.poll()
+            yield from records
+            if len(records) < self.batch_size:
+                time.sleep(interval)
+
+
+def _record(id: int, event_type: str, payload: dict) -> dict:
+    return dict(type="change", position=id, event=event_type, **payload)
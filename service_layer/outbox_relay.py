@@ -0,0 +1,66 @@
+"""Delivers outbox messages to a publisher from a background thread.
+
+Messages are marked published in the transaction that fetched them, after
+the publisher has accepted them. A crash in between means they are published
+again: delivery is at least once, and consumers can dedupe on message id.
+"""
+
+import logging
+import threading
+from typing import Optional
+
+from adapters import outbox
+from adapters.publishers import AbstractPublisher
+from service_layer import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    def __init__(
+        self,
+        publisher: AbstractPublisher,
+        session_factory=unit_of_work.DEFAULT_SESSION_FACTORY,
+        batch_size: int = 100,
+        interval: float = 0.5,
+    ):
+        self.publisher = publisher
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def relay_once(self) -> int:
+        session = self.session_factory()
+        try:
+            messages = outbox.fetch_unpublished(session, self.batch_size)
+            if messages:
+                self.publisher.publish(messages)
+                outbox.mark_published(session, [m.id for m in messages])
+            session.commit()
+            return len(messages)
+        finally:
+            session.close()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                relayed = self.relay_once()
+            except Exception:
+                logger.exception("Relaying the outbox failed, will retry")
+                relayed = 0
+            # a full batch suggests more are waiting: go again straight away
+            if relayed < self.batch_size:
+                self._stopped.wait(self.interval)
+
+    def start(self) -> "OutboxRelay":
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -1,31 +1,245 @@
+from datetime import date
+from typing import Callable
+from typing import Optional
+from typing import TypeVar
+from typing import Union
+
 from domain import model
+from domain import planner
 from domain.model import OrderLine
-from adapters.repository import AbstractRepository
+from adapters import metrics
+from service_layer import unit_of_work
+
+MAX_ATTEMPTS = 10
+
+T = TypeVar("T")
 
 
 class InvalidSku(Exception):
     pass
 
 
-def is_valid_sku(sku, batches):
-    return sku in {b.sku for b in batches}
+class InvalidBatchReference(Exception):
+    pass
+
+
+class DuplicateBatchReference(Exception):
+    pass
+
+
+class ConcurrentUpdate(Exception):
+    pass
+
+
+def commit_with_retries(
+    uow: unit_of_work.AbstractUnitOfWork, operation: Callable[[], T]
+) -> T:
+    """Runs the operation in the unit of work and commits it, running it again
+    on a version conflict, up to MAX_ATTEMPTS times."""
+    for _ in range(MAX_ATTEMPTS):
+        with uow:
+            try:
+                result = operation()
+            except model.OutOfStock:
+                # running out of stock is an event too: record it, then report it
+                uow.commit()
+                raise
+            try:
+                uow.commit()
+            except unit_of_work.VersionConflict:
+                continue
+            return result
+    raise ConcurrentUpdate(f"Gave up after {MAX_ATTEMPTS} conflicting attempts")
+
+
+def add_batch(
+    reference: str,
+    sku: str,
+    quantity: int,
+    eta: Optional[date],
+    uow: unit_of_work.AbstractUnitOfWork,
+) -> None:
+    def _add_batch():
+        _reject_taken_reference(reference, uow)
+        product = uow.products.get(sku=sku)
+        if product is None:
+            product = model.Product(sku, batches=[])
+            uow.products.add(product)
+        product.add_batch(model.Batch(reference, sku, quantity, eta))
+
+    commit_with_retries(uow, _add_batch)
+
+
+def check_new_batch_reference(
+    reference: str, uow: unit_of_work.AbstractUnitOfWork
+) -> None:
+    with uow:
+        _reject_taken_reference(reference, uow)
+
+
+def _reject_taken_reference(reference: str, uow: unit_of_work.AbstractUnitOfWork):
+    if uow.products.get_by_batchref(reference) is not None:
+        raise DuplicateBatchReference(f"Duplicate batch reference {reference}")
+
+
+def allocate(line: OrderLine, uow: unit_of_work.AbstractUnitOfWork) -> str:
+    def _allocate():
+        product = uow.products.get(sku=line.sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {line.sku}")
+        with metrics.span("domain.allocate"):
+            return product.allocate(line)
+
+    return commit_with_retries(uow, _allocate)
+
+
+def allocate_set_based(line: OrderLine, uow: unit_of_work.AbstractUnitOfWork) -> str:
+    def _allocate():
+        batchref = uow.products.allocate_set_based(line)
+        if batchref is None:
+            raise InvalidSku(f"Invalid sku {line.sku}")
+        return batchref
 
+    return commit_with_retries(uow, _allocate)
 
-def allocate(line: OrderLine, repo: AbstractRepository, session) -> str:
-    batches = repo.list()
-    if not is_valid_sku(line.sku, batches):
-        raise InvalidSku(f"Invalid sku {line.sku}")
-    batchref = model.allocate(line, batches)
-    session.commit()
-    return batchref
+
+def allocate_lines(
+    lines: list[OrderLine], products: dict[str, model.Product]
+) -> list[Union[str, Exception]]:
+    """Allocates each line on its own, in a deterministic order, and returns a
+    batch reference or the error for each line."""
+    results: list[Union[str, Exception]] = [""] * len(lines)
+    order = sorted(
+        range(len(lines)), key=lambda i: (lines[i].sku, lines[i].order_reference)
+    )
+    for i in order:
+        line = lines[i]
+        product = products.get(line.sku)
+        if product is None:
+            results[i] = InvalidSku(f"Invalid sku {line.sku}")
+            continue
+        try:
+            with metrics.span("domain.allocate"):
+                results[i] = product.allocate(line)
+        except model.OutOfStock as e:
+            results[i] = e
+    return results
+
+
+def allocate_as_planned(
+    lines: list[OrderLine],
+    products: dict[str, model.Product],
+    objective: str = planner.EARLIEST_SHIP_DATE,
+    budget: float = 0.05,
+) -> list[Union[str, Exception]]:
+    """Allocates the lines of one order together, as planned for the objective,
+    and returns a batch reference or the error for each line."""
+    results: list[Union[str, Exception]] = [""] * len(lines)
+    for i, line in enumerate(lines):
+        if line.sku not in products:
+            results[i] = InvalidSku(f"Invalid sku {line.sku}")
+    # the order allocate_lines takes lines in, for the greedy fallback
+    order = sorted(
+        (i for i, line in enumerate(lines) if line.sku in products),
+        key=lambda i: lines[i].sku,
+    )
+    index = model.BatchIndex(b for p in products.values() for b in p.batches)
+    with metrics.span("domain.plan"):
+        plan = planner.plan([lines[i] for i in order], index, objective, budget)
+    for i, (line, batch) in zip(order, plan.allocations):
+        try:
+            results[i] = products[line.sku].allocate_to(line, batch)
+        except model.OutOfStock as e:
+            results[i] = e
+    return results
+
+
+def allocate_many(
+    lines: list[OrderLine], uow: unit_of_work.AbstractUnitOfWork
+) -> list[Union[str, Exception]]:
+    def _allocate_many():
+        products = {
+            p.sku: p for p in uow.products.get_many({line.sku for line in lines})
+        }
+        return allocate_lines(lines, products)
+
+    return commit_with_retries(uow, _allocate_many)
+
+
+def allocate_order(
+    lines: list[OrderLine],
+    uow: unit_of_work.AbstractUnitOfWork,
+    objective: str = planner.EARLIEST_SHIP_DATE,
+    budget: float = 0.05,
+) -> list[Union[str, Exception]]:
+    """Allocates the lines of one order together, as planned for the objective,
+    rather than line by line."""
+
+    def _allocate_order():
+        products = {
+            p.sku: p for p in uow.products.get_many({line.sku for line in lines})
+        }
+        return allocate_as_planned(lines, products, objective, budget)
+
+    return commit_with_retries(uow, _allocate_order)
+
+
+def moved_lines(
+    moved: list[tuple[OrderLine, Union[str, Exception]]],
+) -> list[tuple[OrderLine, Union[str, Exception]]]:
+    # copies, as the mapped lines expire with the commit
+    return [
+        (OrderLine(line.order_reference, line.sku, line.quantity), result)
+        for line, result in moved
+    ]
+
+
+def batch_sku(reference: str, uow: unit_of_work.AbstractUnitOfWork) -> str:
+    with uow:
+        product = uow.products.get_by_batchref(reference)
+        if product is None:
+            raise InvalidBatchReference(f"Invalid batch reference {reference}")
+        return product.sku
+
+
+def change_batch_quantity(
+    reference: str, quantity: int, uow: unit_of_work.AbstractUnitOfWork
+) -> list[tuple[OrderLine, Union[str, Exception]]]:
+    """Resizes a batch, moving the lines it can no longer hold to other batches
+    of its SKU in the same commit."""
+
+    def _change_batch_quantity():
+        product = uow.products.get_by_batchref(reference)
+        if product is None:
+            raise InvalidBatchReference(f"Invalid batch reference {reference}")
+        with metrics.span("domain.change_batch_quantity"):
+            return moved_lines(product.change_batch_quantity(reference, quantity))
+
+    return commit_with_retries(uow, _change_batch_quantity)
 
 
 def deallocate(
-    order_reference: str, sku: str, repo: AbstractRepository, session
+    order_reference: str, sku: str, uow: unit_of_work.AbstractUnitOfWork
 ) -> str:
-    batches = repo.list()
-    if not is_valid_sku(sku, batches):
-        raise InvalidSku(f"Invalid sku {sku}")
-    batchref = model.deallocate(order_reference, sku, batches)
-    session.commit()
-    return batchref
+    def _deallocate():
+        product = uow.products.get(sku=sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {sku}")
+        with metrics.span("domain.deallocate"):
+            return product.deallocate(order_reference)
+
+    return commit_with_retries(uow, _deallocate)
+
+
+def availability(
+    sku: str, uow: unit_of_work.AbstractUnitOfWork
+) -> tuple[model.BatchAvailability, ...]:
+    with uow:
+        return uow.products.availability(sku)
+
+
+def availability_many(
+    skus: list[str], uow: unit_of_work.AbstractUnitOfWork
+) -> dict[str, tuple[model.BatchAvailability, ...]]:
+    with uow:
+        return uow.products.availability_many(skus)
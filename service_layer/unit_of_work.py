@@ -0,0 +1,110 @@
+import abc
+from typing import Iterator
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+
+import config
+from domain import events
+from adapters import metrics
+from adapters import orm
+from adapters import outbox
+from adapters import read_model
+from adapters import repository
+from adapters.cache import LRUCache
+
+
+class VersionConflict(Exception):
+    pass
+
+
+class AbstractUnitOfWork(abc.ABC):
+    products: repository.AbstractRepository
+    _depth = 0
+
+    def __enter__(self) -> "AbstractUnitOfWork":
+        # nested blocks join the outermost one, which owns the transaction
+        self._depth += 1
+        if self._depth == 1:
+            self._begin()
+        return self
+
+    def __exit__(self, *args):
+        self._depth -= 1
+        if self._depth == 0:
+            self.rollback()
+            self._end()
+
+    def commit(self):
+        if self._depth <= 1:
+            self._commit()
+
+    def collect_new_events(self) -> Iterator[events.Event]:
+        for product in self.products.seen:
+            while product.events:
+                yield product.events.pop(0)
+
+    def _begin(self):
+        pass
+
+    def _end(self):
+        pass
+
+    @abc.abstractmethod
+    def _commit(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def rollback(self):
+        raise NotImplementedError
+
+
+DEFAULT_ENGINE = create_engine(config.get_database_uri(), **config.get_pool_options())
+DEFAULT_SESSION_FACTORY = sessionmaker(bind=DEFAULT_ENGINE)
+
+
+class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
+    def __init__(
+        self,
+        session_factory=DEFAULT_SESSION_FACTORY,
+        cache: Optional[LRUCache] = None,
+    ):
+        self.session_factory = session_factory
+        self.cache = cache
+
+    def _begin(self):
+        self.session = self.session_factory()
+        self.products = repository.SqlAlchemyRepository(self.session)
+        if self.cache is not None:
+            self.products = repository.CachingRepository(self.products, self.cache)
+
+    def _end(self):
+        self.session.close()
+
+    def _commit(self):
+        outbox.add(self.session, self.collect_new_events())
+        try:
+            with metrics.span("session.flush"):
+                self.session.flush()
+            changed = orm.pop_changed_batches(self.session)
+            with metrics.span("read_model.refresh"):
+                read_model.refresh(self.session, changed)
+            # before the commit expires them, which would reload each batch
+            written = {b.sku for b in changed} | self.products.written
+            with metrics.span("session.commit"):
+                self.session.commit()
+        except StaleDataError as e:
+            raise VersionConflict(str(e)) from e
+        self.products.written.clear()
+        if self.cache is not None:
+            for sku in written:
+                self.cache.invalidate(sku)
+
+    def rollback(self):
+        self.session.rollback()
+        for product in self.products.seen:
+            product.events.clear()
+        self.products.seen.clear()
+        self.products.written.clear()
@@ -1,15 +1,25 @@
+import asyncio
 import time
+from datetime import date
 from pathlib import Path
 
 import pytest
 import requests
 from sqlalchemy import create_engine
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
 
 import config
+from domain import model
+from adapters import migrations
 from adapters.orm import metadata
 from adapters.orm import start_mappers
+from service_layer import services
+from service_layer import unit_of_work
+from service_layer.async_unit_of_work import AsyncSqlAlchemyUnitOfWork
+from tests.query_counter import QueryCounter
 
 
 @pytest.fixture
@@ -20,12 +30,74 @@ def in_memory_db():
 
 
 @pytest.fixture
-def session(in_memory_db):
+def query_counter(in_memory_db):
+    return QueryCounter(in_memory_db)
+
+
+@pytest.fixture
+def session_factory(in_memory_db):
+    start_mappers()
+    yield sessionmaker(bind=in_memory_db)
+    clear_mappers()
+
+
+@pytest.fixture
+def session(session_factory):
+    return session_factory()
+
+
+@pytest.fixture
+def sqlite_session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+    metadata.create_all(engine)
+    start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+
+
+@pytest.fixture
+def async_session_factory(tmp_path):
+    db_path = tmp_path / "allocation.db"
+    metadata.create_all(create_engine(f"sqlite:///{db_path}"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
     start_mappers()
-    yield sessionmaker(bind=in_memory_db)()
+    yield sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
     clear_mappers()
 
 
+async def _add_stock_async(session_factory, batches):
+    uow = AsyncSqlAlchemyUnitOfWork(session_factory)
+    async with uow:
+        for reference, sku, quantity, eta in batches:
+            product = await uow.products.get(sku)
+            if product is None:
+                product = model.Product(sku, [])
+                uow.products.add(product)
+            product.add_batch(model.Batch(reference, sku, quantity, eta))
+        await uow.commit()
+
+
+@pytest.fixture
+def add_stock_to():
+    """Adds ``(reference, sku, quantity, eta)`` batches to the database behind a
+    session factory, through the service layer or its async counterpart."""
+
+    def _add_stock_to(session_factory, batches):
+        if issubclass(session_factory.class_, AsyncSession):
+            asyncio.run(_add_stock_async(session_factory, batches))
+            return
+        for reference, sku, quantity, eta in batches:
+            services.add_batch(
+                reference,
+                sku,
+                quantity,
+                eta,
+                unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+            )
+
+    return _add_stock_to
+
+
 def wait_for_postgres_to_come_up(engine):
     deadline = time.time() + 10
     while time.time() < deadline:
@@ -51,7 +123,7 @@ def wait_for_webapp_to_come_up():
 def postgres_db():
     engine = create_engine(config.get_postgres_uri())
     wait_for_postgres_to_come_up(engine)
-    metadata.create_all(engine)
+    migrations.migrate(engine)
     return engine
 
 
@@ -62,6 +134,53 @@ def postgres_session(postgres_db):
     clear_mappers()
 
 
+@pytest.fixture
+def add_stock(postgres_db, postgres_session, add_stock_to):
+    batches_added = set()
+    skus_added = set()
+
+    def _add_stock(lines):
+        lines = [
+            (ref, sku, qty, eta and date.fromisoformat(eta))
+            for ref, sku, qty, eta in lines
+        ]
+        # through the service layer, so the availability rows are written too
+        add_stock_to(sessionmaker(bind=postgres_db), lines)
+        for ref, sku, _, _ in lines:
+            [[batch_id]] = postgres_session.execute(
+                "SELECT id FROM batches WHERE reference=:ref AND sku=:sku",
+                dict(ref=ref, sku=sku),
+            )
+            batches_added.add(batch_id)
+            skus_added.add(sku)
+
+    yield _add_stock
+
+    for batch_id in batches_added:
+        postgres_session.execute(
+            "DELETE FROM allocations WHERE batch_id=:batch_id",
+            dict(batch_id=batch_id),
+        )
+        postgres_session.execute(
+            "DELETE FROM batches WHERE id=:batch_id",
+            dict(batch_id=batch_id),
+        )
+    for sku in skus_added:
+        postgres_session.execute(
+            "DELETE FROM order_lines WHERE sku=:sku",
+            dict(sku=sku),
+        )
+        postgres_session.execute(
+            "DELETE FROM availability WHERE sku=:sku",
+            dict(sku=sku),
+        )
+        postgres_session.execute(
+            "DELETE FROM products WHERE sku=:sku",
+            dict(sku=sku),
+        )
+        postgres_session.commit()
+
+
 @pytest.fixture
 def restart_api():
     (Path(__file__).parent.parent / "entrypoints" / "flask_app.py").touch()
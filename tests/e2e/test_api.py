@@ -1,64 +1,52 @@
-import uuid
-
 import pytest
 import requests
 
 import config
+from tests.random_refs import random_batchref
+from tests.random_refs import random_orderid
+from tests.random_refs import random_sku
 
 
-@pytest.fixture
-def add_stock(postgres_session):
-    batches_added = set()
-    skus_added = set()
-
-    def _add_stock(lines):
-        for ref, sku, qty, eta in lines:
-            postgres_session.execute(
-                "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
-                " VALUES (:ref, :sku, :qty, :eta)",
-                dict(ref=ref, sku=sku, qty=qty, eta=eta),
-            )
-            [[batch_id]] = postgres_session.execute(
-                "SELECT id FROM batches WHERE reference=:ref AND sku=:sku",
-                dict(ref=ref, sku=sku),
-            )
-            batches_added.add(batch_id)
-            skus_added.add(sku)
-        postgres_session.commit()
-
-    yield _add_stock
-
-    for batch_id in batches_added:
-        postgres_session.execute(
-            "DELETE FROM allocations WHERE batch_id=:batch_id",
-            dict(batch_id=batch_id),
-        )
-        postgres_session.execute(
-            "DELETE FROM batches WHERE id=:batch_id",
-            dict(batch_id=batch_id),
-        )
-    for sku in skus_added:
-        postgres_session.execute(
-            "DELETE FROM order_lines WHERE sku=:sku",
-            dict(sku=sku),
-        )
-        postgres_session.commit()
-
+@pytest.mark.usefixtures("restart_api")
+def test_add_batch_then_allocate(postgres_session):
+    sku, batch, orderid = random_sku(), random_batchref(), random_orderid()
+    url = config.get_api_url()
 
-def random_suffix():
-    return uuid.uuid4().hex[:6]
+    r = requests.post(
+        f"{url}/add_batch",
+        json={"reference": batch, "sku": sku, "quantity": 100, "eta": "2011-01-02"},
+    )
+    assert r.status_code == 201
 
+    data = {"order_reference": orderid, "sku": sku, "quantity": 3}
+    r = requests.post(f"{url}/allocate", json=data)
+    assert r.status_code == 201
+    assert r.json()["batchref"] == batch
 
-def random_sku(name=""):
-    return f"sku-{name}-{random_suffix()}"
+    for sql in [
+        "DELETE FROM allocations WHERE batch_id IN"
+        " (SELECT id FROM batches WHERE sku=:sku)",
+        "DELETE FROM order_lines WHERE sku=:sku",
+        "DELETE FROM batches WHERE sku=:sku",
+        "DELETE FROM products WHERE sku=:sku",
+    ]:
+        postgres_session.execute(sql, dict(sku=sku))
+    postgres_session.commit()
 
 
-def random_batchref(name=""):
-    return f"batch-{name}-{random_suffix()}"
+@pytest.mark.usefixtures("restart_api")
+def test_adding_a_batch_reference_twice_returns_400(add_stock):
+    sku, batch = random_sku(), random_batchref()
+    add_stock([(batch, sku, 100, None)])
+    url = config.get_api_url()
 
+    r = requests.post(
+        f"{url}/add_batch",
+        json={"reference": batch, "sku": sku, "quantity": 10, "eta": None},
+    )
 
-def random_orderid(name=""):
-    return f"order-{name}-{random_suffix()}"
+    assert r.status_code == 400
+    assert r.json()["message"] == f"Duplicate batch reference {batch}"
 
 
 @pytest.mark.usefixtures("restart_api")
@@ -100,7 +88,7 @@ def test_unhappy_path_returns_400_and_error_message():
 def test_deallocate(add_stock):
     sku, order1, order2 = random_sku(), random_orderid(), random_orderid()
     batch = random_batchref()
-    add_stock([(batch, sku, 100, "2011-01-2")])
+    add_stock([(batch, sku, 100, "2011-01-02")])
 
     url = config.get_api_url()
     # fully allocate
@@ -131,3 +119,195 @@ def test_deallocate(add_stock):
     )
     assert r.ok
     assert r.json()["batchref"] == batch
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_deallocating_an_unknown_order_returns_400(add_stock):
+    sku, orderid = random_sku(), random_orderid()
+    add_stock([(random_batchref(), sku, 100, None)])
+    url = config.get_api_url()
+
+    r = requests.post(
+        f"{url}/deallocate", json={"order_reference": orderid, "sku": sku}
+    )
+
+    assert r.status_code == 400
+    assert orderid in r.json()["message"]
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_bulk_allocate_returns_a_result_per_line(add_stock):
+    sku, unknown_sku = random_sku(), random_sku("unknown")
+    batch = random_batchref()
+    add_stock([(batch, sku, 10, None)])
+    order1, order2 = random_orderid(1), random_orderid(2)
+    data = {
+        "lines": [
+            {"order_reference": order1, "sku": sku, "quantity": 10},
+            {"order_reference": order2, "sku": sku, "quantity": 10},
+            {"order_reference": order1, "sku": unknown_sku, "quantity": 10},
+        ]
+    }
+    url = config.get_api_url()
+
+    r = requests.post(f"{url}/allocate/bulk", json=data)
+
+    assert r.status_code == 201
+    assert r.json()["results"] == [
+        {"batchref": batch},
+        {"message": f"Out of stock for sku {sku}"},
+        {"message": f"Invalid sku {unknown_sku}"},
+    ]
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_sessions_are_returned_to_the_pool_after_each_request(add_stock):
+    sku, batch = random_sku(), random_batchref()
+    add_stock([(batch, sku, 100, None)])
+    url = config.get_api_url()
+
+    for _ in range(3):
+        data = {"order_reference": random_orderid(), "sku": sku, "quantity": 1}
+        requests.post(f"{url}/allocate", json=data)
+    requests.post(
+        f"{url}/allocate", json={"order_reference": "o", "sku": "", "quantity": 1}
+    )
+
+    r = requests.get(f"{url}/pool-stats")
+
+    assert r.status_code == 200
+    assert r.json()["checked_out"] == 0
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_availability_reports_batches_for_a_sku(add_stock):
+    sku, earlybatch, laterbatch = random_sku(), random_batchref(1), random_batchref(2)
+    add_stock([(laterbatch, sku, 100, "2011-01-02"), (earlybatch, sku, 50, None)])
+    url = config.get_api_url()
+    data = {"order_reference": random_orderid(), "sku": sku, "quantity": 10}
+    requests.post(f"{url}/allocate", json=data)
+
+    r = requests.get(f"{url}/availability/{sku}")
+
+    assert r.status_code == 200
+    assert r.json() == {
+        "sku": sku,
+        "available_quantity": 140,
+        "batches": [
+            {"batchref": earlybatch, "eta": None, "available_quantity": 40},
+            {"batchref": laterbatch, "eta": "2011-01-02", "available_quantity": 100},
+        ],
+    }
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_availability_for_unknown_sku_returns_404():
+    sku = random_sku()
+    url = config.get_api_url()
+
+    r = requests.get(f"{url}/availability/{sku}")
+
+    assert r.status_code == 404
+    assert r.json()["message"] == f"Invalid sku {sku}"
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_availability_for_several_skus(add_stock):
+    sku, othersku, unknown_sku = (
+        random_sku(),
+        random_sku("other"),
+        random_sku("unknown"),
+    )
+    batch, otherbatch = random_batchref(1), random_batchref(2)
+    add_stock([(batch, sku, 100, None), (otherbatch, othersku, 20, None)])
+    url = config.get_api_url()
+    for s in (sku, othersku):
+        data = {"order_reference": random_orderid(), "sku": s, "quantity": 10}
+        requests.post(f"{url}/allocate", json=data)
+
+    r = requests.get(
+        f"{url}/availability", params={"sku": [sku, othersku, unknown_sku]}
+    )
+
+    assert r.status_code == 200
+    assert [
+        (result["sku"], result["available_quantity"])
+        for result in r.json()["results"]
+    ] == [(sku, 90), (othersku, 10), (unknown_sku, 0)]
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_metrics_report_request_latency_and_sql_counts(add_stock):
+    sku, batch = random_sku(), random_batchref()
+    add_stock([(batch, sku, 100, None)])
+    url = config.get_api_url()
+    data = {"order_reference": random_orderid(), "sku": sku, "quantity": 1}
+    requests.post(f"{url}/allocate", json=data)
+
+    r = requests.get(f"{url}/metrics")
+
+    assert r.status_code == 200
+    assert 'allocation_http_request_seconds_count{endpoint="/allocate"' in r.text
+    assert (
+        'allocation_sql_statements_per_request_count{endpoint="/allocate"}' in r.text
+    )
+    assert 'allocation_stage_seconds_count{stage="session.commit"}' in r.text
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_retried_allocation_with_an_idempotency_key_replays_the_outcome(add_stock):
+    sku, batch = random_sku(), random_batchref()
+    add_stock([(batch, sku, 10, None)])
+    url = config.get_api_url()
+    headers = {"Idempotency-Key": random_orderid("key")}
+    data = {"order_reference": random_orderid(), "sku": sku, "quantity": 10}
+
+    first = requests.post(f"{url}/allocate", json=data, headers=headers)
+    retry = requests.post(f"{url}/allocate", json=data, headers=headers)
+    other = requests.post(
+        f"{url}/allocate", json={**data, "quantity": 1}, headers=headers
+    )
+
+    assert (first.status_code, retry.status_code) == (201, 201)
+    assert retry.json() == first.json() == {"batchref": batch}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert other.status_code == 422
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_allocate_order_plans_the_lines_together(add_stock):
+    sku, small, large = random_sku(), random_batchref(1), random_batchref(2)
+    add_stock([(small, sku, 5, None), (large, sku, 10, "2011-01-02")])
+    data = {
+        "objective": "fewest_batches",
+        "lines": [
+            {"order_reference": random_orderid(1), "sku": sku, "quantity": 5},
+            {"order_reference": random_orderid(2), "sku": sku, "quantity": 5},
+        ],
+    }
+    url = config.get_api_url()
+
+    r = requests.post(f"{url}/allocate/order", json=data)
+
+    assert r.status_code == 201
+    assert r.json()["results"] == [{"batchref": large}, {"batchref": large}]
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_change_batch_quantity_reallocates_lines_the_batch_cannot_hold(add_stock):
+    sku, small, large = random_sku(), random_batchref(1), random_batchref(2)
+    first, second = random_orderid(1), random_orderid(2)
+    add_stock([(small, sku, 10, None), (large, sku, 10, "2011-01-02")])
+    url = config.get_api_url()
+    for order_reference in (first, second):
+        data = {"order_reference": order_reference, "sku": sku, "quantity": 5}
+        assert requests.post(f"{url}/allocate", json=data).status_code == 201
+
+    r = requests.post(
+        f"{url}/change_batch_quantity", json={"reference": small, "quantity": 5}
+    )
+
+    assert r.status_code == 200
+    assert r.json()["reallocated"] == [
+        {"order_reference": second, "sku": sku, "quantity": 5, "batchref": large}
+    ]
@@ -0,0 +1,74 @@
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+import config
+from tests.random_refs import random_batchref
+from tests.random_refs import random_orderid
+from tests.random_refs import random_sku
+
+
+@pytest.fixture
+def restart_async_api():
+    (Path(__file__).parent.parent.parent / "entrypoints" / "asgi_app.py").touch()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            return requests.get(config.get_async_api_url())
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    pytest.fail("Async API never came up")
+
+
+@pytest.mark.usefixtures("restart_async_api")
+def test_async_api_allocates_and_deallocates(add_stock):
+    sku, order1, order2 = random_sku(), random_orderid(1), random_orderid(2)
+    earlybatch, laterbatch = random_batchref(1), random_batchref(2)
+    add_stock([(laterbatch, sku, 100, "2011-01-02"), (earlybatch, sku, 100, None)])
+    url = config.get_async_api_url()
+
+    r = requests.post(
+        f"{url}/allocate",
+        json={"order_reference": order1, "sku": sku, "quantity": 100},
+    )
+    assert r.status_code == 201
+    assert r.json()["batchref"] == earlybatch
+
+    r = requests.post(
+        f"{url}/allocate",
+        json={"order_reference": order2, "sku": sku, "quantity": 100},
+    )
+    assert r.json()["batchref"] == laterbatch
+
+    r = requests.post(
+        f"{url}/deallocate", json={"order_reference": order1, "sku": sku}
+    )
+    assert r.status_code == 201
+    assert r.json()["batchref"] == earlybatch
+
+
+@pytest.mark.usefixtures("restart_async_api")
+def test_async_api_unhappy_path_returns_400_and_error_message():
+    unknown_sku, orderid = random_sku(), random_orderid()
+    data = {"order_reference": orderid, "sku": unknown_sku, "quantity": 20}
+
+    r = requests.post(f"{config.get_async_api_url()}/allocate", json=data)
+
+    assert r.status_code == 400
+    assert r.json()["message"] == f"Invalid sku {unknown_sku}"
+
+
+@pytest.mark.usefixtures("restart_async_api")
+def test_async_api_deallocating_an_unknown_order_returns_400(add_stock):
+    sku, orderid = random_sku(), random_orderid()
+    add_stock([(random_batchref(), sku, 100, None)])
+
+    r = requests.post(
+        f"{config.get_async_api_url()}/deallocate",
+        json={"order_reference": orderid, "sku": sku},
+    )
+
+    assert r.status_code == 400
+    assert orderid in r.json()["message"]
@@ -0,0 +1,86 @@
+from domain.model import BatchAvailability
+from domain.model import Product
+from adapters.repository import AbstractRepository
+from service_layer.unit_of_work import AbstractUnitOfWork
+from service_layer.unit_of_work import VersionConflict
+
+
+class FakeRepository(AbstractRepository):
+    def __init__(self, products):
+        super().__init__()
+        self._products = set(products)
+        self.stored_versions = {p.sku: p.version_number for p in self._products}
+
+    def _add(self, product):
+        self._products.add(product)
+
+    def _get(self, sku):
+        return next((p for p in self._products if p.sku == sku), None)
+
+    def _get_many(self, skus):
+        return [p for p in self._products if p.sku in skus]
+
+    def _get_by_batchref(self, reference):
+        return next(
+            (
+                p
+                for p in self._products
+                if reference in [b.reference for b in p.batches]
+            ),
+            None,
+        )
+
+    def version_numbers(self, skus):
+        return {
+            sku: self.stored_versions[sku]
+            for sku in skus
+            if sku in self.stored_versions
+        }
+
+    def availability(self, sku):
+        product = self._get(sku)
+        return tuple(
+            BatchAvailability(b.reference, b.sku, b.eta, b.available_quantity)
+            for b in (product.batches if product else [])
+        )
+
+
+class FakeUnitOfWork(AbstractUnitOfWork):
+    def __init__(self, products=()):
+        self.repository = FakeRepository(products)
+        self.products = self.repository
+        self.commits = 0
+        self.events = []
+
+    @staticmethod
+    def for_batches(*batches):
+        skus = {b.sku for b in batches}
+        return FakeUnitOfWork(
+            Product(sku, [b for b in batches if b.sku == sku]) for sku in skus
+        )
+
+    @property
+    def committed(self):
+        return self.commits > 0
+
+    def _commit(self):
+        self.commits += 1
+        self.events.extend(self.collect_new_events())
+        self.repository.stored_versions = {
+            p.sku: p.version_number for p in self.repository._products
+        }
+
+    def rollback(self):
+        pass
+
+
+class ConflictingUnitOfWork(FakeUnitOfWork):
+    def __init__(self, products=(), conflicts=0):
+        super().__init__(products)
+        self.conflicts = conflicts
+
+    def _commit(self):
+        if self.conflicts:
+            self.conflicts -= 1
+            raise VersionConflict("version mismatch")
+        super()._commit()
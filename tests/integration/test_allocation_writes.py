@@ -0,0 +1,155 @@
+from sqlalchemy import event
+
+from domain import model
+from adapters import orm
+from service_layer import services
+from service_layer import unit_of_work
+from tests.query_counter import summary
+
+
+def summaries(statements):
+    return [summary(statement) for statement in statements]
+
+
+def allocations(session):
+    return sorted(
+        session.execute(
+            "SELECT b.reference, l.order_reference, l.quantity FROM allocations AS a"
+            " JOIN batches AS b ON a.batch_id = b.id"
+            " JOIN order_lines AS l ON a.orderline_id = l.id"
+        )
+    )
+
+
+def allocate_orders(session_factory, count):
+    lines = [model.OrderLine(f"o{i}", "RED-CHAIR", 1) for i in range(count)]
+    services.allocate_many(lines, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+
+def test_allocating_issues_the_same_statements_for_few_and_many_lines(
+    query_counter, session_factory, add_stock_to
+):
+    add_stock_to(
+        session_factory,
+        [("b1", "RED-CHAIR", 1000, None), ("b2", "RED-CHAIR", 1000, None)],
+    )
+
+    with query_counter.record() as few:
+        allocate_orders(session_factory, 2)
+    with query_counter.record() as many:
+        allocate_orders(session_factory, 200)
+
+    few, many = summaries(few), summaries(many)
+    assert few == many
+    assert many.count("INSERT order_lines") == 1
+    assert many.count("INSERT allocations") == 1
+
+
+def test_lines_beyond_one_insert_are_written_in_chunks(
+    query_counter, session_factory, add_stock_to
+):
+    count = orm.INSERT_CHUNK_SIZE * 2 + 1
+    add_stock_to(session_factory, [("b1", "RED-CHAIR", count, None)])
+
+    with query_counter.record() as statements:
+        allocate_orders(session_factory, count)
+
+    assert summaries(statements).count("INSERT order_lines") == 3
+    assert summaries(statements).count("INSERT allocations") == 1
+    assert allocations(session_factory()) == sorted(
+        ("b1", f"o{i}", 1) for i in range(count)
+    )
+
+
+def test_commit_refreshes_availability_of_changed_batches_only(
+    in_memory_db, session_factory, add_stock_to
+):
+    add_stock_to(
+        session_factory, [(f"b{i}", "RED-CHAIR", 10, None) for i in range(20)]
+    )
+    parameters = []
+
+    def record(conn, cursor, statement, params, context, executemany):
+        if statement.startswith("INSERT INTO availability"):
+            parameters.extend(params if executemany else [params])
+
+    event.listen(in_memory_db, "before_cursor_execute", record)
+    services.allocate(
+        model.OrderLine("o1", "RED-CHAIR", 5),
+        unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+    )
+    event.remove(in_memory_db, "before_cursor_execute", record)
+
+    assert parameters == [("b0", "RED-CHAIR", None, 5)]
+
+
+def test_deallocating_and_reallocating_in_one_commit(session_factory, add_stock_to):
+    add_stock_to(session_factory, [("b1", "RED-CHAIR", 10, None)])
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.allocate(model.OrderLine("o1", "RED-CHAIR", 2), uow)
+    services.allocate(model.OrderLine("o2", "RED-CHAIR", 2), uow)
+
+    with uow:
+        services.deallocate("o1", "RED-CHAIR", uow)
+        services.allocate(model.OrderLine("o1", "RED-CHAIR", 3), uow)
+        services.deallocate("o2", "RED-CHAIR", uow)
+        uow.commit()
+
+    assert allocations(session_factory()) == [("b1", "o1", 3)]
+
+
+def test_allocations_written_by_an_earlier_flush_can_be_removed(
+    session_factory, add_stock_to
+):
+    add_stock_to(session_factory, [("b1", "RED-CHAIR", 10, None)])
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+    with uow:
+        product = uow.products.get("RED-CHAIR")
+        product.allocate(model.OrderLine("o1", "RED-CHAIR", 2))
+        uow.session.flush()
+        product.deallocate("o1")
+        uow.commit()
+
+    assert allocations(session_factory()) == []
+
+
+def test_rolled_back_allocations_are_not_written_later(
+    sqlite_session_factory, add_stock_to
+):
+    add_stock_to(sqlite_session_factory, [("b1", "RED-CHAIR", 10, None)])
+    session = sqlite_session_factory()
+    product = session.query(model.Product).one()
+    [batch] = product.batches
+
+    product.allocate(model.OrderLine("o1", "RED-CHAIR", 2))
+    session.rollback()
+    batch._purchased_quantity = 20
+    session.commit()
+
+    assert allocations(sqlite_session_factory()) == []
+
+
+def test_shrinking_a_batch_moves_its_newest_lines_in_one_commit(
+    query_counter, session_factory, add_stock_to
+):
+    add_stock_to(
+        session_factory,
+        [("b1", "RED-CHAIR", 200, None), ("b2", "RED-CHAIR", 200, None)],
+    )
+    allocate_orders(session_factory, 200)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+    with query_counter.record() as few:
+        services.change_batch_quantity("b1", 198, uow)
+    with query_counter.record() as many:
+        moved = services.change_batch_quantity("b1", 100, uow)
+
+    # allocate_many took the lines in order reference order
+    order = sorted(f"o{i}" for i in range(200))
+    assert summaries(few) == summaries(many)
+    assert [line.order_reference for line, _ in moved] == order[100:198]
+    assert allocations(session_factory()) == sorted(
+        [("b1", reference, 1) for reference in order[:100]]
+        + [("b2", reference, 1) for reference in order[100:]]
+    )
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from domain import model
+from service_layer import async_services
+from service_layer import services
+from service_layer.async_unit_of_work import AsyncSqlAlchemyUnitOfWork
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_async_uow_allocates_and_deallocates(async_session_factory, add_stock_to):
+    add_stock_to(async_session_factory, [("batch1", "ASYNC-LAMP", 100, None)])
+
+    async def scenario():
+        uow = AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        line = model.OrderLine("o1", "ASYNC-LAMP", 10)
+        allocated = await async_services.allocate(line, uow)
+        [after_allocation] = await async_services.availability("ASYNC-LAMP", uow)
+        deallocated = await async_services.deallocate("o1", "ASYNC-LAMP", uow)
+        [after_deallocation] = await async_services.availability("ASYNC-LAMP", uow)
+        return allocated, after_allocation, deallocated, after_deallocation
+
+    allocated, after_allocation, deallocated, after_deallocation = run(scenario())
+
+    assert allocated == deallocated == "batch1"
+    assert after_allocation.available_quantity == 90
+    assert after_deallocation.available_quantity == 100
+
+
+def test_async_uow_rolls_back_uncommitted_work(async_session_factory, add_stock_to):
+    add_stock_to(async_session_factory, [("batch1", "ASYNC-LAMP", 100, None)])
+
+    async def allocate_without_commit():
+        async with AsyncSqlAlchemyUnitOfWork(async_session_factory) as uow:
+            product = await uow.products.get("ASYNC-LAMP")
+            product.allocate(model.OrderLine("o1", "ASYNC-LAMP", 10))
+
+        async with AsyncSqlAlchemyUnitOfWork(async_session_factory) as uow:
+            product = await uow.products.get("ASYNC-LAMP")
+            return product.batches[0].available_quantity
+
+    assert run(allocate_without_commit()) == 100
+
+
+def test_async_allocate_rejects_unknown_skus(async_session_factory):
+    uow = AsyncSqlAlchemyUnitOfWork(async_session_factory)
+    line = model.OrderLine("o1", "NONEXISTENTSKU", 10)
+
+    with pytest.raises(services.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+        run(async_services.allocate(line, uow))
+
+
+def test_concurrent_async_allocations_never_oversell(
+    async_session_factory, add_stock_to
+):
+    add_stock_to(async_session_factory, [("batch1", "BUSY-LAMP", 10, None)])
+
+    async def allocate_all():
+        async def try_to_allocate(i):
+            uow = AsyncSqlAlchemyUnitOfWork(async_session_factory)
+            line = model.OrderLine(f"order{i}", "BUSY-LAMP", 1)
+            try:
+                return await async_services.allocate(line, uow)
+            except (model.OutOfStock, services.ConcurrentUpdate) as e:
+                return e
+
+        results = await asyncio.gather(*(try_to_allocate(i) for i in range(20)))
+        [batch] = await async_services.availability(
+            "BUSY-LAMP", AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        )
+        return results, batch
+
+    results, batch = run(allocate_all())
+
+    successes = [r for r in results if r == "batch1"]
+    failures = [r for r in results if r != "batch1"]
+    # conflicting attempts were retried until the batch ran out, not given up
+    assert len(successes) == 10
+    assert all(isinstance(r, model.OutOfStock) for r in failures)
+    assert batch.available_quantity == 0
@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from domain import model
+from service_layer import services
+from service_layer import unit_of_work
+from service_layer.batch_import import import_batches
+from service_layer.dispatcher import AllocationDispatcher
+from tests.random_refs import random_batchref
+from tests.random_refs import random_orderid
+from tests.random_refs import random_sku
+
+
+def test_parallel_allocations_never_oversell_a_batch(
+    sqlite_session_factory, add_stock_to
+):
+    add_stock_to(sqlite_session_factory, [("batch1", "BUSY-TABLE", 10, None)])
+    start = threading.Barrier(20)
+    results = []
+
+    def try_to_allocate(order_reference):
+        uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+        line = model.OrderLine(order_reference, "BUSY-TABLE", 1)
+        start.wait()
+        try:
+            results.append(services.allocate(line, uow))
+        except (model.OutOfStock, services.ConcurrentUpdate) as e:
+            results.append(e)
+
+    threads = [
+        threading.Thread(target=try_to_allocate, args=(f"order{i}",))
+        for i in range(20)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    session = sqlite_session_factory()
+    [[allocated, allocated_quantity, version]] = session.execute(
+        "SELECT"
+        " (SELECT SUM(quantity) FROM order_lines"
+        "  JOIN allocations ON allocations.orderline_id = order_lines.id),"
+        " (SELECT _allocated_quantity FROM batches WHERE reference='batch1'),"
+        " (SELECT version_number FROM products WHERE sku='BUSY-TABLE')"
+    )
+    successes = [r for r in results if r == "batch1"]
+    failures = [r for r in results if r != "batch1"]
+    # conflicting attempts were retried until the batch ran out, not given up
+    assert len(successes) == 10
+    assert all(isinstance(r, model.OutOfStock) for r in failures)
+    assert allocated == allocated_quantity == 10
+    assert version == 11
+
+
+def test_dispatched_allocations_are_written_through(sqlite_session_factory):
+    factory = sessionmaker(
+        bind=sqlite_session_factory.kw["bind"], expire_on_commit=False
+    )
+    skus = ["BUSY-TABLE", "BUSY-CHAIR", "BUSY-LAMP"]
+
+    with AllocationDispatcher(
+        lambda: unit_of_work.SqlAlchemyUnitOfWork(factory), workers=2, max_batch=7
+    ) as dispatcher:
+        for sku in skus:
+            dispatcher.add_batch(f"batch-{sku}", sku, 10, None)
+        futures = [
+            dispatcher.allocate(model.OrderLine(f"order{i}", skus[i % 3], 1))
+            for i in range(45)
+        ]
+        results = [f.exception() or f.result() for f in futures]
+
+    assert sum(isinstance(r, model.OutOfStock) for r in results) == 15
+    session = sqlite_session_factory()
+    rows = session.execute(
+        "SELECT b.sku, b._allocated_quantity, p.version_number, a.available_quantity"
+        " FROM batches AS b JOIN products AS p ON p.sku = b.sku"
+        " JOIN availability AS a ON a.batchref = b.reference ORDER BY b.sku"
+    )
+    assert list(rows) == [(sku, 10, 11, 0) for sku in sorted(skus)]
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    with pytest.raises(model.OutOfStock):
+        services.allocate(model.OrderLine("late", "BUSY-LAMP", 1), uow)
+
+
+def test_set_based_allocation_waits_for_a_batch_only_a_locked_row_can_serve(
+    postgres_db, postgres_session, add_stock_to
+):
+    sku, batchref = random_sku(), random_batchref()
+    factory = sessionmaker(bind=postgres_db)
+    add_stock_to(factory, [(batchref, sku, 10, None)])
+    postgres_session.execute(
+        "SELECT id FROM batches WHERE reference=:reference FOR UPDATE",
+        dict(reference=batchref),
+    )
+    results = []
+
+    def allocate():
+        uow = unit_of_work.SqlAlchemyUnitOfWork(factory)
+        line = model.OrderLine(random_orderid(), sku, 1)
+        try:
+            results.append(services.allocate_set_based(line, uow))
+        except model.OutOfStock as e:
+            results.append(e)
+
+    thread = threading.Thread(target=allocate)
+    thread.start()
+    thread.join(timeout=0.5)
+    assert thread.is_alive(), "skipping the locked batch gave up without waiting"
+    postgres_session.rollback()
+    thread.join()
+
+    assert results == [batchref]
+
+
+def test_dispatched_allocations_see_stock_imported_around_the_dispatcher(
+    sqlite_session_factory,
+):
+    factory = sessionmaker(
+        bind=sqlite_session_factory.kw["bind"], expire_on_commit=False
+    )
+
+    with AllocationDispatcher(
+        lambda: unit_of_work.SqlAlchemyUnitOfWork(factory), workers=1
+    ) as dispatcher:
+        dispatcher.add_batch("b1", "BUSY-TABLE", 1, None).result()
+        assert dispatcher.allocate(model.OrderLine("o1", "BUSY-TABLE", 1)).result()
+        import_batches(
+            [(1, {"reference": "b2", "sku": "BUSY-TABLE", "quantity": 10})],
+            unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        )
+        results = [
+            dispatcher.allocate(model.OrderLine(f"o{i}", "BUSY-TABLE", 1)).result()
+            for i in range(2, 5)
+        ]
+
+    assert results == ["b2", "b2", "b2"]
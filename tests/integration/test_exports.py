@@ -0,0 +1,172 @@
+import io
+import json
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from domain import events
+from domain import model
+from adapters import outbox
+from service_layer import services
+from service_layer import unit_of_work
+from service_layer.exports import ChangeStream
+from service_layer.exports import export_snapshot
+from tests.random_refs import random_orderid
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def allocate(session_factory, order_reference, sku, quantity):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.allocate(model.OrderLine(order_reference, sku, quantity), uow)
+
+
+def snapshot(session_factory, chunk_size=2):
+    out = io.StringIO()
+    report = export_snapshot(out, session_factory, chunk_size)
+    return report, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_snapshot_holds_every_batch_with_its_allocations(
+    session_factory, add_stock_to
+):
+    add_stock_to(
+        session_factory,
+        [
+            ("b1", "RED-CHAIR", 10, None),
+            ("b2", "BLUE-LAMP", 5, model.date(2024, 1, 2)),
+        ],
+    )
+    for order in ("o1", "o2", "o3"):
+        allocate(session_factory, order, "RED-CHAIR", 2)
+
+    report, records = snapshot(session_factory)
+
+    header, *batches = records
+    assert header["type"] == "snapshot"
+    assert header["position"] == report.position > 0
+    # SQLite commits one writer at a time, so no lower id can commit later
+    assert header["snapshot"] is None
+    assert batches == [
+        {
+            "type": "batch",
+            "reference": "b1",
+            "sku": "RED-CHAIR",
+            "eta": None,
+            "purchased_quantity": 10,
+            "allocated_quantity": 6,
+            "allocations": [
+                {"order_reference": "o1", "quantity": 2},
+                {"order_reference": "o2", "quantity": 2},
+                {"order_reference": "o3", "quantity": 2},
+            ],
+        },
+        {
+            "type": "batch",
+            "reference": "b2",
+            "sku": "BLUE-LAMP",
+            "eta": "2024-01-02",
+            "purchased_quantity": 5,
+            "allocated_quantity": 0,
+            "allocations": [],
+        },
+    ]
+    assert (report.batches, report.allocations) == (2, 3)
+
+
+def test_change_stream_continues_from_the_snapshot(session_factory, add_stock_to):
+    add_stock_to(session_factory, [("b1", "RED-CHAIR", 10, None)])
+    allocate(session_factory, "o1", "RED-CHAIR", 2)
+    report, _ = snapshot(session_factory)
+    stream = ChangeStream(report.position, session_factory)
+
+    add_stock_to(session_factory, [("b2", "RED-CHAIR", 10, model.date(2024, 1, 2))])
+    allocate(session_factory, "o2", "RED-CHAIR", 9)
+    with pytest.raises(model.OutOfStock):
+        allocate(session_factory, "o3", "RED-CHAIR", 100)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.deallocate("o1", "RED-CHAIR", uow)
+
+    changes = [
+        (r["event"], r.get("reference") or r["order_reference"])
+        for r in stream.poll()
+    ]
+    assert changes == [
+        ("BatchCreated", "b2"),
+        ("Allocated", "o2"),
+        ("Deallocated", "o1"),
+    ]
+    assert stream.poll() == []
+    assert stream.position == report.position + 4
+
+
+def insert_outbox_row(session_factory, id):
+    session = session_factory()
+    session.execute(
+        "INSERT INTO outbox (id, event_type, payload) VALUES (:id, 'Deallocated', :p)",
+        dict(
+            id=id,
+            p=json.dumps({"order_reference": f"o{id}", "sku": "S", "batchref": "b"}),
+        ),
+    )
+    session.commit()
+
+
+def test_change_stream_waits_for_gaps_to_fill(session_factory):
+    stream = ChangeStream(0, session_factory, gap_timeout=10, clock=FakeClock())
+    insert_outbox_row(session_factory, 1)
+    insert_outbox_row(session_factory, 3)
+
+    assert [r["position"] for r in stream.poll()] == [1, 3]
+    assert stream.position == 1
+
+    insert_outbox_row(session_factory, 2)
+    assert [r["position"] for r in stream.poll()] == [2]
+    assert stream.position == 3
+
+
+def test_change_stream_skips_gaps_that_never_fill(session_factory):
+    clock = FakeClock()
+    stream = ChangeStream(0, session_factory, gap_timeout=10, clock=clock)
+    insert_outbox_row(session_factory, 2)
+
+    assert [r["position"] for r in stream.poll()] == [2]
+    assert stream.position == 0
+    clock.now = 11
+    assert stream.poll() == []
+    assert stream.position == 2
+
+
+def add_outbox_event(session, order_reference):
+    outbox.add(session, [events.Deallocated(order_reference, "S", "b1")])
+    [[id]] = session.execute("SELECT max(id) FROM outbox")
+    return id
+
+
+def test_change_stream_finds_changes_committed_after_the_snapshot_below_its_position(
+    postgres_db,
+):
+    factory = sessionmaker(bind=postgres_db)
+    late, early = random_orderid("late"), random_orderid("early")
+    slow = factory()
+    late_id = add_outbox_event(slow, late)
+    fast = factory()
+    add_outbox_event(fast, early)
+    fast.commit()
+
+    report, [header, *_] = snapshot(factory)
+    stream = ChangeStream(report.position, factory, snapshot=header["snapshot"])
+    slow.commit()
+
+    assert late_id < report.position
+    assert [(r["position"], r["order_reference"]) for r in stream.poll()] == [
+        (late_id, late)
+    ]
+    assert stream.poll() == []
+    assert stream.snapshot is None
@@ -0,0 +1,73 @@
+from datetime import datetime
+from datetime import timedelta
+
+from adapters.idempotency import Outcome
+from adapters.idempotency import PENDING
+from adapters.idempotency import SqlAlchemyIdempotencyStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+def test_stores_outcomes_until_they_expire(session_factory):
+    clock = FakeClock()
+    store = SqlAlchemyIdempotencyStore(session_factory, ttl=60, clock=clock)
+    outcome = Outcome("abc", {"batchref": "b1"}, 201)
+
+    store.put("/allocate:k1", outcome)
+
+    assert store.get("/allocate:k1") == outcome
+    assert store.get("/deallocate:k1") is None
+    clock.now += timedelta(seconds=61)
+    assert store.get("/allocate:k1") is None
+
+
+def test_expired_rows_are_deleted_as_new_ones_are_stored(session_factory):
+    clock = FakeClock()
+    store = SqlAlchemyIdempotencyStore(session_factory, ttl=60, clock=clock)
+    store.put("k1", Outcome("abc", {"batchref": "b1"}, 201))
+    clock.now += timedelta(seconds=61)
+
+    store.put("k1", Outcome("def", {"batchref": "b2"}, 201))
+    store.put("k2", Outcome("abc", {"message": "Invalid sku X"}, 400))
+
+    rows = list(session_factory().execute("SELECT key FROM idempotency_keys"))
+    assert sorted(rows) == [("k1",), ("k2",)]
+    assert store.get("k1").body == {"batchref": "b2"}
+
+
+def test_the_first_outcome_stored_for_a_key_wins(session_factory):
+    store = SqlAlchemyIdempotencyStore(session_factory)
+
+    store.put("k1", Outcome("abc", {"batchref": "b1"}, 201))
+    store.put("k1", Outcome("abc", {"batchref": "b2"}, 201))
+
+    assert store.get("k1").body == {"batchref": "b1"}
+
+
+def test_a_reserved_key_is_pending_until_its_outcome_is_stored(session_factory):
+    store = SqlAlchemyIdempotencyStore(session_factory)
+
+    assert store.reserve("k1", "abc") is None
+    assert store.reserve("k1", "abc") == Outcome("abc", {}, PENDING)
+    store.put("k1", Outcome("abc", {"batchref": "b1"}, 201))
+
+    assert store.reserve("k1", "abc") == Outcome("abc", {"batchref": "b1"}, 201)
+
+
+def test_a_released_or_abandoned_reservation_frees_the_key(session_factory):
+    clock = FakeClock()
+    store = SqlAlchemyIdempotencyStore(session_factory, clock=clock, pending_ttl=60)
+    store.reserve("k1", "abc")
+    store.reserve("k2", "abc")
+
+    store.release("k1")
+    clock.now += timedelta(seconds=61)
+
+    assert store.reserve("k1", "abc") is None
+    assert store.reserve("k2", "abc") is None
@@ -0,0 +1,167 @@
+import pytest
+from sqlalchemy import Column
+from sqlalchemy import Date
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import create_engine
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from domain import model
+from adapters import migrations
+from adapters import orm
+from service_layer import services
+from service_layer import unit_of_work
+
+NEW_INDEXES = {
+    "batches": {"ix_batches_reference", "ix_batches_sku"},
+    "order_lines": {"ix_order_lines_order_reference_sku"},
+    "allocations": {"ix_allocations_orderline_id", "ix_allocations_batch_id"},
+    "outbox": {"ix_outbox_unpublished", "ix_outbox_transaction_id"},
+}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def create_schema_without_the_new_indexes(engine):
+    orm.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for names in NEW_INDEXES.values():
+            for name in names:
+                connection.exec_driver_sql(f"DROP INDEX {name}")
+        connection.exec_driver_sql(
+            "CREATE INDEX ix_outbox_published_at ON outbox (published_at)"
+        )
+
+
+def create_baseline_schema(engine):
+    # the tables as they were before any migration existed
+    baseline = MetaData()
+    Table(
+        "order_lines",
+        baseline,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("order_reference", String(255)),
+        Column("sku", String(255)),
+        Column("quantity", Integer, nullable=False),
+    )
+    Table(
+        "batches",
+        baseline,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("reference", String(255)),
+        Column("sku", String(255)),
+        Column("eta", Date, nullable=True),
+        Column("_purchased_quantity", Integer, nullable=False),
+    )
+    Table(
+        "allocations",
+        baseline,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("orderline_id", ForeignKey("order_lines.id")),
+        Column("batch_id", ForeignKey("batches.id")),
+    )
+    baseline.create_all(engine)
+
+
+def test_migrating_an_empty_database_creates_the_schema(engine):
+    applied = migrations.migrate(engine)
+
+    assert [m.version for m in applied] == [m.version for m in migrations.MIGRATIONS]
+    assert set(inspect(engine).get_table_names()) == set(orm.metadata.tables)
+    for table, names in NEW_INDEXES.items():
+        assert names <= index_names(engine, table)
+
+
+def test_migrating_an_existing_database_adds_the_indexes_once(engine):
+    create_schema_without_the_new_indexes(engine)
+
+    migrations.migrate(engine)
+
+    for table, names in NEW_INDEXES.items():
+        assert names <= index_names(engine, table)
+    assert "ix_outbox_published_at" not in index_names(engine, "outbox")
+    assert migrations.pending(engine) == []
+    assert migrations.migrate(engine) == []
+
+
+def test_a_migration_interrupted_after_its_indexes_can_be_run_again(engine):
+    create_schema_without_the_new_indexes(engine)
+    migrations.migrate(engine, migrations.MIGRATIONS[:1])
+    with engine.begin() as connection:
+        migrations.create_index(
+            connection, "ix_batches_reference", "batches", ["reference"]
+        )
+
+    applied = migrations.migrate(engine)
+
+    assert [m.version for m in applied] == [
+        m.version for m in migrations.MIGRATIONS[1:]
+    ]
+
+
+def test_batch_references_are_unique_once_migrated(engine):
+    migrations.migrate(engine)
+    insert = (
+        "INSERT INTO batches (reference, sku, _purchased_quantity)"
+        " VALUES ('b1', 'RED-CHAIR', 10)"
+    )
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(insert)
+    with pytest.raises(IntegrityError):
+        with engine.begin() as connection:
+            connection.exec_driver_sql(insert)
+
+
+def test_migrating_a_baseline_database_carries_its_allocations_over(
+    engine, session_factory
+):
+    create_baseline_schema(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO batches (id, reference, sku, _purchased_quantity)"
+            " VALUES (1, 'b1', 'RED-CHAIR', 10), (2, 'b2', 'BLUE-LAMP', 5)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO order_lines (id, order_reference, sku, quantity)"
+            " VALUES (1, 'o1', 'RED-CHAIR', 3), (2, 'o2', 'RED-CHAIR', 4)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO allocations (orderline_id, batch_id) VALUES (1, 1), (2, 1)"
+        )
+
+    migrations.migrate(engine)
+
+    with engine.connect() as connection:
+        assert list(
+            connection.exec_driver_sql(
+                "SELECT reference, _allocated_quantity FROM batches ORDER BY id"
+            )
+        ) == [("b1", 7), ("b2", 0)]
+        assert sorted(
+            connection.exec_driver_sql("SELECT sku, version_number FROM products")
+        ) == [("BLUE-LAMP", 0), ("RED-CHAIR", 0)]
+        assert sorted(
+            connection.exec_driver_sql(
+                "SELECT batchref, available_quantity FROM availability"
+            )
+        ) == [("b1", 3), ("b2", 5)]
+    for table, names in NEW_INDEXES.items():
+        assert names <= index_names(engine, table)
+    assert migrations.pending(engine) == []
+    # session_factory maps the models, for the service layer to run on the result
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+    assert services.deallocate("o1", "RED-CHAIR", uow) == "b1"
+    assert services.allocate(model.OrderLine("o3", "RED-CHAIR", 6), uow) == "b1"
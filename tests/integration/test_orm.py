@@ -29,6 +29,18 @@ def test_orderline_mapper_can_save_lines(session):
     assert rows == [("order1", "DECORATIVE-WIDGET", 12)]
 
 
+def test_loaded_lines_share_their_sku_string(session):
+    session.execute(
+        "INSERT INTO order_lines (order_reference, sku, quantity) VALUES "
+        '("order1", "RED-CHAIR", 12),'
+        '("order2", "RED-CHAIR", 13)'
+    )
+
+    line1, line2 = session.query(model.OrderLine).all()
+
+    assert line1.sku is line2.sku
+
+
 def test_retrieving_batches(session):
     session.execute(
         "INSERT INTO batches (reference, sku, _purchased_quantity, eta) VALUES "
@@ -82,7 +94,9 @@ def test_retrieving_allocations(session):
 
     batch = session.query(model.Batch).one_or_none()
     assert batch.reference == "batch1"
-    assert batch._allocations == {model.OrderLine("order1", "sku1", 12)}
+    assert list(batch._allocations.values()) == [
+        model.OrderLine("order1", "sku1", 12)
+    ]
 
 
 def test_saving_allocations(session):
@@ -95,3 +109,27 @@ def test_saving_allocations(session):
 
     rows = list(session.execute('SELECT orderline_id, batch_id FROM "allocations"'))
     assert rows == [(batch.id, line.id)]
+
+
+def test_saving_allocations_persists_allocated_quantity(session):
+    batch = model.Batch("batch1", "sku1", 100, eta=None)
+    batch.allocate(model.OrderLine("order1", "sku1", 12))
+    batch.allocate(model.OrderLine("order2", "sku1", 8))
+
+    session.add(batch)
+    session.commit()
+
+    rows = list(
+        session.execute('SELECT reference, _allocated_quantity FROM "batches"')
+    )
+    assert rows == [("batch1", 20)]
+
+
+def test_retrieving_batches_restores_available_quantity(session):
+    session.execute(
+        "INSERT INTO batches (reference, sku, _purchased_quantity, _allocated_quantity, eta)"
+        ' VALUES ("batch1", "sku1", 100, 30, NULL)'
+    )
+
+    batch = session.query(model.Batch).one()
+    assert batch.available_quantity == 70
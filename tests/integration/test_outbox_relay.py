@@ -0,0 +1,92 @@
+import pytest
+
+from domain import events
+from adapters import outbox
+from adapters.publishers import InMemoryPublisher
+from adapters.publishers import RedisPublisher
+from service_layer.outbox_relay import OutboxRelay
+
+
+def add_events(session_factory, *new_events):
+    session = session_factory()
+    outbox.add(session, new_events)
+    session.commit()
+
+
+def unpublished(session_factory):
+    session = session_factory()
+    return list(session.execute("SELECT id FROM outbox WHERE published_at IS NULL"))
+
+
+def test_relay_publishes_pending_messages_in_order_once(session_factory):
+    add_events(
+        session_factory,
+        events.Allocated("o1", "RED-CHAIR", 10, "b1"),
+        events.OutOfStock("o2", "RED-CHAIR", 5),
+    )
+    publisher = InMemoryPublisher()
+    relay = OutboxRelay(publisher, session_factory)
+
+    assert relay.relay_once() == 2
+    assert relay.relay_once() == 0
+
+    assert [(m.type, m.payload["order_reference"]) for m in publisher.messages] == [
+        ("Allocated", "o1"),
+        ("OutOfStock", "o2"),
+    ]
+    assert unpublished(session_factory) == []
+
+
+def test_relay_publishes_in_batches(session_factory):
+    add_events(
+        session_factory,
+        *(events.Deallocated(f"o{i}", "RED-CHAIR", "b1") for i in range(5)),
+    )
+    publisher = InMemoryPublisher()
+    relay = OutboxRelay(publisher, session_factory, batch_size=2)
+
+    assert [relay.relay_once() for _ in range(4)] == [2, 2, 1, 0]
+    assert len(publisher.messages) == 5
+
+
+def test_messages_stay_pending_when_publishing_fails(session_factory):
+    add_events(session_factory, events.Allocated("o1", "RED-CHAIR", 10, "b1"))
+
+    class BrokenPublisher(InMemoryPublisher):
+        def publish(self, messages):
+            raise ConnectionError("broker unavailable")
+
+    with pytest.raises(ConnectionError):
+        OutboxRelay(BrokenPublisher(), session_factory).relay_once()
+
+    assert len(unpublished(session_factory)) == 1
+
+
+def test_redis_publisher_sends_one_message_per_event_in_a_pipeline():
+    class FakeRedis:
+        def __init__(self):
+            self.published = []
+            self.executed = 0
+
+        def pipeline(self):
+            return self
+
+        def publish(self, channel, message):
+            self.published.append((channel, message))
+
+        def execute(self):
+            self.executed += 1
+
+    client = FakeRedis()
+
+    RedisPublisher(client).publish(
+        [outbox.Message(7, "OutOfStock", {"sku": "RED-CHAIR"})]
+    )
+
+    assert client.published == [
+        (
+            "allocation:OutOfStock",
+            '{"id": 7, "type": "OutOfStock", "payload": {"sku": "RED-CHAIR"}}',
+        )
+    ]
+    assert client.executed == 1
@@ -0,0 +1,148 @@
+"""Statement budgets for the service calls and repository methods.
+
+Each operation runs against a product with two batches of one line each, then
+against one with many batches holding many lines. A lazy load per batch or per
+line shows up as a count that grows with the data, and fails here before it
+reaches production.
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from domain import model
+from adapters.orm import metadata
+from service_layer import services
+from service_layer import unit_of_work
+from tests.query_counter import QueryBudgetExceeded
+from tests.query_counter import QueryCounter
+
+SKU = "RED-CHAIR"
+
+BUDGETS = {
+    "services.allocate": 10,
+    "services.deallocate": 9,
+    "services.change_batch_quantity": 12,
+    "repository.get": 3,
+    "repository.get_many": 3,
+    "repository.get_by_batchref": 3,
+    "repository.add_batches": 6,
+    "repository.allocate_set_based": 8,
+    "repository.availability": 1,
+    "repository.availability_many": 1,
+}
+
+
+def allocate_stock(session_factory, add_stock_to, batches: int, lines_per_batch: int):
+    add_stock_to(
+        session_factory,
+        [(f"b{i}", SKU, lines_per_batch + 10, None) for i in range(batches)]
+        + [("other", "BLUE-CHAIR", 10, None)],
+    )
+    lines = [
+        model.OrderLine(f"o{i}", SKU, 1) for i in range(batches * lines_per_batch)
+    ]
+    services.allocate_many(lines, unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+
+def touch(product: model.Product):
+    # everything callers read, so that lazy loads happen inside the budget
+    for batch in product.batches:
+        batch.available_quantity
+        list(batch._allocations.values())
+
+
+def allocate(uow):
+    services.allocate(model.OrderLine("new", SKU, 1), uow)
+
+
+def deallocate(uow):
+    services.deallocate("o0", SKU, uow)
+
+
+def change_batch_quantity(uow):
+    services.change_batch_quantity("b0", 0, uow)
+
+
+def get(uow):
+    with uow:
+        touch(uow.products.get(SKU))
+
+
+def get_many(uow):
+    with uow:
+        for product in uow.products.get_many([SKU, "BLUE-CHAIR"]):
+            touch(product)
+
+
+def get_by_batchref(uow):
+    with uow:
+        touch(uow.products.get_by_batchref("b0"))
+
+
+def add_batches(uow):
+    with uow:
+        uow.products.add_batches([model.Batch("new", SKU, 10, None)])
+        uow.commit()
+
+
+def allocate_set_based(uow):
+    services.allocate_set_based(model.OrderLine("new", SKU, 1), uow)
+
+
+def availability(uow):
+    services.availability(SKU, uow)
+
+
+def availability_many(uow):
+    services.availability_many([SKU, "BLUE-CHAIR"], uow)
+
+
+OPERATIONS = {
+    "services.allocate": allocate,
+    "services.deallocate": deallocate,
+    "services.change_batch_quantity": change_batch_quantity,
+    "repository.get": get,
+    "repository.get_many": get_many,
+    "repository.get_by_batchref": get_by_batchref,
+    "repository.add_batches": add_batches,
+    "repository.allocate_set_based": allocate_set_based,
+    "repository.availability": availability,
+    "repository.availability_many": availability_many,
+}
+
+
+def new_database():
+    engine = create_engine("sqlite:///:memory:")
+    metadata.create_all(engine)
+    return engine
+
+
+@pytest.mark.parametrize("name", sorted(OPERATIONS))
+def test_operation_stays_within_its_statement_budget(
+    query_counter, session_factory, add_stock_to, name
+):
+    # session_factory maps the models; each database gets a session factory of
+    # its own, and both must need exactly as many statements
+    small = QueryCounter(new_database())
+    counts = []
+    for counter, batches, lines_per_batch in [(small, 2, 1), (query_counter, 20, 10)]:
+        factory = sessionmaker(bind=counter.engine)
+        allocate_stock(factory, add_stock_to, batches, lines_per_batch)
+        operation = counter.budget(BUDGETS[name])(OPERATIONS[name])
+        with counter.record() as statements:
+            operation(unit_of_work.SqlAlchemyUnitOfWork(factory))
+        counts.append(len(statements))
+
+    assert counts[0] == counts[1], f"{name} runs more statements for more data"
+
+
+def test_a_call_over_its_budget_fails_with_the_statements_it_ran(
+    query_counter, session_factory, add_stock_to
+):
+    allocate_stock(session_factory, add_stock_to, 2, 1)
+    operation = query_counter.budget(2)(get)
+
+    with pytest.raises(QueryBudgetExceeded, match="get ran 3 statements") as error:
+        operation(unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+    assert "ORDER BY allocations_1.id" in str(error.value)
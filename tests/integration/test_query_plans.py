@@ -0,0 +1,101 @@
+import re
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from domain import model
+from service_layer import services
+from service_layer import unit_of_work
+
+# a full pass over a table that grows with every batch or allocation
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(batches|allocations|order_lines)\b")
+
+
+@contextmanager
+def recorded_queries(engine):
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith("INSERT"):
+            queries.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def query_plans(engine, queries):
+    with engine.connect() as connection:
+        return {
+            statement: [
+                row.detail
+                for row in connection.exec_driver_sql(
+                    "EXPLAIN QUERY PLAN " + statement, tuple(parameters)
+                )
+            ]
+            for statement, parameters in queries
+        }
+
+
+@pytest.fixture
+def uow(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    for i in range(3):
+        services.add_batch(f"b{i}", "RED-CHAIR", 10, None, uow)
+        services.add_batch(f"other{i}", "BLUE-CHAIR", 10, None, uow)
+    services.allocate(model.OrderLine("o1", "RED-CHAIR", 5), uow)
+    return uow
+
+
+OPERATIONS = {
+    "allocate": lambda uow: services.allocate(
+        model.OrderLine("o2", "RED-CHAIR", 1), uow
+    ),
+    "allocate_set_based": lambda uow: services.allocate_set_based(
+        model.OrderLine("o2", "RED-CHAIR", 1), uow
+    ),
+    "deallocate": lambda uow: services.deallocate("o1", "RED-CHAIR", uow),
+    "change_batch_quantity": lambda uow: services.change_batch_quantity("b0", 0, uow),
+}
+
+
+@pytest.mark.parametrize("name", sorted(OPERATIONS))
+def test_allocation_queries_search_indexes_rather_than_scan_tables(
+    in_memory_db, uow, name
+):
+    with recorded_queries(in_memory_db) as queries:
+        OPERATIONS[name](uow)
+
+    plans = query_plans(in_memory_db, queries)
+
+    scans = {
+        statement: plan
+        for statement, plan in plans.items()
+        if any(FULL_SCAN.match(step) for step in plan)
+    }
+    assert plans and not scans
+
+
+def test_deallocation_finds_the_line_through_its_reference_and_sku(in_memory_db, uow):
+    with recorded_queries(in_memory_db) as queries:
+        services.deallocate("o1", "RED-CHAIR", uow)
+
+    [plan] = [
+        plan
+        for statement, plan in query_plans(in_memory_db, queries).items()
+        if statement.startswith("DELETE FROM allocations")
+    ]
+    assert any("ix_allocations_batch_id" in step for step in plan)
+    assert any("ix_order_lines_order_reference_sku" in step for step in plan)
+
+
+def test_products_are_found_by_batch_reference_through_its_index(in_memory_db, uow):
+    with recorded_queries(in_memory_db) as queries:
+        with uow:
+            uow.products.get_by_batchref("b1")
+
+    [first, *_] = query_plans(in_memory_db, queries).values()
+    assert any("ix_batches_reference" in step for step in first)
@@ -1,18 +1,32 @@
+from datetime import date
+
+from sqlalchemy import event
+
 from domain import model
+from adapters import read_model
 from adapters import repository
 
 
-def test_repository_can_save_a_batch(session):
+def test_repository_can_save_a_product_with_its_batches(session):
     batch = model.Batch("batch1", "RUSTY-SOAPDISH", 100, eta=None)
+    product = model.Product("RUSTY-SOAPDISH", [batch])
 
     repo = repository.SqlAlchemyRepository(session)
-    repo.add(batch)
+    repo.add(product)
     session.commit()
 
     rows = session.execute(
         'SELECT reference, sku, _purchased_quantity, eta FROM "batches"'
     )
     assert list(rows) == [("batch1", "RUSTY-SOAPDISH", 100, None)]
+    rows = session.execute('SELECT sku, version_number FROM "products"')
+    assert list(rows) == [("RUSTY-SOAPDISH", 0)]
+
+
+def insert_product(session, sku="GENERIC-SOFA"):
+    session.execute(
+        "INSERT INTO products (sku, version_number) VALUES (:sku, 0)", dict(sku=sku)
+    )
 
 
 def insert_order_line(session):
@@ -27,15 +41,14 @@ def insert_order_line(session):
     return orderline_id
 
 
-def insert_batch(session, reference):
+def insert_batch(session, reference, eta=None):
     session.execute(
         "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
-        ' VALUES (:reference, "GENERIC-SOFA", 100, NULL)',
-        dict(reference=reference),
+        ' VALUES (:reference, "GENERIC-SOFA", 100, :eta)',
+        dict(reference=reference, eta=eta),
     )
     [[batch_id]] = session.execute(
-        "SELECT id FROM order_lines WHERE order_reference=:order_reference AND sku=:sku",
-        dict(order_reference="order1", sku="GENERIC-SOFA"),
+        "SELECT id FROM batches WHERE reference=:reference", dict(reference=reference)
     )
     return batch_id
 
@@ -53,17 +66,131 @@ def insert_allocation(session, orderline_id, batch_id):
     return allocation_id
 
 
-def test_repository_can_retrieve_a_batch_with_allocations(session):
+def test_repository_can_retrieve_a_product_with_batches_and_allocations(session):
+    insert_product(session)
     orderline_id = insert_order_line(session)
     batch1_id = insert_batch(session, "batch1")
-    insert_batch(session, "batch2")
     insert_allocation(session, orderline_id, batch1_id)
 
     repo = repository.SqlAlchemyRepository(session)
-    retrieved = repo.get("batch1")
+    retrieved = repo.get("GENERIC-SOFA")
+
+    [batch] = retrieved.batches
+    assert batch == model.Batch("batch1", "GENERIC-SOFA", 100, eta=None)
+    assert batch._purchased_quantity == 100
+    assert list(batch._allocations.values()) == [
+        model.OrderLine("order1", "GENERIC-SOFA", 12)
+    ]
+    assert batch.allocation_for("order1", "GENERIC-SOFA") is not None
+    assert retrieved.version_number == 0
+
+
+def test_repository_returns_none_for_unknown_sku(session):
+    repo = repository.SqlAlchemyRepository(session)
+    assert repo.get("UNKNOWN-SOFA") is None
+
+
+def test_retrieved_product_has_batches_in_eta_order(session):
+    insert_product(session)
+    insert_batch(session, "later", eta="2011-01-02")
+    insert_batch(session, "in-stock")
+    insert_batch(session, "earlier", eta="2011-01-01")
+
+    repo = repository.SqlAlchemyRepository(session)
+    retrieved = repo.get("GENERIC-SOFA")
+
+    assert [b.reference for b in retrieved.batches] == [
+        "in-stock",
+        "earlier",
+        "later",
+    ]
+
+
+def test_repository_gets_products_for_several_skus(session):
+    for sku in ["RED-SOFA", "BLUE-SOFA", "PINK-SOFA"]:
+        insert_product(session, sku)
+
+    repo = repository.SqlAlchemyRepository(session)
+    retrieved = repo.get_many(["RED-SOFA", "PINK-SOFA"])
+
+    assert {p.sku for p in retrieved} == {"RED-SOFA", "PINK-SOFA"}
+
+
+def test_repository_reads_availability_from_the_read_model(session):
+    insert_product(session)
+    orderline_id = insert_order_line(session)
+    insert_batch(session, "later", eta="2011-01-02")
+    batch_id = insert_batch(session, "in-stock")
+    insert_allocation(session, orderline_id, batch_id)
+    session.execute(
+        "UPDATE batches SET _allocated_quantity=12 WHERE id=:id", dict(id=batch_id)
+    )
+    read_model.rebuild(session)
+
+    repo = repository.SqlAlchemyRepository(session)
+    availability = repo.availability("GENERIC-SOFA")
+
+    assert availability == (
+        model.BatchAvailability("in-stock", "GENERIC-SOFA", None, 88),
+        model.BatchAvailability("later", "GENERIC-SOFA", date(2011, 1, 2), 100),
+    )
+    assert not any(isinstance(o, model.Batch) for o in session.identity_map.values())
+
+
+def test_repository_reads_availability_for_several_skus_at_once(session):
+    session.execute(
+        "INSERT INTO availability (batchref, sku, eta, available_quantity) VALUES"
+        ' ("b1", "RED-SOFA", NULL, 10), ("b2", "BLUE-SOFA", NULL, 20)'
+    )
+
+    repo = repository.SqlAlchemyRepository(session)
+    availability = repo.availability_many(["RED-SOFA", "PINK-SOFA"])
+
+    assert availability == {
+        "RED-SOFA": (model.BatchAvailability("b1", "RED-SOFA", None, 10),),
+        "PINK-SOFA": (),
+    }
+
+
+def test_repository_adds_batches_in_bulk(session):
+    insert_product(session)
+    insert_batch(session, "batch1")
+    repo = repository.SqlAlchemyRepository(session)
+
+    added = repo.add_batches(
+        [
+            model.Batch("batch1", "GENERIC-SOFA", 100, eta=None),
+            model.Batch("batch2", "GENERIC-SOFA", 50, eta=date(2011, 1, 2)),
+            model.Batch("batch3", "NEW-SOFA", 10, eta=None),
+        ]
+    )
+
+    assert added == 2
+    assert [b.reference for b in repo.get("GENERIC-SOFA").batches] == [
+        "batch1",
+        "batch2",
+    ]
+    assert repo.get("GENERIC-SOFA").version_number == 1
+    assert repo.availability("NEW-SOFA") == (
+        model.BatchAvailability("batch3", "NEW-SOFA", None, 10),
+    )
+
+
+def test_adding_batches_in_bulk_binds_at_most_999_parameters_per_query(session):
+    # SQLite before 3.32 refuses statements with more bound parameters
+    largest = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            largest.append(len(parameters))
+
+    event.listen(session.bind, "before_cursor_execute", record)
+    try:
+        added = repository.SqlAlchemyRepository(session).add_batches(
+            [model.Batch(f"batch{i}", f"SKU-{i}", 10, eta=None) for i in range(1200)]
+        )
+    finally:
+        event.remove(session.bind, "before_cursor_execute", record)
 
-    expected = model.Batch("batch1", "GENERIC-SOFA", 100, eta=None)
-    assert retrieved == expected
-    assert retrieved.sku == expected.sku
-    assert retrieved._purchased_quantity == expected._purchased_quantity
-    assert retrieved._allocations == {model.OrderLine("order1", "GENERIC-SOFA", 12)}
+    assert added == 1200
+    assert max(largest) <= 999
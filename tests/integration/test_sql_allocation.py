@@ -0,0 +1,106 @@
+import random
+from datetime import date
+from datetime import timedelta
+
+import pytest
+
+from domain import model
+from service_layer import services
+from service_layer import unit_of_work
+
+
+def random_scenario(seed):
+    rng = random.Random(seed)
+    skus = [f"SKU-{i}" for i in range(rng.randint(1, 3))]
+    batches = [
+        (
+            f"batch{i}",
+            rng.choice(skus),
+            rng.randint(1, 30),
+            # a narrow window, so that some ETAs tie
+            (
+                None
+                if rng.random() < 0.3
+                else date(2021, 1, 1) + timedelta(rng.randint(0, 4))
+            ),
+        )
+        for i in range(rng.randint(1, 8))
+    ]
+    lines = []
+    for i in range(rng.randint(1, 25)):
+        if lines and rng.random() < 0.15:
+            lines.append(rng.choice(lines))
+        else:
+            lines.append(
+                (f"order{i}", rng.choice(skus + ["UNKNOWN"]), rng.randint(1, 12))
+            )
+    return batches, lines
+
+
+def allocate_in_domain(batches, lines):
+    products = {}
+    for reference, sku, quantity, eta in batches:
+        products.setdefault(sku, model.Product(sku, batches=[]))
+        products[sku].add_batch(model.Batch(reference, sku, quantity, eta))
+    results = []
+    for line in lines:
+        product = products.get(line[1])
+        try:
+            if product is None:
+                raise services.InvalidSku()
+            results.append(product.allocate(model.OrderLine(*line)))
+        except (model.OutOfStock, services.InvalidSku) as e:
+            results.append(type(e).__name__)
+    available = {
+        b.reference: b.available_quantity
+        for p in products.values()
+        for b in p.batches
+    }
+    versions = {p.sku: p.version_number for p in products.values()}
+    return results, available, versions
+
+
+def allocate_in_sql(session_factory, batches, lines):
+    for reference, sku, quantity, eta in batches:
+        uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+        services.add_batch(reference, sku, quantity, eta, uow)
+    results = []
+    for line in lines:
+        uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+        try:
+            results.append(services.allocate_set_based(model.OrderLine(*line), uow))
+        except (model.OutOfStock, services.InvalidSku) as e:
+            results.append(type(e).__name__)
+    session = session_factory()
+    available = dict(
+        session.execute(
+            "SELECT reference, _purchased_quantity - _allocated_quantity FROM batches"
+        ).all()
+    )
+    read_model = dict(
+        session.execute("SELECT batchref, available_quantity FROM availability").all()
+    )
+    versions = dict(session.execute("SELECT sku, version_number FROM products").all())
+    assert read_model == available
+    return results, available, versions
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_set_based_allocation_matches_the_domain(session_factory, seed):
+    batches, lines = random_scenario(seed)
+
+    assert allocate_in_sql(session_factory, batches, lines) == allocate_in_domain(
+        batches, lines
+    )
+
+
+def test_set_based_allocation_records_the_line(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    services.add_batch("batch1", "SMALL-TABLE", 10, None, uow)
+
+    services.allocate_set_based(model.OrderLine("o1", "SMALL-TABLE", 4), uow)
+
+    with uow:
+        product = uow.products.get("SMALL-TABLE")
+        assert product.batches[0].allocation_for("o1", "SMALL-TABLE") is not None
+        assert product.batches[0].available_quantity == 6
@@ -0,0 +1,200 @@
+import pytest
+
+from domain import model
+from adapters import read_model
+from adapters.cache import LRUCache
+from service_layer import unit_of_work
+
+
+def insert_batch(session, reference, sku, quantity, eta):
+    session.execute(
+        "INSERT INTO products (sku, version_number) VALUES (:sku, 0)", dict(sku=sku)
+    )
+    session.execute(
+        "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+        " VALUES (:reference, :sku, :quantity, :eta)",
+        dict(reference=reference, sku=sku, quantity=quantity, eta=eta),
+    )
+
+
+def get_allocated_batch_ref(session, order_reference, sku):
+    [[orderline_id]] = session.execute(
+        "SELECT id FROM order_lines WHERE order_reference=:order_reference AND sku=:sku",
+        dict(order_reference=order_reference, sku=sku),
+    )
+    [[batchref]] = session.execute(
+        "SELECT b.reference FROM allocations JOIN batches AS b ON batch_id = b.id"
+        " WHERE orderline_id=:orderline_id",
+        dict(orderline_id=orderline_id),
+    )
+    return batchref
+
+
+def test_uow_can_retrieve_a_product_and_allocate_to_it(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "HIPSTER-WORKBENCH", 100, None)
+    session.commit()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        product = uow.products.get(sku="HIPSTER-WORKBENCH")
+        product.allocate(model.OrderLine("o1", "HIPSTER-WORKBENCH", 10))
+        uow.commit()
+
+    batchref = get_allocated_batch_ref(session, "o1", "HIPSTER-WORKBENCH")
+    assert batchref == "batch1"
+
+
+def test_rolls_back_uncommitted_work_by_default(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        insert_batch(uow.session, "batch1", "MEDIUM-PLINTH", 100, None)
+
+    new_session = session_factory()
+    rows = list(new_session.execute('SELECT * FROM "batches"'))
+    assert rows == []
+
+
+def test_rolls_back_on_error(session_factory):
+    class MyException(Exception):
+        pass
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with pytest.raises(MyException):
+        with uow:
+            insert_batch(uow.session, "batch1", "LARGE-FORK", 100, None)
+            raise MyException()
+
+    new_session = session_factory()
+    rows = list(new_session.execute('SELECT * FROM "batches"'))
+    assert rows == []
+
+
+def test_nested_blocks_commit_once_with_the_outermost_block(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    with uow:
+        with uow:
+            insert_batch(uow.session, "batch1", "SMALL-FORK", 100, None)
+            uow.commit()
+        with uow:
+            insert_batch(uow.session, "batch2", "LARGE-FORK", 100, None)
+            uow.commit()
+        assert list(sqlite_session_factory().execute('SELECT * FROM "batches"')) == []
+        uow.commit()
+
+    rows = sqlite_session_factory().execute('SELECT reference FROM "batches"')
+    assert sorted(rows) == [("batch1",), ("batch2",)]
+
+
+def test_stale_commits_raise_version_conflict(sqlite_session_factory):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "WOBBLY-STOOL", 100, None)
+    session.commit()
+    uow1 = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    uow2 = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+
+    with uow1, uow2:
+        product1 = uow1.products.get("WOBBLY-STOOL")
+        product2 = uow2.products.get("WOBBLY-STOOL")
+        product1.allocate(model.OrderLine("order1", "WOBBLY-STOOL", 10))
+        product2.allocate(model.OrderLine("order2", "WOBBLY-STOOL", 10))
+        uow2.commit()
+
+        with pytest.raises(unit_of_work.VersionConflict):
+            uow1.commit()
+
+
+def test_commits_invalidate_cached_availability_for_changed_skus(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "GOLDEN-LAMP", 100, None)
+    insert_batch(session, "batch2", "SILVER-LAMP", 100, None)
+    read_model.rebuild(session)
+    session.commit()
+    cache = LRUCache()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, cache=cache)
+
+    with uow:
+        [golden] = uow.products.availability("GOLDEN-LAMP")
+        [silver] = uow.products.availability("SILVER-LAMP")
+    assert golden.available_quantity == silver.available_quantity == 100
+
+    with uow:
+        product = uow.products.get("GOLDEN-LAMP")
+        product.allocate(model.OrderLine("o1", "GOLDEN-LAMP", 10))
+        uow.commit()
+
+    with uow:
+        [golden] = uow.products.availability("GOLDEN-LAMP")
+        [silver] = uow.products.availability("SILVER-LAMP")
+    assert golden.available_quantity == 90
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["invalidations"] == 1
+
+
+def get_availability_rows(session, sku):
+    return list(
+        session.execute(
+            "SELECT batchref, available_quantity FROM availability WHERE sku=:sku"
+            " ORDER BY batchref",
+            dict(sku=sku),
+        )
+    )
+
+
+def test_commit_keeps_the_availability_read_model_up_to_date(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    with uow:
+        product = model.Product("DAINTY-CUP", [])
+        product.add_batch(model.Batch("batch1", "DAINTY-CUP", 100, eta=None))
+        uow.products.add(product)
+        uow.commit()
+
+    session = sqlite_session_factory()
+    assert get_availability_rows(session, "DAINTY-CUP") == [("batch1", 100)]
+
+    with uow:
+        product = uow.products.get("DAINTY-CUP")
+        product.allocate(model.OrderLine("o1", "DAINTY-CUP", 10))
+        product.add_batch(model.Batch("batch2", "DAINTY-CUP", 5, eta=None))
+        uow.commit()
+
+    assert get_availability_rows(session, "DAINTY-CUP") == [
+        ("batch1", 90),
+        ("batch2", 5),
+    ]
+
+    with uow:
+        product = uow.products.get("DAINTY-CUP")
+        product.deallocate("o1")
+
+    assert get_availability_rows(session, "DAINTY-CUP") == [
+        ("batch1", 90),
+        ("batch2", 5),
+    ]
+
+
+def test_commit_writes_domain_events_to_the_outbox(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "HIPSTER-WORKBENCH", 10, None)
+    session.commit()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        product = uow.products.get(sku="HIPSTER-WORKBENCH")
+        product.allocate(model.OrderLine("o1", "HIPSTER-WORKBENCH", 10))
+        uow.commit()
+    with uow:
+        product = uow.products.get(sku="HIPSTER-WORKBENCH")
+        product.deallocate("o1")
+
+    rows = list(
+        session.execute("SELECT event_type, payload, published_at FROM outbox")
+    )
+    assert rows == [
+        (
+            "Allocated",
+            '{"order_reference": "o1", "sku": "HIPSTER-WORKBENCH",'
+            ' "quantity": 10, "batchref": "batch1"}',
+            None,
+        )
+    ]
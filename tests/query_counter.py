@@ -0,0 +1,60 @@
+import functools
+from contextlib import contextmanager
+from typing import Callable
+from typing import Iterator
+
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """Records the SQL statements an engine sends while ``record`` is active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @contextmanager
+    def record(self) -> Iterator[list[str]]:
+        statements: list[str] = []
+
+        def receive(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", receive)
+        try:
+            yield statements
+        finally:
+            event.remove(self.engine, "before_cursor_execute", receive)
+
+    @contextmanager
+    def at_most(self, budget: int, name: str = "block") -> Iterator[list[str]]:
+        with self.record() as statements:
+            yield statements
+        if len(statements) > budget:
+            raise QueryBudgetExceeded(
+                f"{name} ran {len(statements)} statements, over its budget of"
+                f" {budget}:\n" + "\n".join(statements)
+            )
+
+    def budget(self, budget: int) -> Callable[[Callable], Callable]:
+        """Decorates a function so that every call fails once it sends more
+        than ``budget`` statements."""
+
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.at_most(budget, function.__qualname__):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+
+def summary(statement: str) -> str:
+    # the verb and the table, such as "INSERT order_lines"
+    words = statement.split()
+    return f"{words[0]} {words[2]}"
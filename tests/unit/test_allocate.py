@@ -2,10 +2,13 @@ from datetime import date
 from datetime import timedelta
 import pytest
 
+from domain import events
 from domain.model import allocate
 from domain.model import Batch
+from domain.model import BatchIndex
 from domain.model import OrderLine
 from domain.model import OutOfStock
+from domain.model import Product
 
 today = date.today()
 tomorrow = today + timedelta(days=1)
@@ -42,3 +45,162 @@ def test_raises_out_of_stock_exception_if_cannot_allocate():
 
     with pytest.raises(OutOfStock, match="SMALL-FORK"):
         allocate(OrderLine("order2", "SMALL-FORK", 1), [batch])
+
+
+def test_allocate__ignores_batches_for_other_skus():
+    other_sku_batch = Batch("other-batch", "RETRO-LAMP", 100, eta=None)
+    shipment_batch = Batch("shipment-batch", "RETRO-CLOCK", 100, eta=tomorrow)
+    line = OrderLine("oref", "RETRO-CLOCK", 10)
+
+    assert allocate(line, [other_sku_batch, shipment_batch]) == "shipment-batch"
+    assert other_sku_batch.available_quantity == 100
+
+
+def test_batch_index__keeps_batches_in_eta_order_with_warehouse_stock_first():
+    medium = Batch("normal-batch", "MINIMALIST-SPOON", 100, eta=tomorrow)
+    latest = Batch("slow-batch", "MINIMALIST-SPOON", 100, eta=later)
+    index = BatchIndex([latest, medium])
+
+    earliest = Batch("speedy-batch", "MINIMALIST-SPOON", 100, eta=today)
+    in_stock = Batch("in-stock-batch", "MINIMALIST-SPOON", 100, eta=None)
+    index.add(earliest)
+    index.add(in_stock)
+
+    assert index.for_sku("MINIMALIST-SPOON") == [in_stock, earliest, medium, latest]
+    assert index.for_sku("UNKNOWN-SKU") == []
+
+
+def test_allocate__accepts_a_prebuilt_batch_index():
+    earliest = Batch("speedy-batch", "MINIMALIST-SPOON", 10, eta=today)
+    medium = Batch("normal-batch", "MINIMALIST-SPOON", 100, eta=tomorrow)
+    index = BatchIndex([medium, earliest])
+
+    assert (
+        allocate(OrderLine("oref1", "MINIMALIST-SPOON", 10), index) == "speedy-batch"
+    )
+    assert (
+        allocate(OrderLine("oref2", "MINIMALIST-SPOON", 10), index) == "normal-batch"
+    )
+
+
+def test_product_keeps_batches_in_eta_order():
+    medium = Batch("normal-batch", "MINIMALIST-SPOON", 100, eta=tomorrow)
+    product = Product("MINIMALIST-SPOON", [medium])
+    in_stock = Batch("in-stock-batch", "MINIMALIST-SPOON", 100, eta=None)
+    earliest = Batch("speedy-batch", "MINIMALIST-SPOON", 100, eta=today)
+
+    product.add_batch(in_stock)
+    product.add_batch(earliest)
+
+    assert product.batches == [in_stock, earliest, medium]
+
+
+def test_product_index_shares_its_batches_without_sorting_them_again():
+    in_stock = Batch("in-stock-batch", "RETRO-CLOCK", 100, eta=None)
+    shipment = Batch("shipment-batch", "RETRO-CLOCK", 100, eta=tomorrow)
+    product = Product("RETRO-CLOCK", [shipment, in_stock])
+
+    assert product.index.for_sku("RETRO-CLOCK") is product.batches
+    assert product.allocate(OrderLine("oref", "RETRO-CLOCK", 10)) == "in-stock-batch"
+
+
+def test_product_increments_version_number_on_changes():
+    batch = Batch("b1", "SCANDI-PEN", 100, eta=None)
+    product = Product("SCANDI-PEN", [batch], version_number=7)
+
+    product.allocate(OrderLine("oref", "SCANDI-PEN", 10))
+    assert product.version_number == 8
+
+    product.deallocate("oref")
+    assert product.version_number == 9
+
+
+def test_product_does_not_increment_version_number_when_out_of_stock():
+    batch = Batch("b1", "SCANDI-PEN", 10, eta=None)
+    product = Product("SCANDI-PEN", [batch], version_number=3)
+
+    with pytest.raises(OutOfStock):
+        product.allocate(OrderLine("oref", "SCANDI-PEN", 11))
+    assert product.version_number == 3
+
+
+def test_product_records_allocation_events():
+    batch = Batch("b1", "SCANDI-PEN", 10, eta=None)
+    product = Product("SCANDI-PEN", [batch])
+
+    product.allocate(OrderLine("o1", "SCANDI-PEN", 10))
+    with pytest.raises(OutOfStock):
+        product.allocate(OrderLine("o2", "SCANDI-PEN", 1))
+    product.deallocate("o1")
+
+    assert product.events == [
+        events.Allocated("o1", "SCANDI-PEN", 10, "b1"),
+        events.OutOfStock("o2", "SCANDI-PEN", 1),
+        events.Deallocated("o1", "SCANDI-PEN", "b1"),
+    ]
+
+
+def test_shrinking_a_batch_deallocates_only_the_newest_lines_it_cannot_hold():
+    batch = Batch("b1", "SCANDI-PEN", 20, eta=None)
+    product = Product("SCANDI-PEN", [batch])
+    for reference in ("o1", "o2", "o3", "o4"):
+        product.allocate(OrderLine(reference, "SCANDI-PEN", 5))
+
+    moved = product.change_batch_quantity("b1", 12)
+
+    assert [line.order_reference for line, _ in moved] == ["o3", "o4"]
+    assert batch.available_quantity == 2
+    assert batch.can_deallocate("o2", "SCANDI-PEN")
+
+
+def test_lines_moved_off_a_batch_are_reallocated_to_the_other_batches():
+    in_stock = Batch("b1", "SCANDI-PEN", 10, eta=None)
+    shipment = Batch("b2", "SCANDI-PEN", 5, eta=tomorrow)
+    product = Product("SCANDI-PEN", [in_stock, shipment], version_number=1)
+    for reference in ("o1", "o2", "o3"):
+        product.allocate(OrderLine(reference, "SCANDI-PEN", 3))
+    product.events.clear()
+
+    moved = product.change_batch_quantity("b1", 3)
+
+    assert [(line.order_reference, r) for line, r in moved[:1]] == [("o2", "b2")]
+    assert moved[1][0].order_reference == "o3"
+    assert isinstance(moved[1][1], OutOfStock)
+    assert product.version_number == 5
+    assert product.events == [
+        events.BatchQuantityChanged("b1", "SCANDI-PEN", 3),
+        events.Deallocated("o3", "SCANDI-PEN", "b1"),
+        events.Deallocated("o2", "SCANDI-PEN", "b1"),
+        events.Allocated("o2", "SCANDI-PEN", 3, "b2"),
+        events.OutOfStock("o3", "SCANDI-PEN", 3),
+    ]
+
+
+def test_lines_that_still_fit_the_shrunk_batch_stay_in_it():
+    in_stock = Batch("b1", "SCANDI-PEN", 10, eta=None)
+    shipment = Batch("b2", "SCANDI-PEN", 6, eta=tomorrow)
+    product = Product("SCANDI-PEN", [in_stock, shipment])
+    for reference, quantity in [("o1", 6), ("o3", 1), ("o5", 2)]:
+        product.allocate(OrderLine(reference, "SCANDI-PEN", quantity))
+    product.events.clear()
+
+    moved = product.change_batch_quantity("b1", 3)
+
+    assert [(line.order_reference, r) for line, r in moved] == [("o1", "b2")]
+    assert in_stock.can_deallocate("o3", "SCANDI-PEN")
+    assert in_stock.can_deallocate("o5", "SCANDI-PEN")
+    assert in_stock.available_quantity == 0
+    assert product.events == [
+        events.BatchQuantityChanged("b1", "SCANDI-PEN", 3),
+        events.Deallocated("o1", "SCANDI-PEN", "b1"),
+        events.Allocated("o1", "SCANDI-PEN", 6, "b2"),
+    ]
+
+
+def test_growing_a_batch_moves_no_lines():
+    batch = Batch("b1", "SCANDI-PEN", 10, eta=None)
+    product = Product("SCANDI-PEN", [batch])
+    product.allocate(OrderLine("o1", "SCANDI-PEN", 10))
+
+    assert product.change_batch_quantity("b1", 15) == []
+    assert batch.available_quantity == 5
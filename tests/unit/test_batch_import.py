@@ -0,0 +1,87 @@
+import io
+from datetime import date
+
+import pytest
+
+from adapters.batch_files import read_batches
+from service_layer.batch_import import InvalidBatchRow
+from service_layer.batch_import import import_batches
+from service_layer.batch_import import parse_batch_row
+from tests.fakes import FakeUnitOfWork
+
+CSV = """reference,sku,quantity,eta
+b1,RED-CHAIR,10,
+b2,RED-CHAIR,20,2011-01-02
+b3,BLUE-TABLE,5,
+b2,RED-CHAIR,20,2011-01-02
+b4,BLUE-TABLE,lots,
+"""
+
+
+def test_reads_rows_with_their_line_numbers():
+    jsonl = '{"reference": "b1", "sku": "S", "quantity": 1}\n\nnot json\n[1]\n'
+
+    assert [n for n, _ in read_batches(io.StringIO(CSV), "csv")] == [2, 3, 4, 5, 6]
+    assert list(read_batches(io.StringIO(jsonl), "jsonl")) == [
+        (1, {"reference": "b1", "sku": "S", "quantity": 1}),
+        (3, None),
+        (4, None),
+    ]
+
+
+def test_parses_a_row_into_a_batch():
+    batch = parse_batch_row(
+        {"reference": "b1", "sku": "RED-CHAIR", "quantity": "10", "eta": "2011-01-02"}
+    )
+
+    assert (batch.reference, batch.sku, batch.eta) == (
+        "b1",
+        "RED-CHAIR",
+        date(2011, 1, 2),
+    )
+    assert batch.available_quantity == 10
+
+
+def test_imports_valid_rows_and_reports_the_rest():
+    uow = FakeUnitOfWork()
+
+    report = import_batches(read_batches(io.StringIO(CSV), "csv"), uow, chunk_size=2)
+
+    # the repeated b2 lands in the second chunk, after b2 was stored
+    assert (
+        report.rows,
+        report.imported,
+        report.duplicates,
+        report.already_present,
+        report.invalid,
+    ) == (5, 3, 0, 1, 1)
+    assert report.errors == [(6, "invalid quantity 'lots'")]
+    assert [b.reference for b in uow.products.get("RED-CHAIR").batches] == [
+        "b1",
+        "b2",
+    ]
+    assert uow.commits == 2
+
+
+def test_counts_a_reference_repeated_within_a_chunk_as_a_duplicate():
+    uow = FakeUnitOfWork()
+
+    report = import_batches(read_batches(io.StringIO(CSV), "csv"), uow)
+
+    assert (report.imported, report.duplicates, report.already_present) == (3, 1, 0)
+    assert uow.commits == 1
+
+
+def test_rejects_a_row_without_a_quantity():
+    with pytest.raises(InvalidBatchRow, match="missing quantity"):
+        parse_batch_row({"reference": "b1", "sku": "RED-CHAIR"})
+
+
+def test_rerunning_an_import_skips_batches_already_stored():
+    uow = FakeUnitOfWork()
+    import_batches(read_batches(io.StringIO(CSV), "csv"), uow)
+
+    report = import_batches(read_batches(io.StringIO(CSV), "csv"), uow)
+
+    assert (report.imported, report.already_present) == (0, 3)
+    assert len(uow.products.get("BLUE-TABLE").batches) == 1
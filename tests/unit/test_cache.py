@@ -0,0 +1,122 @@
+import threading
+
+from adapters.cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_returns_cached_value_until_it_expires():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=10, ttl=5, clock=clock)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get_or_load("sku1", load) == 1
+    clock.now = 4
+    assert cache.get_or_load("sku1", load) == 1
+    clock.now = 6
+    assert cache.get_or_load("sku1", load) == 2
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_evicts_least_recently_used_entries():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.get_or_load("sku1", lambda: 1)
+    cache.get_or_load("sku2", lambda: 2)
+    cache.get_or_load("sku1", lambda: "unused")
+    cache.get_or_load("sku3", lambda: 3)
+
+    assert cache.get_or_load("sku1", lambda: "reloaded") == 1
+    assert cache.get_or_load("sku2", lambda: "reloaded") == "reloaded"
+    assert cache.stats()["evictions"] == 2
+
+
+def test_invalidation_forces_a_reload():
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.get_or_load("sku1", lambda: "old")
+
+    cache.invalidate("sku1")
+
+    assert cache.get_or_load("sku1", lambda: "new") == "new"
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_does_not_cache_a_value_invalidated_while_loading():
+    cache = LRUCache(maxsize=10, ttl=60)
+    loading, invalidated = threading.Event(), threading.Event()
+
+    def slow_load():
+        loading.set()
+        invalidated.wait()
+        return "stale"
+
+    reader = threading.Thread(target=cache.get_or_load, args=("sku1", slow_load))
+    reader.start()
+    loading.wait()
+    cache.invalidate("sku1")
+    invalidated.set()
+    reader.join()
+
+    assert cache.get_or_load("sku1", lambda: "fresh") == "fresh"
+
+
+def test_invalidations_leave_no_bookkeeping_behind():
+    cache = LRUCache(maxsize=10, ttl=60)
+    loading, invalidated = threading.Event(), threading.Event()
+
+    def slow_load():
+        loading.set()
+        invalidated.wait()
+        return "stale"
+
+    reader = threading.Thread(target=cache.get_or_load, args=("sku1", slow_load))
+    reader.start()
+    loading.wait()
+    for key in ("sku1", "sku2", "sku3"):
+        cache.invalidate(key)
+    invalidated.set()
+    reader.join()
+
+    assert cache._generations == {} and cache._loading == {}
+
+
+def test_loads_only_missing_keys_in_one_call():
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.get_or_load("sku1", lambda: 1)
+    calls = []
+
+    def load_many(keys):
+        calls.append(keys)
+        return {key: key.upper() for key in keys}
+
+    found = cache.get_many_or_load(["sku1", "sku2", "sku3"], load_many)
+
+    assert found == {"sku1": 1, "sku2": "SKU2", "sku3": "SKU3"}
+    assert calls == [["sku2", "sku3"]]
+    assert cache.get_many_or_load(["sku2", "sku3"], load_many) == {
+        "sku2": "SKU2",
+        "sku3": "SKU3",
+    }
+    assert len(calls) == 1
+
+
+def test_get_and_put_values_that_expire():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=10, ttl=5, clock=clock)
+
+    cache.put("key", "value")
+
+    assert cache.get("key") == "value"
+    clock.now = 6
+    assert cache.get("key") is None
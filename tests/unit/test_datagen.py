@@ -0,0 +1,38 @@
+from benchmarks import datagen
+
+
+def test_generator_is_deterministic_for_a_seed():
+    spec = datagen.WarehouseSpec(skus=3, batches_per_sku=4)
+
+    def snapshot(products):
+        return [
+            (
+                b.reference,
+                b.eta,
+                b._purchased_quantity,
+                sorted(map(repr, b._allocations.values())),
+            )
+            for p in products
+            for b in p.batches
+        ]
+
+    assert snapshot(datagen.generate(spec)) == snapshot(datagen.generate(spec))
+    assert datagen.order_lines(spec, 5) == datagen.order_lines(spec, 5)
+
+
+def test_generator_follows_the_spec():
+    spec = datagen.WarehouseSpec(skus=5, batches_per_sku=20, allocation_density=0.5)
+
+    products = list(datagen.generate(spec))
+
+    assert [p.sku for p in products] == [datagen.sku_name(i) for i in range(5)]
+    batches = [b for p in products for b in p.batches]
+    assert len(batches) == 100
+    assert any(b.eta is None for b in batches)
+    assert any(b.eta is not None for b in batches)
+    for b in batches:
+        assert (
+            b.allocated_quantity
+            >= b._purchased_quantity // 2 - spec.max_line_quantity
+        )
+        assert b.allocated_quantity <= b._purchased_quantity
@@ -0,0 +1,186 @@
+from datetime import date
+
+import pytest
+
+from domain.model import Batch
+from domain.model import OrderLine
+from domain.model import OutOfStock
+from domain.model import Product
+from adapters.cache import LRUCache
+from adapters.repository import CachingRepository
+from service_layer.dispatcher import AllocationDispatcher
+from service_layer.services import ConcurrentUpdate
+from service_layer.services import DuplicateBatchReference
+from service_layer.services import InvalidBatchReference
+from service_layer.services import InvalidSku
+from tests.fakes import ConflictingUnitOfWork
+from tests.fakes import FakeUnitOfWork
+
+
+def test_allocations_for_a_sku_are_applied_in_order():
+    uow = FakeUnitOfWork.for_batches(Batch("b1", "BLUE-PLINTH", 20, eta=None))
+
+    with AllocationDispatcher(lambda: uow, workers=1) as dispatcher:
+        futures = [
+            dispatcher.allocate(OrderLine(f"o{i}", "BLUE-PLINTH", 10))
+            for i in range(3)
+        ]
+
+    assert [f.result() for f in futures[:2]] == ["b1", "b1"]
+    with pytest.raises(OutOfStock):
+        futures[2].result()
+
+
+def test_queued_commands_are_written_in_one_commit():
+    uow = FakeUnitOfWork.for_batches(Batch("b1", "BLUE-PLINTH", 100, eta=None))
+    dispatcher = AllocationDispatcher(lambda: uow, workers=1)
+    futures = [
+        dispatcher.allocate(OrderLine(f"o{i}", "BLUE-PLINTH", 1)) for i in range(10)
+    ]
+    futures.append(dispatcher.deallocate("o0", "BLUE-PLINTH"))
+
+    with dispatcher:
+        pass
+
+    assert [f.result() for f in futures] == ["b1"] * 11
+    assert uow.commits == 1
+
+
+def test_a_sku_always_goes_to_the_same_worker():
+    dispatcher = AllocationDispatcher(FakeUnitOfWork, workers=8)
+
+    assert len({dispatcher.shard("BLUE-PLINTH") for _ in range(10)}) == 1
+
+
+def test_add_batch_creates_the_product():
+    uow = FakeUnitOfWork()
+
+    with AllocationDispatcher(lambda: uow, workers=1) as dispatcher:
+        dispatcher.add_batch("b1", "GARISH-RUG", 10, None).result()
+        batchref = dispatcher.allocate(OrderLine("o1", "GARISH-RUG", 10)).result()
+
+    assert batchref == "b1"
+    assert uow.products.get("GARISH-RUG").batches[0].available_quantity == 0
+
+
+def test_a_duplicate_batch_fails_only_its_own_command():
+    uow = FakeUnitOfWork()
+
+    with AllocationDispatcher(lambda: uow, workers=1) as dispatcher:
+        first = dispatcher.add_batch("b1", "GARISH-RUG", 10, None)
+        again = dispatcher.add_batch("b1", "GARISH-RUG", 20, None)
+
+    assert first.result() is None
+    with pytest.raises(DuplicateBatchReference):
+        again.result()
+    assert [b.available_quantity for b in uow.products.get("GARISH-RUG").batches] == [
+        10
+    ]
+
+
+def test_unknown_sku_fails_only_its_own_command():
+    uow = FakeUnitOfWork.for_batches(Batch("b1", "BLUE-PLINTH", 100, eta=None))
+    dispatcher = AllocationDispatcher(lambda: uow, workers=1)
+    bad = dispatcher.allocate(OrderLine("o1", "NONEXISTENTSKU", 10))
+    good = dispatcher.allocate(OrderLine("o1", "BLUE-PLINTH", 10))
+
+    with dispatcher:
+        pass
+
+    with pytest.raises(InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+        bad.result()
+    assert good.result() == "b1"
+
+
+def test_gives_up_after_too_many_concurrent_updates():
+    batch = Batch("b1", "OMINOUS-MIRROR", 100, eta=None)
+    uow = ConflictingUnitOfWork([Product("OMINOUS-MIRROR", [batch])], conflicts=100)
+
+    with AllocationDispatcher(lambda: uow, workers=1) as dispatcher:
+        future = dispatcher.allocate(OrderLine("o1", "OMINOUS-MIRROR", 10))
+
+    with pytest.raises(ConcurrentUpdate):
+        future.result()
+    assert uow.committed is False
+
+
+def test_bulk_allocations_are_split_by_sku_and_answered_in_order():
+    uow = FakeUnitOfWork.for_batches(
+        Batch("b1", "BLUE-PLINTH", 10, eta=None),
+        Batch("b2", "RED-PLINTH", 10, eta=None),
+    )
+    lines = [
+        OrderLine("o1", "RED-PLINTH", 10),
+        OrderLine("o1", "BLUE-PLINTH", 10),
+        OrderLine("o2", "RED-PLINTH", 10),
+        OrderLine("o1", "NONEXISTENTSKU", 10),
+    ]
+
+    with AllocationDispatcher(lambda: uow, workers=2) as dispatcher:
+        results = dispatcher.allocate_many(lines).result()
+        batchref = dispatcher.deallocate("o1", "RED-PLINTH").result()
+
+    assert results[:2] == ["b2", "b1"]
+    assert isinstance(results[2], OutOfStock)
+    assert isinstance(results[3], InvalidSku)
+    assert batchref == "b2"
+
+
+def test_orders_are_planned_by_the_workers_that_own_their_skus():
+    uow = FakeUnitOfWork.for_batches(
+        Batch("b1", "BLUE-PLINTH", 5, eta=None),
+        Batch("b2", "BLUE-PLINTH", 10, eta=date.today()),
+    )
+    lines = [OrderLine("o1", "BLUE-PLINTH", 5), OrderLine("o2", "BLUE-PLINTH", 5)]
+
+    with AllocationDispatcher(lambda: uow, workers=2) as dispatcher:
+        results = dispatcher.allocate_order(lines, "fewest_batches").result()
+
+    assert results == ["b2", "b2"]
+
+
+def test_change_batch_quantity_moves_lines_through_the_worker():
+    uow = FakeUnitOfWork.for_batches(
+        Batch("b1", "BLUE-PLINTH", 10, eta=None),
+        Batch("b2", "BLUE-PLINTH", 10, eta=date.today()),
+    )
+
+    with AllocationDispatcher(lambda: uow, workers=1) as dispatcher:
+        dispatcher.allocate(OrderLine("o1", "BLUE-PLINTH", 10)).result()
+        moved = dispatcher.change_batch_quantity("b1", "BLUE-PLINTH", 5).result()
+        unknown = dispatcher.change_batch_quantity("b9", "BLUE-PLINTH", 5)
+
+    assert moved == [(OrderLine("o1", "BLUE-PLINTH", 10), "b2")]
+    with pytest.raises(InvalidBatchReference):
+        unknown.result()
+
+
+def test_workers_keep_only_the_most_recently_used_products():
+    uow = FakeUnitOfWork.for_batches(
+        Batch("b1", "BLUE-PLINTH", 10, eta=None),
+        Batch("b2", "RED-PLINTH", 10, eta=None),
+    )
+    dispatcher = AllocationDispatcher(lambda: uow, workers=1, max_products=1)
+
+    with dispatcher:
+        dispatcher.allocate(OrderLine("o1", "BLUE-PLINTH", 1)).result()
+        dispatcher.allocate(OrderLine("o1", "RED-PLINTH", 1)).result()
+
+    [worker] = dispatcher._workers
+    assert list(worker.products) == ["RED-PLINTH"]
+    assert [p.sku for p in uow.products.seen] == ["RED-PLINTH"]
+
+
+def test_workers_with_a_caching_repository_keep_only_their_recent_products():
+    skus = [f"PLINTH-{i}" for i in range(5)]
+    uow = FakeUnitOfWork.for_batches(
+        *(Batch(f"b-{sku}", sku, 10, None) for sku in skus)
+    )
+    uow.products = CachingRepository(uow.repository, LRUCache())
+    dispatcher = AllocationDispatcher(lambda: uow, workers=1, max_products=2)
+
+    with dispatcher:
+        for sku in skus:
+            dispatcher.allocate(OrderLine("o1", sku, 1)).result()
+
+    assert {p.sku for p in uow.repository.seen} == {"PLINTH-3", "PLINTH-4"}
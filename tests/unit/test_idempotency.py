@@ -0,0 +1,115 @@
+import pytest
+
+from adapters import idempotency
+from adapters.idempotency import InMemoryIdempotencyStore
+from adapters.idempotency import KeyReused
+from adapters.idempotency import RequestInProgress
+from adapters.idempotency import outcome_for
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Endpoint:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+REQUEST = idempotency.fingerprint({"order_reference": "o1", "sku": "RED-CHAIR"})
+
+
+def test_repeated_requests_replay_the_first_outcome():
+    store = InMemoryIdempotencyStore()
+    endpoint = Endpoint(({"batchref": "b1"}, 201))
+
+    first, replayed_first = outcome_for(store, "k1", REQUEST, endpoint)
+    second, replayed_second = outcome_for(store, "k1", REQUEST, endpoint)
+
+    assert (second.body, second.status) == ({"batchref": "b1"}, 201)
+    assert second == first
+    assert (replayed_first, replayed_second) == (False, True)
+    assert endpoint.calls == 1
+
+
+def test_errors_are_replayed_too():
+    store = InMemoryIdempotencyStore()
+    endpoint = Endpoint(({"message": "Out of stock for sku RED-CHAIR"}, 400))
+
+    outcome_for(store, "k1", REQUEST, endpoint)
+    outcome, replayed = outcome_for(store, "k1", REQUEST, endpoint)
+
+    assert (outcome.status, replayed) == (400, True)
+    assert endpoint.calls == 1
+
+
+def test_concurrent_update_outcomes_are_not_kept():
+    store = InMemoryIdempotencyStore()
+    endpoint = Endpoint(({"message": "Gave up"}, 409), ({"batchref": "b1"}, 201))
+
+    outcome_for(store, "k1", REQUEST, endpoint)
+    outcome, replayed = outcome_for(store, "k1", REQUEST, endpoint)
+
+    assert (outcome.status, replayed) == (201, False)
+
+
+def test_a_request_repeated_while_the_first_runs_is_reported_in_progress():
+    store = InMemoryIdempotencyStore()
+    repeated = []
+
+    def endpoint():
+        with pytest.raises(RequestInProgress):
+            outcome_for(store, "k1", REQUEST, Endpoint(({"batchref": "b2"}, 201)))
+        repeated.append(True)
+        return {"batchref": "b1"}, 201
+
+    outcome, _ = outcome_for(store, "k1", REQUEST, endpoint)
+
+    assert repeated == [True]
+    assert outcome_for(store, "k1", REQUEST, endpoint) == (outcome, True)
+
+
+def test_a_request_that_raises_releases_its_key():
+    store = InMemoryIdempotencyStore()
+
+    def endpoint():
+        raise RuntimeError("database went away")
+
+    with pytest.raises(RuntimeError):
+        outcome_for(store, "k1", REQUEST, endpoint)
+    outcome, replayed = outcome_for(
+        store, "k1", REQUEST, Endpoint(({"batchref": "b1"}, 201))
+    )
+
+    assert (outcome.status, replayed) == (201, False)
+
+
+def test_a_key_cannot_be_reused_for_another_request():
+    store = InMemoryIdempotencyStore()
+    outcome_for(store, "k1", REQUEST, Endpoint(({"batchref": "b1"}, 201)))
+
+    other = idempotency.fingerprint({"order_reference": "o2", "sku": "RED-CHAIR"})
+    with pytest.raises(KeyReused):
+        outcome_for(store, "k1", other, Endpoint(({"batchref": "b1"}, 201)))
+
+
+def test_outcomes_expire_and_are_evicted():
+    clock = FakeClock()
+    store = InMemoryIdempotencyStore(maxsize=2, ttl=60, clock=clock)
+    endpoint = Endpoint(*[({"batchref": "b1"}, 201)] * 4)
+
+    for key in ("k1", "k2", "k3"):
+        outcome_for(store, key, REQUEST, endpoint)
+    assert store.get("k1") is None
+    clock.now = 61
+    assert store.get("k3") is None
+    assert endpoint.calls == 3
@@ -0,0 +1,48 @@
+from sqlalchemy import create_engine
+
+from adapters import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("latency", "Latency.", ["stage"], buckets=[0.1, 1])
+
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, stage="load")
+
+    assert histogram.render() == [
+        "# HELP latency Latency.",
+        "# TYPE latency histogram",
+        'latency_bucket{stage="load",le="0.1"} 2',
+        'latency_bucket{stage="load",le="1"} 3',
+        'latency_bucket{stage="load",le="+Inf"} 4',
+        'latency_sum{stage="load"} 3.65',
+        'latency_count{stage="load"} 4',
+    ]
+
+
+def test_span_records_the_stage_duration():
+    before = metrics.STAGE_SECONDS.count(stage="test.stage")
+
+    with metrics.span("test.stage"):
+        pass
+
+    assert metrics.STAGE_SECONDS.count(stage="test.stage") == before + 1
+
+
+def test_instrumented_engine_counts_statements_per_request():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    metrics.instrument_engine(engine)
+    before = metrics.SQL_STATEMENT_SECONDS.count(operation="SELECT")
+
+    stats = metrics.start_request()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1")
+        conn.exec_driver_sql("SELECT 2")
+    assert metrics.end_request() is stats
+
+    assert stats.statements == 2
+    assert metrics.SQL_STATEMENT_SECONDS.count(operation="SELECT") == before + 2
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 3")
+    assert stats.statements == 2
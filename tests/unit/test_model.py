@@ -50,3 +50,50 @@ def test_can_only_deallocate_allocated_lines():
     batch, line = make_batch_and_line("SMALL-TABLE", 20, 5)
     batch.deallocate(line)
     assert batch.available_quantity == 20
+
+
+def test_allocated_quantity_tracks_allocations_and_deallocations():
+    batch = Batch("batch-001", "SMALL-TABLE", 20, eta=None)
+    line1 = OrderLine("order-1", "SMALL-TABLE", 5)
+    line2 = OrderLine("order-2", "SMALL-TABLE", 3)
+
+    batch.allocate(line1)
+    batch.allocate(line2)
+    assert batch.allocated_quantity == 8
+
+    batch.deallocate(line1)
+    assert batch.allocated_quantity == 3
+
+
+def test_allocating_a_line_again_with_another_quantity_replaces_it():
+    batch = Batch("batch-001", "SMALL-TABLE", 20, eta=None)
+    batch.allocate(OrderLine("order-1", "SMALL-TABLE", 5))
+
+    batch.allocate(OrderLine("order-1", "SMALL-TABLE", 3))
+
+    assert batch.allocated_quantity == 3
+    assert batch.allocation_for("order-1", "SMALL-TABLE").quantity == 3
+
+
+def test_shrinking_a_batch_deallocates_the_most_recent_lines():
+    batch = Batch("batch-001", "SMALL-TABLE", 20, eta=None)
+    for i in range(3):
+        batch.allocate(OrderLine(f"order-{i}", "SMALL-TABLE", 1))
+
+    assert batch.change_purchased_quantity(1) == [
+        OrderLine("order-2", "SMALL-TABLE", 1),
+        OrderLine("order-1", "SMALL-TABLE", 1),
+    ]
+    assert batch.can_deallocate("order-0", "SMALL-TABLE")
+
+
+def test_can_deallocate_by_order_reference_and_sku():
+    batch, line = make_batch_and_line("SMALL-TABLE", 20, 5)
+    batch.allocate(line)
+
+    assert batch.can_deallocate("order-ref", "SMALL-TABLE")
+    assert batch.allocation_for("order-ref", "SMALL-TABLE") == line
+
+    batch.deallocate(line)
+    assert not batch.can_deallocate("order-ref", "SMALL-TABLE")
+    assert batch.allocation_for("order-ref", "SMALL-TABLE") is None
@@ -0,0 +1,124 @@
+from datetime import date
+from datetime import timedelta
+import pytest
+
+from domain import planner
+from domain.model import Batch
+from domain.model import BatchIndex
+from domain.model import OrderLine
+
+today = date.today()
+tomorrow = today + timedelta(days=1)
+later = tomorrow + timedelta(days=19)
+
+
+def lines(*quantities, sku="RETRO-CLOCK"):
+    return [OrderLine(f"o{i}", sku, q) for i, q in enumerate(quantities, 1)]
+
+
+def references(plan):
+    return [batch.reference if batch else None for _, batch in plan.allocations]
+
+
+def test_plans_the_earliest_date_the_whole_order_can_ship():
+    index = BatchIndex(
+        [
+            Batch("in-stock", "RETRO-CLOCK", 10, eta=None),
+            Batch("tomorrow", "RETRO-CLOCK", 10, eta=tomorrow),
+            Batch("later", "RETRO-CLOCK", 10, eta=later),
+        ]
+    )
+    order = lines(5, 6, 4, 5)
+
+    greedy = planner.plan(order, index, budget=0)
+    planned = planner.plan(order, index, planner.EARLIEST_SHIP_DATE)
+
+    assert (references(greedy), greedy.optimal) == (
+        ["in-stock", "tomorrow", "in-stock", "later"],
+        False,
+    )
+    assert "later" not in references(planned)
+    assert planned.optimal is True
+
+
+def test_plans_the_fewest_batches():
+    index = BatchIndex(
+        [
+            Batch("in-stock", "RETRO-CLOCK", 5, eta=None),
+            Batch("tomorrow", "RETRO-CLOCK", 5, eta=tomorrow),
+            Batch("later", "RETRO-CLOCK", 10, eta=later),
+        ]
+    )
+    order = lines(5, 5)
+
+    earliest = planner.plan(order, index, planner.EARLIEST_SHIP_DATE)
+    fewest = planner.plan(order, index, planner.FEWEST_BATCHES)
+
+    assert references(earliest) == ["in-stock", "tomorrow"]
+    assert references(fewest) == ["later", "later"]
+
+
+def test_leaves_as_few_lines_unallocated_as_it_can():
+    index = BatchIndex([Batch("in-stock", "RETRO-CLOCK", 10, eta=None)])
+
+    plan = planner.plan(lines(6, 5, 5), index)
+
+    assert references(plan) == [None, "in-stock", "in-stock"]
+
+
+def test_plans_lines_of_several_skus_in_one_pass():
+    index = BatchIndex(
+        [
+            Batch("clock", "RETRO-CLOCK", 10, eta=None),
+            Batch("lamp", "RED-LAMP", 10, eta=tomorrow),
+        ]
+    )
+    order = [OrderLine("o1", "RETRO-CLOCK", 1), OrderLine("o1", "RED-LAMP", 1)]
+
+    assert references(planner.plan(order, index)) == ["clock", "lamp"]
+
+
+def test_falls_back_to_the_greedy_plan_when_the_budget_runs_out():
+    ticks = iter(range(1000))
+    index = BatchIndex(
+        [
+            Batch("in-stock", "RETRO-CLOCK", 10, eta=None),
+            Batch("tomorrow", "RETRO-CLOCK", 10, eta=tomorrow),
+            Batch("later", "RETRO-CLOCK", 10, eta=later),
+        ]
+    )
+
+    plan = planner.plan(lines(5, 6, 4, 5), index, budget=3, clock=lambda: next(ticks))
+
+    assert references(plan) == ["in-stock", "tomorrow", "in-stock", "later"]
+    assert plan.optimal is False
+
+
+def test_lines_already_allocated_stay_where_they_are():
+    in_stock = Batch("in-stock", "RETRO-CLOCK", 10, eta=None)
+    shipment = Batch("tomorrow", "RETRO-CLOCK", 10, eta=tomorrow)
+    [line] = lines(10)
+    shipment.allocate(line)
+
+    plan = planner.plan([line], BatchIndex([in_stock, shipment]))
+
+    assert references(plan) == ["tomorrow"]
+
+
+def test_rejects_unknown_objectives():
+    with pytest.raises(ValueError):
+        planner.plan(lines(1), BatchIndex(), "cheapest")
+
+
+def test_plans_orders_with_more_lines_than_the_recursion_limit():
+    index = BatchIndex(
+        [
+            Batch("in-stock", "RETRO-CLOCK", 1100, eta=None),
+            Batch("tomorrow", "RETRO-CLOCK", 10, eta=tomorrow),
+        ]
+    )
+
+    plan = planner.plan(lines(*[1] * 1102), index, clock=lambda: 0.0)
+
+    assert references(plan).count("tomorrow") == 2
+    assert plan.optimal is True
@@ -2,110 +2,287 @@ from datetime import date
 from datetime import timedelta
 import pytest
 
+from domain import events
 from domain.model import Batch
+from domain.model import BatchAvailability
 from domain.model import OrderLine
+from domain.model import OutOfStock
+from domain.model import Product
 from domain.model import ReferenceAndSkuNotFound
-from adapters.repository import AbstractRepository
+from service_layer.services import add_batch
 from service_layer.services import allocate
+from service_layer.services import allocate_many
+from service_layer.services import allocate_order
+from service_layer.services import allocate_set_based
+from service_layer.services import availability
+from service_layer.services import availability_many
+from service_layer.services import change_batch_quantity
 from service_layer.services import deallocate
+from service_layer.services import ConcurrentUpdate
+from service_layer.services import DuplicateBatchReference
+from service_layer.services import InvalidBatchReference
 from service_layer.services import InvalidSku
+from tests.fakes import ConflictingUnitOfWork
+from tests.fakes import FakeUnitOfWork
 
 today = date.today()
 tomorrow = today + timedelta(days=1)
 later = tomorrow + timedelta(days=19)
 
 
-class FakeRepository(AbstractRepository):
-    def __init__(self, batches):
-        self._batches = set(batches)
+def test_add_batch_for_new_product():
+    uow = FakeUnitOfWork()
 
-    def add(self, batch):
-        self._batches.add(batch)
+    add_batch("b1", "CRUNCHY-ARMCHAIR", 100, None, uow)
 
-    def get(self, reference):
-        return next(b for b in self._batches if b.reference == reference)
+    assert uow.products.get("CRUNCHY-ARMCHAIR") is not None
+    assert uow.committed is True
 
-    def list(self):
-        return list(self._batches)
 
+def test_add_batch_for_existing_product():
+    uow = FakeUnitOfWork()
 
-class FakeSession:
-    commited = False
+    add_batch("b1", "GARISH-RUG", 100, None, uow)
+    add_batch("b2", "GARISH-RUG", 99, None, uow)
 
-    def commit(self):
-        self.commited = True
+    assert "b2" in [b.reference for b in uow.products.get("GARISH-RUG").batches]
+
+
+def test_add_batch_rejects_a_reference_already_taken():
+    uow = FakeUnitOfWork()
+    add_batch("b1", "GARISH-RUG", 100, None, uow)
+
+    with pytest.raises(DuplicateBatchReference, match="Duplicate batch reference b1"):
+        add_batch("b1", "CRUNCHY-ARMCHAIR", 10, None, uow)
+    assert uow.products.get("CRUNCHY-ARMCHAIR") is None
 
 
 def test_returns_allocation():
     line = OrderLine("o1", "COMPLICATED-LAMP", 10)
     batch = Batch("b1", "COMPLICATED-LAMP", 100, eta=None)
-    repo = FakeRepository([batch])
+    uow = FakeUnitOfWork.for_batches(batch)
 
-    result = allocate(line, repo, FakeSession())
+    result = allocate(line, uow)
     assert result == "b1"
 
 
 def test_error_for_invalid_sku():
     line = OrderLine("o1", "NONEXISTENTSKU", 10)
     batch = Batch("b1", "AREALSKU", 100, eta=None)
-    repo = FakeRepository([batch])
+    uow = FakeUnitOfWork.for_batches(batch)
 
     with pytest.raises(InvalidSku, match="Invalid sku NONEXISTENTSKU"):
-        allocate(line, repo, FakeSession())
+        allocate(line, uow)
 
 
 def test_commits():
     line = OrderLine("o1", "OMINOUS-MIRROR", 10)
     batch = Batch("b1", "OMINOUS-MIRROR", 100, eta=None)
-    repo = FakeRepository([batch])
-    session = FakeSession()
+    uow = FakeUnitOfWork.for_batches(batch)
+
+    allocate(line, uow)
+    assert uow.committed is True
 
-    allocate(line, repo, session)
-    assert session.commited is True
+
+def test_out_of_stock_is_committed_as_an_event_and_reported():
+    batch = Batch("b1", "OMINOUS-MIRROR", 5, eta=None)
+    uow = FakeUnitOfWork.for_batches(batch)
+
+    with pytest.raises(OutOfStock):
+        allocate(OrderLine("o1", "OMINOUS-MIRROR", 10), uow)
+
+    assert uow.commits == 1
+    assert uow.events == [events.OutOfStock("o1", "OMINOUS-MIRROR", 10)]
+
+
+def test_retries_allocation_after_a_concurrent_update():
+    line = OrderLine("o1", "OMINOUS-MIRROR", 10)
+    batch = Batch("b1", "OMINOUS-MIRROR", 100, eta=None)
+    uow = ConflictingUnitOfWork([Product("OMINOUS-MIRROR", [batch])], conflicts=2)
+
+    result = allocate(line, uow)
+
+    assert result == "b1"
+    assert uow.commits == 1
+
+
+def test_gives_up_after_too_many_concurrent_updates():
+    line = OrderLine("o1", "OMINOUS-MIRROR", 10)
+    batch = Batch("b1", "OMINOUS-MIRROR", 100, eta=None)
+    uow = ConflictingUnitOfWork([Product("OMINOUS-MIRROR", [batch])], conflicts=100)
+
+    with pytest.raises(ConcurrentUpdate):
+        allocate(line, uow)
+    assert uow.committed is False
+
+
+def test_set_based_allocation_falls_back_to_the_domain():
+    batch = Batch("b1", "OMINOUS-MIRROR", 100, eta=None)
+    uow = FakeUnitOfWork.for_batches(batch)
+
+    assert allocate_set_based(OrderLine("o1", "OMINOUS-MIRROR", 10), uow) == "b1"
+    assert batch.available_quantity == 90
+    assert uow.committed is True
+    with pytest.raises(InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+        allocate_set_based(OrderLine("o1", "NONEXISTENTSKU", 10), uow)
 
 
 def test_deallocate_decrements_available_quantity():
     batch = Batch("b1", "BLUE-PLINTH", 100, eta=None)
-    repo, session = FakeRepository([batch]), FakeSession()
+    uow = FakeUnitOfWork.for_batches(batch)
 
-    allocate(OrderLine("o1", "BLUE-PLINTH", 10), repo, session)
-    batch = repo.get(reference="b1")
+    allocate(OrderLine("o1", "BLUE-PLINTH", 10), uow)
     assert batch.available_quantity == 90
 
-    deallocate("o1", "BLUE-PLINTH", repo, session)
+    deallocate("o1", "BLUE-PLINTH", uow)
     assert batch.available_quantity == 100
 
 
 def test_trying_to_deallocate_unallocated_batch():
     batch = Batch("b1", "AREALSKU", 100, eta=None)
-    repo = FakeRepository([batch])
+    uow = FakeUnitOfWork.for_batches(batch)
 
     with pytest.raises(InvalidSku, match="Invalid sku NONEXISTENTSKU"):
-        deallocate("o1", "NONEXISTENTSKU", repo, FakeSession())
+        deallocate("o1", "NONEXISTENTSKU", uow)
 
 
 def test_trying_to_deallocate_incorrect_data_from_batch__reference():
     batch = Batch("b1", "BLUE-PLINTH", 100, eta=None)
-    repo, session = FakeRepository([batch]), FakeSession()
+    uow = FakeUnitOfWork.for_batches(batch)
 
-    allocate(OrderLine("o1", "BLUE-PLINTH", 10), repo, session)
-    batch = repo.get(reference="b1")
+    allocate(OrderLine("o1", "BLUE-PLINTH", 10), uow)
     assert batch.available_quantity == 90
 
     msg = "Order line not found for such reference NONEXISTENTREFERENCE and sku BLUE-PLINTH"
     with pytest.raises(ReferenceAndSkuNotFound, match=msg):
-        deallocate("NONEXISTENTREFERENCE", "BLUE-PLINTH", repo, session)
+        deallocate("NONEXISTENTREFERENCE", "BLUE-PLINTH", uow)
     assert batch.available_quantity == 90
 
 
 def test_trying_to_deallocate_incorrect_data_from_batch__sku():
     batch = Batch("b1", "BLUE-PLINTH", 100, eta=None)
-    repo, session = FakeRepository([batch]), FakeSession()
+    uow = FakeUnitOfWork.for_batches(batch)
 
-    allocate(OrderLine("o1", "BLUE-PLINTH", 10), repo, session)
-    batch = repo.get(reference="b1")
+    allocate(OrderLine("o1", "BLUE-PLINTH", 10), uow)
     assert batch.available_quantity == 90
 
     with pytest.raises(InvalidSku, match="Invalid sku NONEXISTENTSKU"):
-        deallocate("o1", "NONEXISTENTSKU", repo, session)
+        deallocate("o1", "NONEXISTENTSKU", uow)
+    assert batch.available_quantity == 90
+
+
+def test_allocate_many_returns_a_result_per_line_and_commits_once():
+    batch = Batch("b1", "BLUE-PLINTH", 15, eta=None)
+    other = Batch("b2", "RED-PLINTH", 100, eta=None)
+    uow = FakeUnitOfWork.for_batches(batch, other)
+    lines = [
+        OrderLine("o1", "BLUE-PLINTH", 10),
+        OrderLine("o1", "RED-PLINTH", 10),
+        OrderLine("o2", "BLUE-PLINTH", 10),
+        OrderLine("o1", "NONEXISTENTSKU", 10),
+    ]
+
+    results = allocate_many(lines, uow)
+
+    assert results[:2] == ["b1", "b2"]
+    assert isinstance(results[2], OutOfStock)
+    assert isinstance(results[3], InvalidSku)
+    assert str(results[3]) == "Invalid sku NONEXISTENTSKU"
+    assert batch.available_quantity == 5
+    assert uow.commits == 1
+
+
+def test_allocate_order_allocates_the_planned_batches_and_commits_once():
+    in_stock = Batch("b1", "BLUE-PLINTH", 5, eta=None)
+    shipment = Batch("b2", "BLUE-PLINTH", 5, eta=tomorrow)
+    container = Batch("b3", "BLUE-PLINTH", 10, eta=later)
+    uow = FakeUnitOfWork.for_batches(in_stock, shipment, container)
+    lines = [
+        OrderLine("o1", "BLUE-PLINTH", 5),
+        OrderLine("o1", "NONEXISTENTSKU", 5),
+        OrderLine("o2", "BLUE-PLINTH", 5),
+        OrderLine("o3", "BLUE-PLINTH", 5),
+    ]
+
+    results = allocate_order(lines, uow, objective="fewest_batches")
+
+    planned = [results[0], results[2], results[3]]
+    assert planned.count("b3") == 2 and len(set(planned)) == 2
+    assert isinstance(results[1], InvalidSku)
+    assert uow.commits == 1
+
+
+def test_allocate_order_reports_lines_no_batch_can_take():
+    batch = Batch("b1", "BLUE-PLINTH", 10, eta=None)
+    uow = FakeUnitOfWork.for_batches(batch)
+    lines = [OrderLine(f"o{q}", "BLUE-PLINTH", q) for q in (6, 5, 5)]
+
+    results = allocate_order(lines, uow)
+
+    assert isinstance(results[0], OutOfStock)
+    assert results[1:] == ["b1", "b1"]
+    assert events.OutOfStock("o6", "BLUE-PLINTH", 6) in uow.events
+
+
+def test_change_batch_quantity_reallocates_lines_and_commits_once():
+    in_stock = Batch("b1", "BLUE-PLINTH", 10, eta=None)
+    shipment = Batch("b2", "BLUE-PLINTH", 10, eta=tomorrow)
+    uow = FakeUnitOfWork.for_batches(in_stock, shipment)
+    allocate(OrderLine("o1", "BLUE-PLINTH", 5), uow)
+    allocate(OrderLine("o2", "BLUE-PLINTH", 5), uow)
+
+    moved = change_batch_quantity("b1", 5, uow)
+
+    assert moved == [(OrderLine("o2", "BLUE-PLINTH", 5), "b2")]
+    assert shipment.available_quantity == 5
+    assert uow.commits == 3
+    with pytest.raises(InvalidBatchReference, match="Invalid batch reference b9"):
+        change_batch_quantity("b9", 5, uow)
+
+
+def test_allocate_many_allocates_in_a_deterministic_order():
+    batch = Batch("b1", "BLUE-PLINTH", 10, eta=None)
+    lines = [OrderLine("o2", "BLUE-PLINTH", 10), OrderLine("o1", "BLUE-PLINTH", 10)]
+
+    results = allocate_many(lines, FakeUnitOfWork.for_batches(batch))
+
+    assert isinstance(results[0], OutOfStock)
+    assert results[1] == "b1"
+
+
+def test_several_operations_can_share_one_commit():
+    batch = Batch("b1", "BLUE-PLINTH", 100, eta=None)
+    uow = FakeUnitOfWork.for_batches(batch)
+
+    with uow:
+        allocate(OrderLine("o1", "BLUE-PLINTH", 10), uow)
+        allocate(OrderLine("o2", "BLUE-PLINTH", 10), uow)
+        deallocate("o1", "BLUE-PLINTH", uow)
+        assert uow.commits == 0
+        uow.commit()
+
+    assert uow.commits == 1
     assert batch.available_quantity == 90
+
+
+def test_availability_lists_batches_with_their_available_quantity():
+    in_stock = Batch("b1", "BLUE-PLINTH", 100, eta=None)
+    shipment = Batch("b2", "BLUE-PLINTH", 50, eta=tomorrow)
+    uow = FakeUnitOfWork.for_batches(shipment, in_stock)
+    allocate(OrderLine("o1", "BLUE-PLINTH", 10), uow)
+
+    assert availability("BLUE-PLINTH", uow) == (
+        BatchAvailability("b1", "BLUE-PLINTH", None, 90),
+        BatchAvailability("b2", "BLUE-PLINTH", tomorrow, 50),
+    )
+    assert availability("NONEXISTENTSKU", uow) == ()
+
+
+def test_availability_many_reports_each_requested_sku():
+    batch = Batch("b1", "BLUE-PLINTH", 100, eta=None)
+    uow = FakeUnitOfWork.for_batches(batch)
+
+    assert availability_many(["BLUE-PLINTH", "NONEXISTENTSKU"], uow) == {
+        "BLUE-PLINTH": (BatchAvailability("b1", "BLUE-PLINTH", None, 100),),
+        "NONEXISTENTSKU": (),
+    }